@@ -0,0 +1,120 @@
+#OS imports
+import os
+import time
+import logging
+
+#Vector maths
+import numpy as np
+
+#An inverted file (IVF) index over the rows of the numpy vector store.
+#Rows are grouped under their nearest of nlist centroids (spherical k-means on the unit vectors), a query
+#scores the centroids and then only the rows in the nprobe nearest lists, so it reads nprobe/nlist of the matrix.
+#nprobe is the accuracy/speed knob: nprobe == nlist is exact search, smaller is faster and may miss neighbours.
+#0 nlist picks about 4 * sqrt(rows), the usual starting point.
+ivf_nlist = int(os.getenv('IVF_NLIST', 0))
+ivf_nprobe = int(os.getenv('IVF_NPROBE', 8))
+ivf_iterations = int(os.getenv('IVF_ITERATIONS', 10))
+#k-means trains on a sample, a few hundred rows per list is plenty to place the centroids
+ivf_train_sample = int(os.getenv('IVF_TRAIN_SAMPLE', 50000))
+
+logger = logging.getLogger(__name__)
+
+#Saved next to vectors.f32
+INDEX_FILE = 'ivf.npz'
+
+def default_nlist(rows):
+    return max(1, min(rows, int(4 * np.sqrt(rows))))
+
+#Nearest centroid for each (unit) row, in chunks so the score matrix stays small.
+def nearest_centroids(vectors, centroids, chunk=4096):
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        assignments[start:start + chunk] = np.argmax(np.asarray(vectors[start:start + chunk]) @ centroids.T, axis=1)
+    return assignments
+
+#Spherical k-means: centroids are kept unit length so a dot product ranks them the same way it ranks rows.
+def train_centroids(vectors, nlist, iterations=ivf_iterations, sample=ivf_train_sample, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = len(vectors)
+    if rows > sample:
+        vectors = np.asarray(vectors[np.sort(rng.choice(rows, sample, replace=False))])
+    else:
+        vectors = np.asarray(vectors)
+
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=nlist > len(vectors))].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=nlist)
+
+        #An empty list takes a random row so every centroid stays in use
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=len(empty) > len(vectors))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = (sums / np.where(norms == 0, 1, norms)).astype(np.float32)
+    return centroids
+
+class IVFIndex:
+    def __init__(self, centroids, assignments, nprobe=ivf_nprobe):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self.nprobe = nprobe
+        self._build_lists()
+
+    #The lists as one array of row numbers ordered by list, with offsets[i]:offsets[i+1] the rows of list i.
+    def _build_lists(self):
+        self.order = np.argsort(self.assignments, kind='stable').astype(np.int64)
+        self.offsets = np.searchsorted(self.assignments[self.order], np.arange(len(self.centroids) + 1))
+
+    def __len__(self):
+        return len(self.assignments)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, matrix, nlist=None, nprobe=ivf_nprobe, iterations=ivf_iterations, seed=0):
+        started = time.perf_counter()
+        nlist = min(nlist or ivf_nlist or default_nlist(len(matrix)), len(matrix))
+        centroids = train_centroids(matrix, nlist, iterations, seed=seed)
+        index = cls(centroids, nearest_centroids(matrix, centroids), nprobe)
+        logger.info(f'Trained {nlist} lists over {len(matrix)} rows in {time.perf_counter() - started:.2f}s')
+        return index
+
+    #New rows go into the list of their nearest centroid, the centroids themselves are not moved.
+    #Retrain once the corpus has grown well past what the centroids were trained on.
+    def add(self, vectors):
+        if len(vectors):
+            self.assignments = np.concatenate([self.assignments, nearest_centroids(vectors, self.centroids)])
+            self._build_lists()
+
+    #query_vectors must be unit length. Returns a list per query of (row, score) pairs, best first.
+    def search_batch(self, matrix, query_vectors, k=4, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = query_vectors @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query, probe in zip(query_vectors, probes):
+            rows = np.sort(np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe]))
+            if not len(rows):
+                results.append([])
+                continue
+            scores = matrix[rows] @ query
+            count = min(k, len(rows))
+            best = np.argpartition(-scores, count - 1)[:count]
+            best = best[np.argsort(-scores[best])]
+            results.append([(int(rows[i]), float(scores[i])) for i in best])
+        return results
+
+    def save(self, path):
+        temp_path = path + '.tmp.npz'
+        np.savez(temp_path, centroids=self.centroids, assignments=self.assignments)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, nprobe=ivf_nprobe):
+        with np.load(path) as data:
+            return cls(data["centroids"], data["assignments"], nprobe)
@@ -0,0 +1,605 @@
+#OS imports
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import sqlite3
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+#Vector maths
+import numpy as np
+
+data_directory= os.getenv('DATA_DIRECTORY', './data')
+data_pre_processed= os.getenv('DATA_PRE_PROCESSED_DIR', './source/preprocessed')
+
+def percentiles(samples):
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    if not len(samples):
+        return {}
+    return {"mean_ms": round(float(samples.mean()), 3), "p50_ms": round(float(np.percentile(samples, 50)), 3),
+            "p95_ms": round(float(np.percentile(samples, 95)), 3), "p99_ms": round(float(np.percentile(samples, 99)), 3)}
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+#Queries are stored vectors with a little noise, so no embedding calls are needed to benchmark search.
+def sample_queries(matrix, count, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = np.asarray(matrix)[rng.integers(0, len(matrix), count)]
+    return rows + rng.normal(0, 0.01, rows.shape).astype(np.float32)
+
+def bench_numpy_store(path, queries, k, batch):
+    from vectorstore import NumpyVectorStore
+
+    store, load_time = timed(NumpyVectorStore, None, path)
+    _, first_query = timed(store.search_batch, queries[:1], k)
+
+    single = [timed(store.search_batch, queries[i:i + 1], k)[1] for i in range(len(queries))]
+    batched = [timed(store.search_batch, queries[i:i + batch], k)[1] for i in range(0, len(queries), batch)]
+    return {
+        "rows": len(store),
+        "load_s": round(load_time, 4),
+        "first_query_s": round(first_query, 4),
+        "query": percentiles(single),
+        "batched_query": {**percentiles(batched), "batch": batch,
+                          "queries_per_second": round(len(queries) / sum(batched), 1) if sum(batched) else None}
+    }
+
+#Compare loading and querying the persisted Chroma collection with the same vectors in the numpy store.
+def bench_vectorstore(args):
+    from langchain.vectorstores import Chroma
+    from vectorstore import NumpyVectorStore
+
+    vectordb, chroma_load = timed(Chroma, persist_directory=data_directory)
+    collection = vectordb._collection
+    data = collection.get(include=["embeddings"])
+    if not data["ids"]:
+        raise SystemExit(f'No vectors in the Chroma collection under {data_directory}, run loadlang.py first')
+
+    queries = sample_queries(np.asarray(data["embeddings"], dtype=np.float32), args.queries)
+    _, chroma_first = timed(collection.query, query_embeddings=queries[:1].tolist(), n_results=args.k)
+    single = [timed(collection.query, query_embeddings=queries[i:i + 1].tolist(), n_results=args.k)[1] for i in range(len(queries))]
+    batched = [timed(collection.query, query_embeddings=queries[i:i + args.batch].tolist(), n_results=args.k)[1]
+               for i in range(0, len(queries), args.batch)]
+
+    numpy_dir = tempfile.mkdtemp()
+    try:
+        NumpyVectorStore.from_chroma(vectordb, numpy_dir)
+        numpy_results = bench_numpy_store(numpy_dir, queries, args.k, args.batch)
+    finally:
+        shutil.rmtree(numpy_dir)
+
+    return {
+        "chroma": {
+            "rows": len(data["ids"]),
+            "load_s": round(chroma_load, 4),
+            "first_query_s": round(chroma_first, 4),
+            "query": percentiles(single),
+            "batched_query": {**percentiles(batched), "batch": args.batch,
+                              "queries_per_second": round(len(queries) / sum(batched), 1) if sum(batched) else None}
+        },
+        "numpy": numpy_results
+    }
+
+#The numpy store on its own over random vectors, for sizes we don't have a real corpus for yet.
+def bench_numpy_synthetic(args):
+    from vectorstore import NumpyVectorStore
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(args.rows, args.dim)).astype(np.float32)
+    numpy_dir = tempfile.mkdtemp()
+    try:
+        NumpyVectorStore(None, numpy_dir).add_embeddings([''] * args.rows, vectors)
+        return bench_numpy_store(numpy_dir, sample_queries(vectors, args.queries), args.k, args.batch)
+    finally:
+        shutil.rmtree(numpy_dir)
+
+#Vectors around a few hundred centres, closer to real embeddings than uniform noise, which has no neighbourhoods for IVF to find.
+def clustered_vectors(rows, dim, centres=256, seed=0):
+    rng = np.random.default_rng(seed)
+    means = rng.normal(size=(centres, dim)).astype(np.float32)
+    return means[rng.integers(0, centres, rows)] + rng.normal(0, 0.5, (rows, dim)).astype(np.float32)
+
+def recall_at_k(exact, approximate):
+    hits = [len({row for row, _ in truth} & {row for row, _ in found}) / len(truth) for truth, found in zip(exact, approximate) if truth]
+    return round(float(np.mean(hits)), 4) if hits else None
+
+#Recall@k and latency of the IVF index against exact search, for each nprobe.
+#Against --store the index is trained in memory and not saved, synthetic runs also time incremental inserts.
+def bench_ann(args):
+    from annindex import IVFIndex
+    from vectorstore import NumpyVectorStore, normalise
+
+    numpy_dir = None
+    if args.store:
+        store = NumpyVectorStore(None, args.store)
+        if not len(store):
+            raise SystemExit(f'No vectors in {args.store}')
+    else:
+        numpy_dir = tempfile.mkdtemp()
+        store = NumpyVectorStore(None, numpy_dir)
+        store.add_embeddings([''] * args.rows, clustered_vectors(args.rows, args.dim))
+
+    try:
+        queries = normalise(sample_queries(store.matrix, args.queries, seed=1))
+        exact = []
+        exact_times = []
+        for i in range(len(queries)):
+            result, elapsed = timed(store.search_batch, queries[i:i + 1], args.k, exact=True)
+            exact.extend(result)
+            exact_times.append(elapsed)
+
+        index, build_time = timed(IVFIndex.train, store.matrix, args.nlist or None)
+        results = {"rows": len(store), "dim": store.dim, "k": args.k, "nlist": index.nlist, "build_s": round(build_time, 3),
+                   "exact": percentiles(exact_times), "ivf": []}
+        for nprobe in args.nprobe:
+            found = []
+            times = []
+            for i in range(len(queries)):
+                result, elapsed = timed(index.search_batch, store.matrix, queries[i:i + 1], args.k, nprobe)
+                found.extend(result)
+                times.append(elapsed)
+            results["ivf"].append({"nprobe": nprobe, "recall": recall_at_k(exact, found), **percentiles(times)})
+
+        if numpy_dir and args.insert:
+            store.index = index
+            _, insert_time = timed(store.add_embeddings, [''] * args.insert, clustered_vectors(args.insert, store.dim, seed=2))
+            exact = store.search_batch(queries, args.k, exact=True)
+            found = index.search_batch(store.matrix, queries, args.k)
+            results["insert"] = {"rows": args.insert, "insert_s": round(insert_time, 3), "nprobe": index.nprobe,
+                                 "recall": recall_at_k(exact, found)}
+        return results
+    finally:
+        if numpy_dir:
+            shutil.rmtree(numpy_dir)
+
+#Fixtures for the suite. Synthetic contracts are generated from a fixed seed so every run sees the same text.
+WORDS = ('the supplier shall provide services to the customer under this statement of work including delivery '
+         'acceptance payment milestone risk assumption dependency constraint network access platform release '
+         'implementation support change request schedule charges invoice termination warranty obligation').split()
+CODES = ['SOW_INF 1978', 'NAB41496', 'CON002328', 'NPP', 'ITO', 'MOA']
+SUITE_QUERIES = ["What are the key dates?", "What are the key deliverables?", "What are the key milestones?",
+                 "What are the key risks?", "What are the key assumptions?", "What are the key dependencies?",
+                 "SOW_INF 1978", "NAB41496"]
+
+def synthetic_pages(count, seed=0, lines_per_page=40):
+    rng = random.Random(seed)
+    pages = []
+    for page_number in range(1, count + 1):
+        lines = [f'Page {page_number} Clause {page_number}.{line + 1} ' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 14)))
+                 + (f' {rng.choice(CODES)}' if rng.random() < 0.1 else '')
+                 for line in range(lines_per_page)]
+        pages.append('\n'.join(lines))
+    return pages
+
+#Numbered clauses whose pages start the same way, "The", "12.1", "Clause 12", and every third ending in a number,
+#under a running header and footer if given. Returns the pages and the body each page should be left with after stripping.
+CLAUSES = ['The Supplier must provide the services described in the statement of work.',
+           'The Customer may terminate this agreement on thirty days notice.',
+           'Each party must keep the other party\'s confidential information secret.',
+           'Invoices are payable within forty five days of receipt.',
+           'The Supplier must meet the service levels in the schedule.',
+           'Service credits are the Customer\'s sole remedy for a missed service level.',
+           'Either party may refer a dispute to the executive committee.',
+           'The Supplier must maintain insurance for the term of the agreement.',
+           'Intellectual property created under this agreement vests in the Customer.',
+           'The Supplier must not subcontract without the Customer\'s consent.',
+           'Personal information must be handled under the privacy laws.',
+           'This agreement is governed by the laws of Victoria.']
+
+def clause_pages(count, header='Acme Managed Services Agreement CONFIDENTIAL Page {page} of {count}',
+                 footer='Commercial in confidence Version 2.{page} Printed 09.06.16'):
+    starts = ['The', '12.1', 'Clause 12', 'The Supplier', '1']
+    pages, bodies = [], []
+    for page in range(1, count + 1):
+        clauses = [CLAUSES[(page * 5 + line) % len(CLAUSES)] for line in range(3)]
+        lines = [f'{starts[page % len(starts)]} {page}.1 {clauses[0]}']
+        lines += [f'{page}.{line} {clause}' for line, clause in enumerate(clauses[1:], 2)] + ([str(page)] if page % 3 == 0 else [])
+        body = '\n'.join(lines)
+        lines = [header.format(page=page, count=count)] if header else []
+        lines += [body] + ([footer.format(page=page)] if footer else [])
+        pages.append({"page_number": page, "content": '\n'.join(lines)})
+        bodies.append(body)
+    return pages, bodies
+
+#A minimal PDF with one Helvetica text stream per page, enough for PyPDF2 to extract the lines back out.
+def make_pdf(path, pages):
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>',
+               f'<< /Type /Pages /Kids [{" ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))}] /Count {len(pages)} >>']
+    font = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 {font} 0 R >> >> /Contents {4 + 2 * i} 0 R >>')
+        stream = 'BT /F1 10 Tf 12 TL 72 740 Td ' + ' '.join(f'({line}) Tj T*' for line in text.split('\n')) + ' ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+    objects.append('<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+
+    out = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    out += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode('latin-1')
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    with open(path, 'wb') as f:
+        f.write(out)
+
+#High water mark of this process (and finished children, for the extract workers), in MB. Linux reports KB.
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+#Resident and high water mark RSS in MB from /proc on Linux, None elsewhere. Unlike ru_maxrss the high water mark
+#starts again in a new program (not just a fork) and can be reset, so it gives the peak of one piece of work.
+def proc_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f)
+    except OSError:
+        return None
+    return {name: round(int(fields[key].split()[0]) / 1024, 1) for name, key in (("rss", 'VmRSS'), ("peak", 'VmHWM'))}
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+#Run a stage repeat times. The output of the last run feeds the next stage.
+def run_stage(results, name, items, function, repeat):
+    durations = []
+    for _ in range(repeat):
+        output, elapsed = timed(function)
+        durations.append(elapsed)
+    median = float(np.median(durations))
+    results[name] = {"items": items, "runs": repeat, **percentiles(durations),
+                     "items_per_second": round(items / median, 1) if median else None,
+                     "peak_rss_mb": peak_rss_mb()}
+    print(f'{name}: {items} items, {median * 1000:.1f}ms median', file=sys.stderr)
+    return output
+
+def compare_baseline(results, baseline, tolerance):
+    comparison = {}
+    for name, stage in results["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if not before or not before.get("p50_ms") or "p50_ms" not in stage:
+            continue
+        ratio = stage["p50_ms"] / before["p50_ms"]
+        comparison[name] = {"baseline_p50_ms": before["p50_ms"], "p50_ms": stage["p50_ms"], "ratio": round(ratio, 3),
+                            "regression": ratio > 1 + tolerance}
+    return comparison
+
+#Every stage of the pipeline end to end, offline: PDF extract, boilerplate, tokenize, pack, chunk (by tokens, and by
+#characters to compare), dedup, embed (hashing backend), vector, IVF and BM25 index builds, then single and batched
+#queries.
+#--fixture corpus runs the text stages over the pre processed documents checked in under source/preprocessed
+#instead of the synthetic pages, extract always uses synthetic PDFs.
+def bench_suite(args):
+    work_dir = tempfile.mkdtemp()
+    #Metrics are written at exit, after work_dir has gone, which would make it again for their database
+    os.environ.update(DATA_CONNECTION_STRING=os.path.join(work_dir, 'bench.db'), METRICS_ENABLED='false')
+    try:
+        from extract import extract_pdfs_parallel
+        from tokens import count_tokens, init_token_cache
+        from packer import pack_pages
+        from pagestore import write_store
+        from embeddings import HashingEmbeddings
+        from vectorstore import NumpyVectorStore
+        from lexical import LexicalIndex, build_index, corpus_documents
+        from chunker import chunk_pages
+        from boilerplate import strip_document
+        from dedup import dedup_chunks
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        results = {"environment": {"python": platform.python_version(), "numpy": np.__version__, "cpus": os.cpu_count(),
+                                   "platform": platform.platform()},
+                   "arguments": {key: value for key, value in vars(args).items() if key != 'run'}, "stages": {}}
+        stages = results["stages"]
+
+        pdf_dir = os.path.join(work_dir, 'pdf')
+        os.makedirs(pdf_dir)
+        pdf_paths = []
+        for number in range(args.documents):
+            pdf_paths.append(os.path.join(pdf_dir, f'contract_{number}.pdf'))
+            make_pdf(pdf_paths[-1], synthetic_pages(args.pages, seed=number))
+        extracted = run_stage(stages, 'extract', args.documents * args.pages,
+                              lambda: extract_pdfs_parallel(pdf_paths, workers=args.workers)[0], args.repeat)
+        stages['extract']['peak_rss_children_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+        if args.fixture == 'corpus':
+            documents = dict(corpus_documents((data_pre_processed,)))
+            if not documents:
+                raise SystemExit(f'No pre processed documents in {data_pre_processed}')
+        else:
+            documents = {os.path.basename(path): pages for path, pages in extracted.items()}
+        #Timed on copies, then done for real as the later stages see stripped pages
+        reports = run_stage(stages, 'boilerplate', sum(map(len, documents.values())),
+                            lambda: [strip_document([dict(page) for page in document_pages]) for document_pages in documents.values()],
+                            args.repeat)
+        stages['boilerplate']['tokens_saved'] = sum(report["boilerplate_tokens"] for report in reports)
+        for document_pages in documents.values():
+            strip_document(document_pages)
+        pages = [page for document_pages in documents.values() for page in document_pages]
+        texts = [page["content"] for page in pages]
+
+        counts = run_stage(stages, 'tokenize', len(texts), lambda: count_tokens(texts, conn=init_token_cache(sqlite3.connect(':memory:'))), args.repeat)
+        for page, count in zip(pages, counts):
+            page["token_count"] = count
+        token_conn = init_token_cache(sqlite3.connect(':memory:'))
+        count_tokens(texts, conn=token_conn)
+        run_stage(stages, 'tokenize_cached', len(texts), lambda: count_tokens(texts, conn=token_conn), args.repeat)
+
+        batches = run_stage(stages, 'pack', len(pages),
+                            lambda: [batch for document_pages in documents.values() for batch in pack_pages(document_pages, args.token_limit)],
+                            args.repeat)
+        stages['pack']['batches'] = len(batches)
+
+        #The token chunker the pipeline uses, and the character splitter it replaced for comparison
+        chunks = run_stage(stages, 'chunk', len(texts),
+                           lambda: [chunk for name, document_pages in documents.items() for chunk in chunk_pages(document_pages, name)],
+                           args.repeat)
+        stages['chunk']['chunks'] = len(chunks)
+        kept = run_stage(stages, 'dedup', len(chunks), lambda: dedup_chunks(chunks), args.repeat)
+        stages['dedup']['dedup_ratio'] = round(1 - len(kept) / len(chunks), 4) if chunks else 0.0
+        chunks = kept
+        chunk_texts = [chunk.page_content for chunk in chunks]
+        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+        metadatas = [{"source": name, "page": page["page_number"] - 1} for name, document_pages in documents.items() for page in document_pages]
+        character_chunks = run_stage(stages, 'chunk_characters', len(texts), lambda: splitter.create_documents(texts, metadatas), args.repeat)
+        stages['chunk_characters']['chunks'] = len(character_chunks)
+
+        embedding = HashingEmbeddings(args.dim)
+        vectors = run_stage(stages, 'embed', len(chunk_texts), lambda: embedding.embed_documents(chunk_texts), args.repeat)
+
+        def build_vectors():
+            store_dir = tempfile.mkdtemp(dir=work_dir)
+            store = NumpyVectorStore(embedding, store_dir)
+            store.add_embeddings(chunk_texts, vectors, [chunk.metadata for chunk in chunks])
+            return store
+        store = run_stage(stages, 'index_vectors', len(vectors), build_vectors, args.repeat)
+        run_stage(stages, 'index_ivf', len(vectors), lambda: store.build_index(args.nlist or None), args.repeat)
+
+        page_dir = os.path.join(work_dir, 'pages')
+        os.makedirs(page_dir)
+        for name, document_pages in documents.items():
+            write_store(os.path.join(page_dir, os.path.splitext(name)[0]), {"document_name": name, "pages": document_pages})
+        def build_lexical():
+            conn = sqlite3.connect(':memory:')
+            build_index(conn, (page_dir,))
+            return conn
+        lexical = LexicalIndex(run_stage(stages, 'index_lexical', len(pages), build_lexical, args.repeat), directories=(page_dir,))
+
+        queries = [SUITE_QUERIES[i % len(SUITE_QUERIES)] for i in range(args.queries)]
+        for name, search in (('query_vector', lambda query: store.similarity_search(query, args.k)),
+                             ('query_vector_exact', lambda query: store.search_batch([embedding.embed_query(query)], args.k, exact=True)),
+                             ('query_lexical', lambda query: lexical.search(query, args.k))):
+            latencies = [timed(search, query)[1] for query in queries]
+            stages[name] = {"items": len(queries), **percentiles(latencies),
+                            "items_per_second": round(len(queries) / sum(latencies), 1) if sum(latencies) else None,
+                            "peak_rss_mb": peak_rss_mb()}
+
+        batch_times = [timed(store.similarity_search_batch, queries[i:i + args.batch], args.k)[1] for i in range(0, len(queries), args.batch)]
+        stages['query_vector_batched'] = {"items": len(queries), "batch": args.batch, **percentiles(batch_times),
+                                          "items_per_second": round(len(queries) / sum(batch_times), 1) if sum(batch_times) else None,
+                                          "peak_rss_mb": peak_rss_mb()}
+
+        if args.baseline:
+            with open(args.baseline) as f:
+                results["baseline"] = compare_baseline(results, json.load(f), args.tolerance)
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(results, f, indent=4)
+        return results
+    finally:
+        shutil.rmtree(work_dir)
+
+#Runs in a fresh process so the peak RSS is this document's alone. One PDF goes through extract, tokenize, the page
+#store, chunk, embed (hashing backend) and the numpy vector store, either whole, every page held at each step and
+#the store open as the original scripts do, or streamed batch pages at a time and appended to the store files
+#without opening the store, so nothing held grows with the document.
+def stream_worker(mode, pdf_path, work_dir, dim, batch):
+    os.environ.update(DATA_CONNECTION_STRING=os.path.join(work_dir, 'bench.db'), DATA_PRE_PROCESSED_DIR=work_dir,
+                      METRICS_ENABLED='false')
+    from extract import iter_pdf_pages
+    from tokens import count_tokens
+    from preprocess import save_document_store, stream_document
+    from embeddings import HashingEmbeddings
+    from vectorstore import NumpyVectorStore, append_embeddings
+    from utils import batched
+    from chunker import chunk_pages
+
+    embedding = HashingEmbeddings(dim)
+    store_dir = os.path.join(work_dir, 'vectors')
+    name = os.path.basename(pdf_path)
+    measured = reset_peak_rss() and proc_rss_mb()
+    baseline = measured["rss"] if measured else peak_rss_mb()
+    started = time.perf_counter()
+
+    def embedded(pages):
+        chunks = chunk_pages(pages, name)
+        texts = [chunk.page_content for chunk in chunks]
+        return texts, embedding.embed_documents(texts), [chunk.metadata for chunk in chunks]
+
+    page_count = chunk_count = 0
+    if mode == 'whole':
+        pages = [page for page, _ in iter_pdf_pages(pdf_path, reader_pages=0)]
+        for page, count in zip(pages, count_tokens([page["content"] for page in pages])):
+            page["token_count"] = count
+        save_document_store(name, pages)
+        store = NumpyVectorStore(embedding, store_dir)
+        store.add_embeddings(*embedded(pages))
+        page_count, chunk_count = len(pages), len(store)
+    else:
+        for pages in batched(stream_document(pdf_path, batch), batch):
+            _, records = append_embeddings(store_dir, *embedded(pages))
+            page_count += len(pages)
+            chunk_count += len(records)
+
+    return {"pages": page_count, "chunks": chunk_count,
+            "seconds": round(time.perf_counter() - started, 3), "baseline_rss_mb": baseline,
+            "peak_rss_mb": proc_rss_mb()["peak"] if measured else peak_rss_mb()}
+
+#Peak RSS against page count for the whole document and streamed paths. growth_mb is what the document added on
+#top of the process with everything imported, which should stay flat with page count when streaming.
+def bench_stream(args):
+    work_dir = tempfile.mkdtemp()
+    try:
+        results = {"environment": {"python": platform.python_version(), "platform": platform.platform()},
+                   "arguments": {key: value for key, value in vars(args).items() if key != 'run'}, "stages": {}}
+        context = multiprocessing.get_context('spawn')
+        for pages in args.pages:
+            pdf_path = os.path.join(work_dir, f'bundle_{pages}.pdf')
+            make_pdf(pdf_path, synthetic_pages(pages))
+            for mode in ('whole', 'stream'):
+                with context.Pool(1) as pool:
+                    result = pool.apply(stream_worker, (mode, pdf_path, tempfile.mkdtemp(dir=work_dir), args.dim, args.batch))
+                result["growth_mb"] = round(result["peak_rss_mb"] - result["baseline_rss_mb"], 1)
+                results["stages"][f'{mode}_{pages}'] = result
+                print(f'{mode} {pages} pages: {result["growth_mb"]}MB over {result["baseline_rss_mb"]}MB, {result["seconds"]}s', file=sys.stderr)
+        return results
+    finally:
+        shutil.rmtree(work_dir)
+
+#Boilerplate stripping over numbered clause fixtures, with a running header and footer, with one of them, and with
+#neither, where nothing may be stripped. Each page must be left with exactly its body.
+def bench_boilerplate(args):
+    from boilerplate import strip_document
+    fixtures = {"header_footer": {}, "header": {"footer": None}, "footer": {"header": None}, "none": {"header": None, "footer": None}}
+    results = {"fixtures": {}, "failures": []}
+    for name, fixture in fixtures.items():
+        pages, bodies = clause_pages(args.pages, **fixture)
+        report, elapsed = timed(strip_document, pages)
+        results["fixtures"][name] = {**report, "ms": round(elapsed * 1000, 2)}
+        results["failures"] += [{"fixture": name, "page": page["page_number"], "content": page["content"]}
+                                for page, body in zip(pages, bodies) if page["content"] != body]
+    return results
+
+#Each cli.py command, as argv after the script name
+STARTUP_COMMANDS = [['ingest'], ['pack'], ['summarize'], ['query'], ['serve'], ['watch'], ['index', 'lexical'], ['index', 'chroma'],
+                    ['index', 'numpy'], ['index', 'ivf']]
+
+#How long each cli.py command takes to import what it needs, each run in a fresh interpreter so nothing is already
+#loaded. p50_ms is the import time cli.py measures, process_p50_ms the whole process including the interpreter
+#starting, which the interpreter stage gives on its own. A command whose modules don't import here is reported and skipped.
+def bench_startup(args):
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+    #Anything a command does at import (summarize opens its log and database) goes to a scratch directory
+    work_dir = tempfile.mkdtemp()
+    env = dict(os.environ, LOG_DIR=os.path.join(work_dir, 'log'), DATA_CONNECTION_STRING=os.path.join(work_dir, 'bench.db'),
+               METRICS_ENABLED='false')
+    results = {"environment": {"python": platform.python_version(), "platform": platform.platform()},
+               "arguments": {key: value for key, value in vars(args).items() if key != 'run'}, "stages": {}}
+    stages = results["stages"]
+
+    process_times = [timed(subprocess.run, [sys.executable, '-c', 'pass'], check=True)[1] for _ in range(args.repeat)]
+    stages['interpreter'] = {"runs": args.repeat, **percentiles(process_times)}
+
+    for argv in STARTUP_COMMANDS:
+        name = 'startup_' + '_'.join(argv)
+        import_times, process_times, modules = [], [], 0
+        for _ in range(args.repeat):
+            process, elapsed = timed(subprocess.run, [sys.executable, cli, '--imports-only', *argv], capture_output=True, text=True, env=env)
+            if process.returncode:
+                error = process.stderr.strip().splitlines()
+                stages[name] = {"error": error[-1] if error else f'exit code {process.returncode}'}
+                break
+            report = json.loads(process.stdout)
+            import_times.append(report["import_s"])
+            process_times.append(elapsed)
+            modules = report["modules"]
+        else:
+            stages[name] = {"runs": args.repeat, "modules": modules, **percentiles(import_times),
+                            "process_p50_ms": round(float(np.median(process_times)) * 1000, 3)}
+        print(f'{name}: {stages[name].get("p50_ms", stages[name].get("error"))}', file=sys.stderr)
+
+    shutil.rmtree(work_dir)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["baseline"] = compare_baseline(results, json.load(f), args.tolerance)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the knowledge summary pipeline')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('vectorstore', help='persisted Chroma collection against the numpy vector store')
+    command.add_argument('--queries', type=int, default=200)
+    command.add_argument('--k', type=int, default=2)
+    command.add_argument('--batch', type=int, default=8)
+    command.set_defaults(run=bench_vectorstore)
+
+    command = commands.add_parser('numpy', help='numpy vector store over synthetic vectors')
+    command.add_argument('--rows', type=int, default=5000)
+    command.add_argument('--dim', type=int, default=1536)
+    command.add_argument('--queries', type=int, default=200)
+    command.add_argument('--k', type=int, default=2)
+    command.add_argument('--batch', type=int, default=8)
+    command.set_defaults(run=bench_numpy_synthetic)
+
+    command = commands.add_parser('ann', help='IVF index recall@k and latency against exact search')
+    command.add_argument('--store', help='numpy vector store directory, synthetic clustered vectors if not given')
+    command.add_argument('--rows', type=int, default=50000)
+    command.add_argument('--dim', type=int, default=1536)
+    command.add_argument('--queries', type=int, default=200)
+    command.add_argument('--k', type=int, default=10)
+    command.add_argument('--nlist', type=int, default=0)
+    command.add_argument('--nprobe', type=lambda value: [int(n) for n in value.split(',')], default=[1, 2, 4, 8, 16, 32])
+    command.add_argument('--insert', type=int, default=5000, help='rows to add after training, synthetic only')
+    command.set_defaults(run=bench_ann)
+
+    command = commands.add_parser('suite', help='every pipeline stage on offline fixtures, optionally against a saved baseline')
+    command.add_argument('--fixture', choices=['synthetic', 'corpus'], default='synthetic')
+    command.add_argument('--documents', type=int, default=4)
+    command.add_argument('--pages', type=int, default=50, help='pages per synthetic document')
+    command.add_argument('--workers', type=int, default=2)
+    command.add_argument('--token-limit', type=int, default=8000)
+    command.add_argument('--dim', type=int, default=1536)
+    command.add_argument('--nlist', type=int, default=0)
+    command.add_argument('--queries', type=int, default=100)
+    command.add_argument('--k', type=int, default=2)
+    command.add_argument('--batch', type=int, default=8)
+    command.add_argument('--repeat', type=int, default=3)
+    command.add_argument('--save', help='write the results here, e.g. to use as the next baseline')
+    command.add_argument('--baseline', help='results saved by an earlier --save to compare against')
+    command.add_argument('--tolerance', type=float, default=0.2, help='how much slower a stage can get before it counts as a regression')
+    command.set_defaults(run=bench_suite)
+
+    command = commands.add_parser('stream', help='peak RSS against page count, whole document against streamed')
+    command.add_argument('--pages', type=lambda value: [int(n) for n in value.split(',')], default=[250, 500, 1000, 2000])
+    command.add_argument('--dim', type=int, default=1536)
+    command.add_argument('--batch', type=int, default=64, help='pages per streamed batch')
+    command.set_defaults(run=bench_stream)
+
+    command = commands.add_parser('boilerplate', help='header and footer stripping on numbered clause fixtures, fails if a page loses more')
+    command.add_argument('--pages', type=int, default=20)
+    command.set_defaults(run=bench_boilerplate)
+
+    command = commands.add_parser('startup', help='import time of each cli.py command, optionally against a saved baseline')
+    command.add_argument('--repeat', type=int, default=5)
+    command.add_argument('--save', help='write the results here, e.g. to use as the next baseline')
+    command.add_argument('--baseline', help='results saved by an earlier --save to compare against')
+    command.add_argument('--tolerance', type=float, default=0.3, help='how much slower an import can get before it counts as a regression')
+    command.set_defaults(run=bench_startup)
+
+    args = parser.parse_args()
+    results = args.run(args)
+    json.dump(results, sys.stdout, indent=4)
+    print()
+    if any(stage["regression"] for stage in results.get("baseline", {}).values()) or results.get("failures"):
+        sys.exit(1)
@@ -0,0 +1,182 @@
+#OS imports
+import os
+import re
+import sys
+import json
+import math
+import logging
+from itertools import islice, chain
+from collections import Counter
+
+#Token counter for modeling size to stuff into GPT
+from tokens import count_tokens
+
+#Offset indexed page store for the pre processed pages
+from pagestore import PageStore, list_stores, write_store
+
+#Bring in the utils
+from utils import batched
+
+#Run metrics
+from metrics import count
+
+data_pre_processed= os.getenv('DATA_PRE_PROCESSED_DIR', './source/preprocessed')
+strip_enabled = os.getenv('STRIP_BOILERPLATE', 'true').lower() in ('1', 'true', 'yes')
+#Text at the top or bottom of at least this share of a document's pages (and of 3 pages) is boilerplate. Kept low as
+#a contract bundle changes its running header from one part to the next, the SOW's first part header is on 40 of its
+#243 pages.
+boilerplate_min_fraction = float(os.getenv('BOILERPLATE_MIN_FRACTION', 0.15))
+#A header or footer has at least this many words that aren't numbers or stopwords, so a page starting "The" or
+#"12.1" or "Clause 12" isn't cut
+boilerplate_min_words = int(os.getenv('BOILERPLATE_MIN_WORDS', 3))
+#How far into the top and bottom of a page to look, in words
+boilerplate_words = int(os.getenv('BOILERPLATE_WORDS', 40))
+#Streamed documents learn their boilerplate from this many pages before any page is passed on
+boilerplate_sample_pages = int(os.getenv('BOILERPLATE_SAMPLE_PAGES', 64))
+
+logger = logging.getLogger(__name__)
+
+BOILERPLATE_MIN_PAGES = 3
+#Share of the pages sharing a run that must continue it for the longer run to count
+BOILERPLATE_CONTINUE = 0.5
+
+WORD = re.compile(r'\S+')
+DIGITS = re.compile(r'\d+')
+LETTER = re.compile(r'[^\W\d_]')
+#Words that start clauses and cross references as often as headers, they don't count towards a header
+STOPWORDS = frozenset('''a an and are as at be by for from in is it of on or that the this to was were will with
+    shall may must not no any all each such its their under clause section page part schedule'''.split())
+
+#Running headers and footers, e.g. every page of the SOW starting
+#   NPP Implementation and Run SOW (NAB41496) ... NAB & SUPPLIER CONFIDENTIAL 26999162_67 Page N of 243
+#Pages are compared a word at a time with the numbers blanked out, so page numbers and dates don't stop a line
+#matching. Extracted text often runs the header into the first line of the page, so what repeats is found as the
+#longest run of words from the top (or bottom) of the page that enough other pages start (or end) with, rather
+#than as whole lines.
+def edge_keys(words, limit=boilerplate_words):
+    keys = []
+    key = ''
+    for word in words[:limit]:
+        key += DIGITS.sub('#', word) + '\x00'
+        keys.append(key)
+    return keys
+
+def page_words(content):
+    return list(WORD.finditer(content))
+
+#The headers and footers common to enough of the pages: every qualifying run of normalised words from the top,
+#and from the bottom (read backwards).
+def find_boilerplate(pages, min_fraction=boilerplate_min_fraction):
+    headers, footers = Counter(), Counter()
+    for page in pages:
+        words = [match.group() for match in page_words(page["content"])]
+        headers.update(edge_keys(words))
+        footers.update(edge_keys(words[::-1]))
+    min_pages = max(BOILERPLATE_MIN_PAGES, math.ceil(min_fraction * len(pages)))
+    return common_runs(headers, min_pages), common_runs(footers, min_pages)
+
+#A run carries on past the header only while most of the pages that share it go on the same way, otherwise a
+#header on every page followed by "12.1" on a few of them would take the clause number with it.
+def common_runs(keys, min_pages):
+    runs = set()
+    for key in sorted(keys, key=len):
+        parent = key[:key.rfind('\x00', 0, -1) + 1]
+        if keys[key] >= min_pages and (not parent or (parent in runs and keys[key] >= BOILERPLATE_CONTINUE * keys[parent])):
+            runs.add(key)
+    return {key for key in runs if meaningful(key)}
+
+#Whether a run of normalised words says enough to be a header or footer rather than the common start of a clause.
+def meaningful(key, min_words=boilerplate_min_words):
+    words = (word.strip('.,;:()[]"\'').lower() for word in key.split('\x00'))
+    return sum(1 for word in words if LETTER.search(word) and word not in STOPWORDS) >= min_words
+
+#How many words of the page the longest known key covers, never the whole page.
+def matched_words(words, known):
+    for length, key in reversed(list(enumerate(edge_keys(words), 1))):
+        if key in known and length < len(words):
+            return length
+    return 0
+
+#Cut the header and footer off a page in place, returning the text removed from the top and from the bottom.
+def strip_page(page, headers, footers):
+    content = page["content"]
+    matches = page_words(content)
+    top = matched_words([match.group() for match in matches], headers)
+    bottom = matched_words([match.group() for match in matches[top:]][::-1], footers)
+    start = matches[top - 1].end() if top else 0
+    end = matches[len(matches) - bottom].start() if bottom else len(content)
+    page["content"] = content[start:end].strip() if top or bottom else content
+    return content[:start], content[end:]
+
+#Strip the boilerplate from a stream of pages, learning it from the first sample pages (all of them, for a
+#whole document in memory). The header and footer found, the pages stripped and the tokens that no longer go to the
+#tokenizer, the LLM and the embedder are put in report, e.g. the document metadata for the page store. conn is the
+#token cache to count them with, for callers on their own thread.
+def strip_pages(pages, report, sample=boilerplate_sample_pages, min_fraction=boilerplate_min_fraction, conn=None):
+    report.update({"header": '', "footer": '', "boilerplate_pages": 0, "boilerplate_tokens": 0})
+    if not strip_enabled:
+        yield from pages
+        return
+
+    pages = iter(pages)
+    first = list(islice(pages, sample))
+    headers, footers = find_boilerplate(first, min_fraction)
+    found, texts = Counter(), {}
+    for batch in batched(chain(first, pages), max(sample, 1)):
+        removed = []
+        for page in batch:
+            header, footer = strip_page(page, headers, footers)
+            if header or footer:
+                report["boilerplate_pages"] += 1
+                for field, text in (("header", header), ("footer", footer)):
+                    if text.strip():
+                        key = (field, DIGITS.sub('#', ' '.join(text.split())))
+                        found[key] += 1
+                        texts.setdefault(key, ' '.join(text.split()))
+                removed.extend(text for text in (header, footer) if text.strip())
+        report["boilerplate_tokens"] += sum(count_tokens(removed, conn=conn))
+        yield from batch
+
+    #The commonest, as first seen, is the document's header and footer
+    for key, _ in found.most_common():
+        if not report[key[0]]:
+            report[key[0]] = texts[key]
+    count('boilerplate', 'pages', report["boilerplate_pages"])
+    count('boilerplate', 'tokens_saved', report["boilerplate_tokens"])
+    if report["boilerplate_pages"]:
+        logger.info(f'Stripped boilerplate from {report["boilerplate_pages"]} pages, {report["boilerplate_tokens"]} tokens saved')
+
+#Strip a whole document's pages in place, returning the report.
+def strip_document(pages, min_fraction=boilerplate_min_fraction, conn=None):
+    report = {}
+    for _ in strip_pages(pages, report, len(pages), min_fraction, conn):
+        pass
+    return report
+
+#What stripping would save for each page store in a directory, or with rewrite=True strip them for real.
+#Rewritten pages have their tokens counted again and keep their processed flags.
+def strip_stores(directory=data_pre_processed, rewrite=False):
+    reports = {}
+    for stem in list_stores(directory):
+        with PageStore(stem, writable=False) as store:
+            metadata = dict(store.metadata)
+            pages = list(store.iter_pages())
+        if metadata.get("boilerplate_pages") is not None:
+            reports[os.path.basename(stem)] = {key: metadata[key] for key in ("header", "footer", "boilerplate_pages", "boilerplate_tokens")}
+            continue
+        before = sum(page["token_count"] for page in pages)
+        report = strip_document(pages)
+        reports[os.path.basename(stem)] = {**report, "tokens_before": before}
+        if rewrite and report["boilerplate_pages"]:
+            for page, token_count in zip(pages, count_tokens([page["content"] for page in pages])):
+                page["token_count"] = token_count
+            write_store(stem, {**metadata, **report, "pages": pages})
+    return reports
+
+if __name__ == '__main__':
+    #python boilerplate.py report   what stripping the pre processed page stores would save
+    #python boilerplate.py strip    strip them, for stores written before stripping was added
+    command = sys.argv[1] if len(sys.argv) > 1 else 'report'
+    if command not in ('report', 'strip'):
+        raise SystemExit(f'Unknown command {command}, expected report or strip')
+    print(json.dumps(strip_stores(rewrite=command == 'strip'), indent=4))
@@ -0,0 +1,165 @@
+#OS imports
+import os
+import re
+import sys
+import json
+import time
+import logging
+
+#Vector maths
+import numpy as np
+
+#Token counter for modeling size to stuff into GPT
+from tokens import get_encoding, token_model, token_threads
+
+#Offset indexed page store for the pre processed pages
+from pagestore import PageStore, list_stores
+
+#Run metrics
+from metrics import record_span, count
+
+data_processed= os.getenv('DATA_PROCESSED_DIR', './source/processed')
+data_pre_processed= os.getenv('DATA_PRE_PROCESSED_DIR', './source/preprocessed')
+#Chunk length and the overlap between neighbouring chunks of a page, in tokens. The defaults are about what the
+#1000/200 character splitter gave.
+chunk_tokens = int(os.getenv('CHUNK_TOKENS', 250))
+chunk_overlap_tokens = int(os.getenv('CHUNK_OVERLAP_TOKENS', 50))
+
+logger = logging.getLogger(__name__)
+
+#A blank line (apart from spaces) ends a paragraph, as in packer.py, here on the utf-8 content
+PARAGRAPH_BREAK = re.compile(rb'\n[ \t]*\n')
+
+#Utf-8 length of every token id, per encoding
+_byte_lengths = {}
+
+#Same shape as a langchain Document, page_content and metadata are all the vector stores and ingest.py look at,
+#without importing langchain to make one.
+class Chunk:
+    __slots__ = ('page_content', 'metadata')
+
+    def __init__(self, page_content, metadata):
+        self.page_content = page_content
+        self.metadata = metadata
+
+    def __repr__(self):
+        return f'Chunk({self.page_content[:40]!r}, {self.metadata})'
+
+def token_byte_lengths(encoding):
+    if encoding.name not in _byte_lengths:
+        lengths = np.zeros(encoding.n_vocab, dtype=np.int64)
+        for token in range(encoding.n_vocab):
+            try:
+                lengths[token] = len(encoding.decode_single_token_bytes(token))
+            except (KeyError, ValueError):
+                pass
+        _byte_lengths[encoding.name] = lengths
+    return _byte_lengths[encoding.name]
+
+#Where each chunk of each page starts and ends, in tokens from the start of the page, for every page at once.
+#Windows of size tokens, each overlap tokens into the one before. A page that fits is one chunk, an empty page none.
+def chunk_spans(page_tokens, size=chunk_tokens, overlap=chunk_overlap_tokens):
+    if not 0 <= overlap < size:
+        raise ValueError(f'Chunk overlap {overlap} must be at least 0 and less than the chunk size {size}')
+    step = size - overlap
+    page_tokens = np.asarray(page_tokens, dtype=np.int64)
+    chunks = np.where(page_tokens > 0, np.maximum(1, -(-(page_tokens - overlap) // step)), 0)
+    pages = np.repeat(np.arange(len(page_tokens)), chunks)
+    starts = (np.arange(len(pages)) - np.repeat(np.cumsum(chunks) - chunks, chunks)) * step
+    return pages, starts, np.minimum(starts + size, page_tokens[pages])
+
+#Chunk the pages in a utf-8 buffer, laid out as a page store's content file: records are (page_number,
+#token_count, offset, length) for each page. The token_count of each page is trusted, only the pages too long for
+#one chunk are encoded, to find the byte offset of every token. Everything after that is array arithmetic over
+#the whole document: the windows, their byte spans (moved to the next character boundary, a token can end inside
+#one), their character spans within the page and which paragraph of the page they start in.
+def chunk_content(data, records, metadata, size=chunk_tokens, overlap=chunk_overlap_tokens, model=token_model):
+    started = time.perf_counter()
+    if not records:
+        return []
+    page_numbers, page_tokens, offsets, lengths = (np.array(column, dtype=np.int64) for column in zip(*[record[:4] for record in records]))
+    ends = offsets + lengths
+
+    #Byte offset just past each token of the pages being split, padded at the front so [first + t] is where token t starts
+    split = np.flatnonzero(page_tokens > size)
+    first = np.zeros(len(records), dtype=np.int64)
+    token_ends = np.zeros(1, dtype=np.int64)
+    if len(split):
+        encoding = get_encoding(model)
+        encoded = encoding.encode_ordinary_batch([bytes(data[offsets[i]:ends[i]]).decode('utf-8') for i in split],
+                                                 num_threads=token_threads)
+        counts = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        ids = np.fromiter((token for tokens in encoded for token in tokens), dtype=np.int64, count=int(counts.sum()))
+        flat = np.cumsum(token_byte_lengths(encoding)[ids])
+        before = np.concatenate(([0], flat))[np.cumsum(counts) - counts]
+        token_ends = np.concatenate(([0], flat - np.repeat(before - offsets[split], counts)))
+        if not np.array_equal(token_ends[np.cumsum(counts)], ends[split]):
+            raise ValueError(f'{encoding.name} tokens don\'t add up to the page text of {metadata.get("document")}')
+        page_tokens[split] = counts
+        first[split] = np.cumsum(counts) - counts
+
+    pages, starts, stops = chunk_spans(page_tokens, size, overlap)
+    last = len(token_ends) - 1
+    byte_starts = np.where(starts == 0, offsets[pages], token_ends[np.minimum(first[pages] + starts, last)])
+    byte_ends = np.where(stops == page_tokens[pages], ends[pages], token_ends[np.minimum(first[pages] + stops, last)])
+
+    content = np.frombuffer(data, dtype=np.uint8)
+    characters = np.append(np.flatnonzero((content & 0xC0) != 0x80), len(content))
+    char_starts = np.searchsorted(characters, byte_starts)
+    char_ends = np.searchsorted(characters, byte_ends)
+    byte_starts, byte_ends = characters[char_starts], characters[char_ends]
+    page_chars = np.searchsorted(characters, offsets)[pages]
+
+    breaks = np.fromiter((match.end() for match in PARAGRAPH_BREAK.finditer(data)), dtype=np.int64)
+    paragraphs = np.searchsorted(breaks, byte_starts, 'right') - np.searchsorted(breaks, offsets, 'right')[pages] + 1
+    del content
+
+    chunks = [Chunk(bytes(data[start:end]).decode('utf-8'),
+                    {**metadata, "page": page_number - 1, "page_number": page_number, "paragraph": paragraph,
+                     "char_start": char_start, "char_end": char_end, "tokens": tokens})
+              for start, end, page_number, paragraph, char_start, char_end, tokens
+              in zip(byte_starts.tolist(), byte_ends.tolist(), page_numbers[pages].tolist(), paragraphs.tolist(),
+                     (char_starts - page_chars).tolist(), (char_ends - page_chars).tolist(), (stops - starts).tolist())]
+    record_span('chunk', time.perf_counter() - started, document=metadata.get("document"), pages=len(records),
+                encoded=len(split), chunks=len(chunks))
+    count('chunk', 'chunks', len(chunks))
+    return chunks
+
+#Chunk pages held in memory (page_number, token_count and content each). Sources and 0 based pages as PyPDFLoader
+#records them, with the page number, paragraph, character span within the page and token count alongside.
+def chunk_pages(pages, source, size=chunk_tokens, overlap=chunk_overlap_tokens, model=token_model):
+    contents = [page["content"].encode('utf-8') for page in pages]
+    offsets = np.cumsum([0] + [len(content) for content in contents]).tolist()
+    records = [(page["page_number"], page["token_count"], offset, len(content))
+               for page, offset, content in zip(pages, offsets, contents)]
+    return chunk_content(b''.join(contents), records, {"source": source, "document": os.path.basename(source)},
+                         size, overlap, model)
+
+#Chunk a page store straight from its mmapped content file, without reading the pages out one by one.
+def chunk_store(stem, size=chunk_tokens, overlap=chunk_overlap_tokens, model=token_model):
+    with PageStore(stem, writable=False) as store:
+        name = store.metadata.get("document_name", os.path.basename(stem) + '.pdf')
+        source = os.path.join(store.metadata.get("document_directory", ''), name)
+        return chunk_content(store.pages_map, store.records(), {"source": source, "document": name}, size, overlap, model)
+
+#Every pre processed document, chunked again, e.g. after changing CHUNK_TOKENS.
+def chunk_corpus(directories=(data_pre_processed, data_processed), size=chunk_tokens, overlap=chunk_overlap_tokens, model=token_model):
+    chunks = []
+    for directory in directories:
+        if os.path.isdir(directory):
+            for stem in list_stores(directory):
+                chunks.extend(chunk_store(stem, size, overlap, model))
+    return chunks
+
+if __name__ == '__main__':
+    #python chunker.py [chunk_tokens] [overlap_tokens]   chunk the pre processed corpus and report
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else chunk_tokens
+    overlap = int(sys.argv[2]) if len(sys.argv) > 2 else chunk_overlap_tokens
+    started = time.perf_counter()
+    chunks = chunk_corpus(size=size, overlap=overlap)
+    tokens = [chunk.metadata["tokens"] for chunk in chunks]
+    print(json.dumps({"chunk_tokens": size, "overlap_tokens": overlap,
+                      "documents": len({chunk.metadata["document"] for chunk in chunks}),
+                      "pages": len({(chunk.metadata["document"], chunk.metadata["page"]) for chunk in chunks}),
+                      "chunks": len(chunks), "mean_tokens": round(float(np.mean(tokens)), 1) if tokens else 0,
+                      "max_tokens": max(tokens, default=0), "seconds": round(time.perf_counter() - started, 3)}, indent=4))
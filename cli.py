@@ -0,0 +1,163 @@
+#OS imports
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+
+#One entry point for the pipeline:
+#   python cli.py ingest                  pull the PDFs in DATA_SOURCE_DIR apart into page stores, and add them to the BM25 index
+#   python cli.py pack [token_limit]      pack the pre processed documents into batches and print the packing report
+#   python cli.py summarize               the full summary run (test1.py)
+#   python cli.py query <question>        hybrid vector and BM25 retrieval
+#   python cli.py index <target>          build lexical, chroma, numpy or ivf
+#   python cli.py serve                   the query service (service.py)
+#   python cli.py watch [--once]          the watch folder ingestion daemon (watcher.py)
+#Nothing heavy is imported up here. Each command lists the modules it needs in COMMAND_MODULES and they are only imported
+#once the command is known, so a query doesn't pay for PyPDF2, tiktoken, openai and pydantic, and an ingest doesn't
+#pay for langchain. The time each command spends importing is recorded as a 'startup' span (python metrics.py report),
+#python bench.py startup times every command in a fresh interpreter and compares against a baseline.
+log_level = os.getenv('LOG_LEVEL', 'DEBUG')
+data_conn = os.getenv('DATA_CONNECTION_STRING', './data/database.db')
+
+def ingest(args):
+    from preprocess import split_pdfs_in_directory
+    split_pdfs_in_directory(args.workers)
+    if not args.no_lexical:
+        from lexical import build_index
+        from utils import init_db
+        print(json.dumps(build_index(init_db(data_conn)), indent=4))
+
+def pack(args):
+    from packer import pack_corpus, packing_report
+    print(json.dumps(packing_report(pack_corpus(args.token_limit), args.token_limit), indent=4))
+
+def summarize(args):
+    import test1
+    test1.main()
+
+def query(args):
+    from langquery import query
+    for doc in query(' '.join(args.question), k=args.k):
+        print(doc.metadata, doc.page_content[:200])
+
+def serve(args):
+    import asyncio
+    from service import serve
+    from langquery import build_retriever
+    asyncio.run(serve(build_retriever, args.host, args.port, args.socket))
+
+def watch(args):
+    import signal
+    import threading
+    from watcher import FolderWatcher
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    FolderWatcher().run(stop, once=args.once)
+
+def index(args):
+    if args.target == 'lexical':
+        from lexical import build_index
+        from utils import init_db
+        print(json.dumps(build_index(init_db(data_conn)), indent=4))
+    elif args.target == 'chroma':
+        from loadlang import load_data
+        load_data()
+    elif args.target == 'numpy':
+        from langchain.vectorstores import Chroma
+        from vectorstore import NumpyVectorStore, vector_store_dir, data_directory, HEADER_FILE
+        if os.path.exists(os.path.join(vector_store_dir, HEADER_FILE)):
+            raise SystemExit(f'{vector_store_dir} already holds a vector store, remove it to rebuild')
+        NumpyVectorStore.from_chroma(Chroma(persist_directory=data_directory), vector_store_dir)
+    else:
+        from vectorstore import NumpyVectorStore
+        index = NumpyVectorStore().build_index(args.nlist)
+        print(f'{len(index)} rows in {index.nlist} lists, searching {index.nprobe} lists per query')
+
+#The modules imported before a command runs. Keep them in step with what the command imports, they are what the
+#startup time measures. index depends on the target.
+COMMAND_MODULES = {
+    "ingest": ('preprocess', 'lexical', 'utils'),
+    "pack": ('packer',),
+    "summarize": ('test1',),
+    "query": ('langquery',),
+    "serve": ('service', 'langquery'),
+    "watch": ('watcher',),
+}
+INDEX_MODULES = {
+    "lexical": ('lexical', 'utils'),
+    "chroma": ('loadlang',),
+    "numpy": ('langchain.vectorstores', 'vectorstore'),
+    "ivf": ('vectorstore',),
+}
+
+def command_modules(args):
+    if args.command == 'index':
+        return INDEX_MODULES[args.target]
+    return COMMAND_MODULES[args.command]
+
+#Import a command's modules, returning the seconds it took and how many modules were new.
+def load_command(args):
+    before = len(sys.modules)
+    started = time.perf_counter()
+    for module in command_modules(args):
+        importlib.import_module(module)
+    return time.perf_counter() - started, len(sys.modules) - before
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Knowledge summary pipeline')
+    parser.add_argument('--imports-only', action='store_true', help='import the command\'s modules, print the time it took and stop')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('ingest', help='PDFs in DATA_SOURCE_DIR to page stores')
+    command.add_argument('--workers', type=int, default=int(os.getenv('EXTRACT_WORKERS', 1)))
+    command.add_argument('--no-lexical', action='store_true', help='don\'t update the BM25 index')
+    command.set_defaults(run=ingest)
+
+    command = commands.add_parser('pack', help='pack the pre processed documents and report')
+    command.add_argument('token_limit', type=int, nargs='?', default=2000)
+    command.set_defaults(run=pack)
+
+    command = commands.add_parser('summarize', help='the full summary run')
+    command.set_defaults(run=summarize)
+
+    command = commands.add_parser('query', help='hybrid retrieval for a question')
+    command.add_argument('question', nargs='*')
+    command.add_argument('--k', type=int, default=2)
+    command.set_defaults(run=query)
+
+    command = commands.add_parser('serve', help='long running query service')
+    command.add_argument('--host', default=os.getenv('QUERY_SERVICE_HOST', '127.0.0.1'))
+    command.add_argument('--port', type=int, default=int(os.getenv('QUERY_SERVICE_PORT', 8766)))
+    command.add_argument('--socket', default=os.getenv('QUERY_SERVICE_SOCKET'), help='Unix socket path, instead of host and port')
+    command.set_defaults(run=serve)
+
+    command = commands.add_parser('watch', help='ingest new PDFs from DATA_SOURCE_DIR as they arrive')
+    command.add_argument('--once', action='store_true', help='ingest the PDFs there now and exit')
+    command.set_defaults(run=watch)
+
+    command = commands.add_parser('index', help='build a search index')
+    command.add_argument('target', choices=['lexical', 'chroma', 'numpy', 'ivf'])
+    command.add_argument('--nlist', type=int, default=None, help='IVF lists, IVF_NLIST or 4 * sqrt(rows) by default')
+    command.set_defaults(run=index)
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    import_seconds, modules = load_command(args)
+    if args.imports_only:
+        print(json.dumps({"command": args.command, "import_s": round(import_seconds, 6), "modules": modules}))
+        return
+
+    from utils import init_logging
+    from metrics import record_span
+    logger = init_logging(log_level)
+    logger.debug('%s imported %s modules in %.3fs', args.command, modules, import_seconds)
+    record_span('startup', import_seconds, command=args.command, modules=modules)
+    args.run(args)
+
+if __name__ == '__main__':
+    main()
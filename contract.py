@@ -13,9 +13,12 @@ from utils import init_logging, init_db
 
 #Bring in the layout parser
 from langchain.document_loaders import PyPDFLoader
-from langchain.text_splitter import CharacterTextSplitter
 from langchain.vectorstores import Chroma
-from langchain.embeddings import OpenAIEmbeddings
+from embeddings import get_embeddings
+from tokens import count_tokens
+from boilerplate import strip_document
+from chunker import chunk_pages
+from dedup import dedup_chunks
 
 #PDF tools
 import PyPDF2
@@ -37,15 +40,20 @@ logger = init_logging(log_level)
 # Initialize database connection
 conn = init_db(data_conn)
 
-loader = PyPDFLoader(f'{data_source}/NAP NPP Final with print outs 09.06.16.pdf')
+file_path = f'{data_source}/NAP NPP Final with print outs 09.06.16.pdf'
+loader = PyPDFLoader(file_path)
 documents = loader.load()
 
-text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-documents = text_splitter.split_documents(documents)
+#Running headers and footers off, then token sized chunks with their page, paragraph and character span
+pages = [{"page_number": document.metadata["page"] + 1, "content": document.page_content} for document in documents]
+strip_document(pages)
+for page, token_count in zip(pages, count_tokens([page["content"] for page in pages])):
+    page["token_count"] = token_count
+documents = dedup_chunks(chunk_pages(pages, file_path), conn=conn)
 
 vectordb = Chroma.from_documents(
   documents,
-  embedding=OpenAIEmbeddings(),
+  embedding=get_embeddings(conn=conn),
   persist_directory=data_directory
 )
 vectordb.persist()
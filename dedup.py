@@ -0,0 +1,319 @@
+#OS imports
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+
+#Vector maths
+import numpy as np
+
+#Same terms as the lexical index
+from lexical import tokenize
+
+#Run metrics
+from metrics import record_span, count
+
+#Chunks whose estimated Jaccard similarity (over DEDUP_SHINGLE word shingles) is at least DEDUP_THRESHOLD are the
+#same chunk. Signatures are DEDUP_BANDS * DEDUP_ROWS MinHash values, chunks sharing all the values of any one band
+#are compared. 16 bands of 8 rows find pairs at 0.8 almost always and pairs under 0.5 almost never.
+dedup_enabled = os.getenv('DEDUP_CHUNKS', 'true').lower() in ('1', 'true', 'yes')
+dedup_threshold = float(os.getenv('DEDUP_THRESHOLD', 0.8))
+dedup_shingle = int(os.getenv('DEDUP_SHINGLE', 3))
+dedup_bands = int(os.getenv('DEDUP_BANDS', 16))
+dedup_rows = int(os.getenv('DEDUP_ROWS', 8))
+
+logger = logging.getLogger(__name__)
+
+#Texts hashed together, bounding the shingles x permutations matrix
+SIGNATURE_BLOCK = 64
+#Fixed so signatures from different runs can be compared
+SIGNATURE_SEED = 1496
+
+#Where every dropped copy came from and the chunk that was kept in its place. A chunk's copies are looked up by the
+#canonical chunk's source, page and char_start.
+def init_duplicate_map(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS chunk_duplicates (
+                        source TEXT NOT NULL,
+                        page INTEGER NOT NULL,
+                        char_start INTEGER NOT NULL,
+                        char_end INTEGER,
+                        paragraph INTEGER,
+                        canonical_source TEXT NOT NULL,
+                        canonical_page INTEGER NOT NULL,
+                        canonical_char_start INTEGER NOT NULL,
+                        similarity REAL NOT NULL,
+                        PRIMARY KEY (source, page, char_start)
+                    ) WITHOUT ROWID''')
+    conn.execute('CREATE INDEX IF NOT EXISTS chunk_duplicates_canonical ON chunk_duplicates (canonical_source, canonical_page, canonical_char_start)')
+    conn.commit()
+    return conn
+
+#The signature of every committed chunk, so a later run dedups against what earlier runs indexed (NearDuplicateIndex.load).
+def init_signature_store(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS chunk_signatures (
+                        source TEXT NOT NULL,
+                        page INTEGER NOT NULL,
+                        char_start INTEGER NOT NULL,
+                        char_end INTEGER,
+                        paragraph INTEGER,
+                        signature BLOB NOT NULL,
+                        PRIMARY KEY (source, page, char_start)
+                    ) WITHOUT ROWID''')
+    conn.commit()
+    return conn
+
+@lru_cache(maxsize=1 << 16)
+def term_hash(term):
+    return hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest()
+
+#Odd multipliers and offsets, one pair per MinHash value.
+@lru_cache(maxsize=None)
+def permutations(count):
+    rng = np.random.default_rng(SIGNATURE_SEED)
+    return (rng.integers(0, 2**63, count, dtype=np.uint64) * np.uint64(2) + np.uint64(1),
+            rng.integers(0, 2**63, count, dtype=np.uint64))
+
+#Shingle hashes of one text: each run of size words folded into one 64 bit value. Texts shorter than that are one shingle.
+def shingle_hashes(text, size=dedup_shingle):
+    terms = tokenize(text) or ['']
+    hashes = np.frombuffer(b''.join(map(term_hash, terms)), dtype='<u8')
+    width = max(1, len(hashes) - size + 1)
+    shingles = np.zeros(width, dtype=np.uint64)
+    for offset in range(min(size, len(hashes))):
+        shingles = shingles * np.uint64(0x100000001B3) + hashes[offset:offset + width]
+    return shingles
+
+#MinHash signature of every text, one row each.
+def minhash_signatures(texts, permutation_count=dedup_bands * dedup_rows, shingle=dedup_shingle):
+    multipliers, offsets = permutations(permutation_count)
+    signatures = np.empty((len(texts), permutation_count), dtype=np.uint32)
+    for block in range(0, len(texts), SIGNATURE_BLOCK):
+        shingles = [shingle_hashes(text, shingle) for text in texts[block:block + SIGNATURE_BLOCK]]
+        lengths = np.array([len(hashes) for hashes in shingles])
+        #One row per text, the shorter ones padded out with their last shingle, which doesn't change the minimum
+        positions = (np.cumsum(lengths) - lengths)[:, None] + np.minimum(np.arange(lengths.max()), lengths[:, None] - 1)
+        #An odd multiplier and an offset, mod 2**64, permute the shingle hashes, the top 32 bits of the least are kept
+        hashed = np.multiply(np.concatenate(shingles)[positions][:, :, None], multipliers)
+        hashed += offsets
+        signatures[block:block + len(shingles)] = hashed.min(axis=1) >> np.uint64(32)
+    return signatures
+
+def location(chunk):
+    metadata = chunk.metadata
+    return {"source": metadata.get("source"), "page": metadata.get("page", 0), "paragraph": metadata.get("paragraph"),
+            "char_start": metadata.get("char_start", 0), "char_end": metadata.get("char_end")}
+
+#Locality sensitive index of the chunks kept so far. Each band of a signature goes in a bucket, the first chunk to
+#land in a bucket stays as its representative, so a chunk is compared with at most one chunk per band however many
+#copies there are. Shared between threads (the watcher's chunk workers) and across the documents of a run, load()
+#brings in what earlier runs committed. A document's chunks only go in once it has been indexed: dedup_chunks keeps
+#what it finds in a pending index of its own (pending()), then commit() puts those chunks in place of any earlier
+#version of the same source. Until then the pending index is in flight, and the documents going through alongside
+#it are matched against it too, so a SOW and its copy arriving together aren't both embedded.
+class NearDuplicateIndex:
+    def __init__(self, threshold=dedup_threshold, bands=dedup_bands, rows=dedup_rows):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.buckets = {}
+        self.signatures = {}
+        self.locations = {}
+        #The entries of each source, and for a pending index the chunk_duplicates rows waiting on the commit
+        self.entries = {}
+        self.sources = set()
+        self.copies = []
+        self.in_flight = set()
+        self.next_entry = 0
+        self.lock = threading.Lock()
+        self.stats = {"chunks": 0, "duplicates": 0, "tokens_saved": 0}
+
+    def band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    #The kept chunk a signature is a near copy of and how similar they are, (None, 0.0) if there isn't one.
+    #Chunks of the sources in skip are never matched, a new version of a document isn't a copy of the old one.
+    def match(self, signature, skip=()):
+        best, similarity = None, 0.0
+        for candidate in {self.buckets[key] for key in self.band_keys(signature) if key in self.buckets}:
+            if self.locations[candidate]["source"] in skip:
+                continue
+            estimate = float(np.mean(self.signatures[candidate] == signature))
+            if estimate >= self.threshold and estimate > similarity:
+                best, similarity = candidate, estimate
+        return best, similarity
+
+    def add(self, signature, chunk_location):
+        entry = self.next_entry
+        self.next_entry += 1
+        for key in self.band_keys(signature):
+            self.buckets.setdefault(key, entry)
+        self.signatures[entry] = signature
+        self.locations[entry] = chunk_location
+        self.entries.setdefault(chunk_location["source"], []).append(entry)
+        return entry
+
+    #Take every chunk of a source out, along with the buckets they represent.
+    def forget(self, source):
+        entries = self.entries.pop(source, [])
+        for entry in entries:
+            for key in self.band_keys(self.signatures.pop(entry)):
+                if self.buckets.get(key) == entry:
+                    del self.buckets[key]
+            del self.locations[entry]
+        return len(entries)
+
+    #The closest match among the documents in flight other than pending's own, as (pending index, entry, similarity).
+    #Call holding the lock.
+    def match_in_flight(self, signature, pending):
+        best = (None, None, 0.0)
+        for other in self.in_flight:
+            if other is pending or other.sources & pending.sources:
+                continue
+            entry, similarity = other.match(signature)
+            if entry is not None and similarity > best[2]:
+                best = (other, entry, similarity)
+        return best
+
+    #An empty index for one document's chunks until they are indexed, see commit. It is in flight until it is
+    #committed or discarded.
+    def pending(self):
+        pending = NearDuplicateIndex(self.threshold, self.bands, self.rows)
+        with self.lock:
+            self.in_flight.add(pending)
+        return pending
+
+    #Drop a pending index whose document failed. Copies already matched against its chunks keep pointing at them,
+    #they are found again once the document is ingested.
+    def discard(self, pending):
+        with self.lock:
+            self.in_flight.discard(pending)
+
+    #Load the signatures committed with a connection, in place of anything already here. Signatures of another size
+    #(DEDUP_BANDS or DEDUP_ROWS changed since) can't be compared and are left out.
+    def load(self, conn):
+        init_signature_store(conn)
+        size = self.bands * self.rows
+        rows = conn.execute('SELECT source, page, char_start, char_end, paragraph, signature FROM chunk_signatures').fetchall()
+        with self.lock:
+            for source in list(self.entries):
+                self.forget(source)
+            for source, page, char_start, char_end, paragraph, signature in rows:
+                signature = np.frombuffer(signature, dtype=np.uint32)
+                if len(signature) == size:
+                    self.add(signature, {"source": source, "page": page, "paragraph": paragraph, "char_start": char_start, "char_end": char_end})
+            self.sources = set(self.entries)
+        logger.info(f'Loaded {len(self.signatures)} chunk signatures of {len(self.sources)} documents')
+        return self
+
+    #Swap the chunks of the sources in a pending index for their earlier versions, and with a connection their
+    #signatures and chunk_duplicates rows too. Call once the chunks are in the vector store, a document that fails is
+    #never committed.
+    def commit(self, pending, conn=None):
+        with self.lock:
+            self.in_flight.discard(pending)
+            for source in pending.sources:
+                self.forget(source)
+            for entry, signature in pending.signatures.items():
+                self.add(signature, pending.locations[entry])
+            self.sources |= pending.sources
+        if conn is not None:
+            init_duplicate_map(conn)
+            init_signature_store(conn)
+            removed = [(source,) for source in pending.sources]
+            conn.executemany('DELETE FROM chunk_signatures WHERE source = ?', removed)
+            conn.executemany('''INSERT OR REPLACE INTO chunk_signatures (source, page, char_start, char_end, paragraph, signature)
+                                VALUES (?, ?, ?, ?, ?, ?)''',
+                             [(chunk_location["source"], chunk_location["page"], chunk_location["char_start"], chunk_location["char_end"],
+                               chunk_location["paragraph"], pending.signatures[entry].tobytes())
+                              for entry, chunk_location in pending.locations.items()])
+            conn.executemany('DELETE FROM chunk_duplicates WHERE source = ?', removed)
+            conn.executemany('''INSERT OR REPLACE INTO chunk_duplicates (source, page, char_start, char_end, paragraph, canonical_source,
+                                canonical_page, canonical_char_start, similarity) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', pending.copies)
+            conn.commit()
+
+    def report(self):
+        chunks = self.stats["chunks"]
+        return {**self.stats, "canonical": chunks - self.stats["duplicates"],
+                "dedup_ratio": round(self.stats["duplicates"] / chunks, 4) if chunks else 0.0,
+                "embedding_calls_saved": self.stats["duplicates"]}
+
+#Drop the chunks that are near copies of one already kept, before they are embedded. A chunk is compared with the
+#chunks kept earlier in its own document, the committed chunks of every other source and the chunks kept so far by
+#the other documents in flight. A kept chunk lists the copies dropped with it in this call in its also_in metadata
+#(a JSON list, vector store metadata has to be flat), and every copy, whichever call kept the original, goes in
+#chunk_duplicates when committed with a connection. Without an index, one is loaded from the connection.
+#Without pending the chunks are committed straight away. Pass index.pending() (the same one for every batch of a
+#streamed document) and commit it once the chunks are indexed otherwise. Returns the chunks to embed, in order,
+#index.report() has the totals.
+def dedup_chunks(chunks, index=None, conn=None, pending=None):
+    chunks = list(chunks)
+    if not dedup_enabled or not chunks:
+        return chunks
+    started = time.perf_counter()
+    if index is None:
+        index = NearDuplicateIndex() if conn is None else NearDuplicateIndex().load(conn)
+    commit = pending is None
+    pending = index.pending() if commit else pending
+    pending.sources.update(chunk.metadata.get("source") for chunk in chunks)
+    signatures = minhash_signatures([chunk.page_content for chunk in chunks])
+
+    kept, copies, rows = [], {}, []
+    first = pending.next_entry
+    with index.lock:
+        for chunk, signature in zip(chunks, signatures):
+            chunk_location = location(chunk)
+            canonical, similarity = pending.match(signature)
+            if canonical is not None:
+                original = pending.locations[canonical]
+                if canonical >= first:
+                    copies.setdefault(canonical, []).append(chunk_location)
+            else:
+                canonical, similarity = index.match(signature, pending.sources)
+                if canonical is not None:
+                    original = index.locations[canonical]
+                else:
+                    other, canonical, similarity = index.match_in_flight(signature, pending)
+                    if canonical is None:
+                        kept.append((pending.add(signature, chunk_location), chunk))
+                        continue
+                    original = other.locations[canonical]
+            rows.append((chunk_location["source"], chunk_location["page"], chunk_location["char_start"], chunk_location["char_end"],
+                         chunk_location["paragraph"], original["source"], original["page"], original["char_start"], round(similarity, 4)))
+            index.stats["tokens_saved"] += chunk.metadata.get("tokens", 0)
+        index.stats["chunks"] += len(chunks)
+        index.stats["duplicates"] += len(rows)
+    pending.copies.extend(rows)
+
+    for entry, chunk in kept:
+        if entry in copies:
+            chunk.metadata["duplicates"] = len(copies[entry])
+            chunk.metadata["also_in"] = json.dumps(copies[entry])
+    if commit:
+        index.commit(pending, conn)
+
+    logger.debug(f'{len(rows)} of {len(chunks)} chunks were near duplicates')
+    record_span('dedup', time.perf_counter() - started, chunks=len(chunks), duplicates=len(rows))
+    count('dedup', 'chunks', len(chunks))
+    count('dedup', 'duplicates', len(rows))
+    return [chunk for _, chunk in kept]
+
+#Every place the text of a kept chunk (its metadata, e.g. from a search result) also appears.
+def duplicate_locations(conn, metadata):
+    init_duplicate_map(conn)
+    return [{"source": source, "page": page, "char_start": char_start, "char_end": char_end, "paragraph": paragraph, "similarity": similarity}
+            for source, page, char_start, char_end, paragraph, similarity in conn.execute(
+                '''SELECT source, page, char_start, char_end, paragraph, similarity FROM chunk_duplicates
+                   WHERE canonical_source = ? AND canonical_page = ? AND canonical_char_start = ? ORDER BY source, page, char_start''',
+                (metadata.get("source"), metadata.get("page", 0), metadata.get("char_start", 0)))]
+
+if __name__ == '__main__':
+    #python dedup.py   chunk the pre processed corpus and report the near duplicates, without writing anything
+    from chunker import chunk_corpus
+    chunks = chunk_corpus()
+    index = NearDuplicateIndex()
+    started = time.perf_counter()
+    dedup_chunks(chunks, index)
+    print(json.dumps({**index.report(), "seconds": round(time.perf_counter() - started, 3)}, indent=4))
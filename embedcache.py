@@ -0,0 +1,136 @@
+#OS imports
+import os
+import time
+import hashlib
+import logging
+from array import array
+
+#Langchain embedding interface, so the cache can go anywhere an embedding function can
+from langchain.embeddings.base import Embeddings
+
+#Bring in the utils
+from utils import init_db
+from metrics import record_span, count
+
+data_conn = os.getenv('DATA_CONNECTION_STRING', './data/database.db')
+embedding_cache_max_mb = float(os.getenv('EMBEDDING_CACHE_MAX_MB', 512))
+
+logger = logging.getLogger(__name__)
+
+#SQLite caps the number of bound variables per statement, so cache lookups go in chunks.
+LOOKUP_CHUNK = 500
+
+def init_embedding_cache(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS embedding_cache (
+                        model TEXT NOT NULL,
+                        text_hash TEXT NOT NULL,
+                        vector BLOB NOT NULL,
+                        last_used REAL NOT NULL,
+                        PRIMARY KEY (model, text_hash)
+                    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS embedding_cache_last_used ON embedding_cache (last_used)')
+    conn.commit()
+    return conn
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+#Vectors are kept as float32, half the size of the floats that come back from the API.
+def pack_vector(vector):
+    return array('f', vector).tobytes()
+
+def unpack_vector(blob):
+    vector = array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
+
+#Wraps any embedding function and remembers every vector by (model, hash of the chunk text).
+#Only texts we have never embedded with this model go through to the wrapped embeddings.
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, conn=None, model=None, max_mb=embedding_cache_max_mb):
+        self.embeddings = embeddings
+        self.model = model or getattr(embeddings, 'model', None) or type(embeddings).__name__
+        self.conn = init_embedding_cache(conn or init_db(data_conn))
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, hashes):
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique_hashes), LOOKUP_CHUNK):
+            chunk = unique_hashes[i:i + LOOKUP_CHUNK]
+            rows = self.conn.execute(
+                f'SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({",".join("?" * len(chunk))})',
+                [self.model, *chunk])
+            found.update((row_hash, unpack_vector(blob)) for row_hash, blob in rows)
+
+        if found:
+            now = time.time()
+            self.conn.executemany('UPDATE embedding_cache SET last_used = ? WHERE model = ? AND text_hash = ?',
+                                  [(now, self.model, row_hash) for row_hash in found])
+        return found
+
+    def _store(self, vectors):
+        now = time.time()
+        self.conn.executemany('INSERT OR REPLACE INTO embedding_cache (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)',
+                              [(self.model, row_hash, pack_vector(vector), now) for row_hash, vector in vectors.items()])
+        self.evict()
+
+    #Drop the least recently used vectors until the cache is back under its size limit.
+    def evict(self):
+        total = self.conn.execute('SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache').fetchone()[0]
+        if total > self.max_bytes:
+            evicted = 0
+            for row_model, row_hash, size in self.conn.execute(
+                    'SELECT model, text_hash, LENGTH(vector) FROM embedding_cache ORDER BY last_used').fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute('DELETE FROM embedding_cache WHERE model = ? AND text_hash = ?', (row_model, row_hash))
+                total -= size
+                evicted += 1
+            logger.info(f'Evicted {evicted} vectors from the embedding cache')
+        self.conn.commit()
+
+    def embed_documents(self, texts):
+        started = time.perf_counter()
+        hashes = [text_hash(text) for text in texts]
+        vectors = self._lookup(hashes)
+
+        missing = {}
+        for text, row_hash in zip(texts, hashes):
+            if row_hash not in vectors:
+                missing.setdefault(row_hash, text)
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        logger.info(f'Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} to embed with {self.model}')
+
+        if missing:
+            embedded = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            self._store(embedded)
+            vectors.update(embedded)
+        else:
+            self.conn.commit()
+
+        record_span('embed', time.perf_counter() - started, model=self.model, texts=len(texts), misses=len(missing))
+        count('embed', 'texts', len(texts))
+        count('embed', 'api_texts', len(missing))
+        return [vectors[row_hash] for row_hash in hashes]
+
+    def embed_query(self, text):
+        started = time.perf_counter()
+        row_hash = text_hash(text)
+        vectors = self._lookup([row_hash])
+        if row_hash in vectors:
+            self.hits += 1
+            self.conn.commit()
+            record_span('embed', time.perf_counter() - started, model=self.model, texts=1, misses=0)
+            return vectors[row_hash]
+
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._store({row_hash: vector})
+        record_span('embed', time.perf_counter() - started, model=self.model, texts=1, misses=1)
+        count('embed', 'api_texts')
+        return vector
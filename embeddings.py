@@ -0,0 +1,83 @@
+#OS imports
+import os
+import hashlib
+import logging
+from functools import lru_cache
+from collections import Counter
+
+#Vector maths
+import numpy as np
+
+#Langchain embedding interface, so the local embedder can go anywhere OpenAIEmbeddings does
+from langchain.embeddings.base import Embeddings
+
+#Same terms as the lexical index
+from lexical import tokenize
+
+#Content addressed cache in front of the API
+from embedcache import CachedEmbeddings
+
+#openai: OpenAIEmbeddings behind the embedding cache
+#hashing: HashingEmbeddings, local and deterministic, for loading, benchmarking and testing without the network.
+#Vectors from different backends (or dimensions) can't share a store, point DATA_DIRECTORY somewhere else when switching.
+embedding_backend = os.getenv('EMBEDDING_BACKEND', 'openai')
+embedding_dim = int(os.getenv('EMBEDDING_DIM', 1536))
+
+logger = logging.getLogger(__name__)
+
+#Every term lands on this many signed positions, a sparse random projection of the term space
+HASH_PROBES = 4
+
+#Bounded so a long streaming ingest keeps a steady working set rather than one entry per term ever seen
+@lru_cache(maxsize=1 << 16)
+def term_digest(term):
+    return hashlib.blake2b(term.encode('utf-8'), digest_size=16).digest()
+
+#Bag of words and word pairs, hashed onto a fixed number of dimensions and L2 normalised.
+#Texts sharing terms come out close together, which is enough to exercise every stage of the index and query path.
+#The same text gives the same vector on any machine, so results can be compared across runs.
+class HashingEmbeddings(Embeddings):
+    def __init__(self, dim=embedding_dim):
+        self.dim = dim
+        self.model = f'hashing-{dim}'
+
+    def _features(self, text):
+        words = tokenize(text)
+        return Counter(words + [f'{a} {b}' for a, b in zip(words, words[1:])])
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        rows, digests, counts = [], [], []
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            rows.extend([row] * len(features))
+            digests.extend(map(term_digest, features))
+            counts.extend(features.values())
+
+        matrix = np.zeros(len(texts) * self.dim, dtype=np.float64)
+        if digests:
+            #First 8 bytes pick the positions, 16 bits each, the last 8 bytes give the signs
+            hashes = np.frombuffer(b''.join(digests), dtype='<u8').reshape(-1, 2)
+            offsets = np.asarray(rows, dtype=np.int64) * self.dim
+            weights = 1 + np.log(np.asarray(counts, dtype=np.float64))
+            for probe in range(HASH_PROBES):
+                positions = ((hashes[:, 0] >> np.uint64(16 * probe)) & np.uint64(0xFFFF)) % np.uint64(self.dim)
+                signs = np.where((hashes[:, 1] >> np.uint64(probe)) & np.uint64(1), 1.0, -1.0)
+                matrix += np.bincount(offsets + positions.astype(np.int64), signs * weights, minlength=len(matrix))
+        matrix = matrix.reshape(len(texts), self.dim).astype(np.float32)
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return (matrix / np.where(norms == 0, 1, norms)).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+#The embedding function the scripts use, picked by EMBEDDING_BACKEND.
+def get_embeddings(backend=None, conn=None):
+    backend = backend or embedding_backend
+    if backend == 'hashing':
+        return HashingEmbeddings()
+    if backend == 'openai':
+        from langchain.embeddings import OpenAIEmbeddings
+        return CachedEmbeddings(OpenAIEmbeddings(), conn=conn)
+    raise ValueError(f'Unknown embedding backend {backend}, expected openai or hashing')
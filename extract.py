@@ -0,0 +1,109 @@
+#OS imports
+import os
+import time
+import logging
+
+#Process pool for spreading pages across cores
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+#PDF tools
+import PyPDF2
+
+#Run metrics
+from metrics import record_span, count
+
+extract_pages_per_task = int(os.getenv('EXTRACT_PAGES_PER_TASK', 25))
+#PyPDF2 keeps every object it has parsed, page content streams and the flattened page tree included, for as long as
+#the reader is open. A new reader every this many pages lets the last one go, which keeps memory flat through a long
+#document. 0 reads the whole range with one reader.
+extract_reader_pages = int(os.getenv('EXTRACT_READER_PAGES', 200))
+
+logger = logging.getLogger(__name__)
+
+def count_pdf_pages(file_path):
+    with open(file_path, 'rb') as pdf_file:
+        return file_path, len(PyPDF2.PdfReader(pdf_file).pages)
+
+#Split a document into (start, end) page ranges, end exclusive and zero based.
+def plan_page_ranges(total_pages, pages_per_task):
+    pages_per_task = max(1, pages_per_task)
+    return [(start, min(start + pages_per_task, total_pages)) for start in range(0, total_pages, pages_per_task)]
+
+#Yield (page, seconds it took) for a contiguous range of pages, to the last page with no end, one page at a time.
+#The file is opened again every reader_pages pages. Token counts are left for the caller to fill in.
+def iter_pdf_pages(file_path, start=0, end=None, reader_pages=extract_reader_pages):
+    end = count_pdf_pages(file_path)[1] if end is None else end
+    window = reader_pages or max(end - start, 1)
+    for window_start in range(start, end, window):
+        with open(file_path, 'rb') as pdf_file:
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            for page_num in range(window_start, min(window_start + window, end)):
+                page_started = time.perf_counter()
+                page_content = pdf_reader.pages[page_num].extract_text()
+                yield {
+                    "page_number": page_num + 1,
+                    "token_count": None,
+                    "content": page_content
+                }, time.perf_counter() - page_started
+
+#Runs inside a worker process: open the PDF and extract a contiguous range of pages, to the last page with no end.
+#Token counts are filled in afterwards, one batch per document, by the parent.
+def extract_page_range(file_path, start=0, end=None):
+    started = time.perf_counter()
+    pages = []
+    page_times = []
+    for page, elapsed in iter_pdf_pages(file_path, start, end):
+        pages.append(page)
+        page_times.append(elapsed)
+
+    return {
+        "file_path": file_path,
+        "start": start,
+        "worker": os.getpid(),
+        "elapsed": time.perf_counter() - started,
+        "page_times": page_times,
+        "pages": pages
+    }
+
+def summarise_workers(results):
+    stats = {}
+    for result in results:
+        worker = stats.setdefault(result["worker"], {"pages": 0, "elapsed": 0.0, "tasks": 0})
+        worker["pages"] += len(result["pages"])
+        worker["elapsed"] += result["elapsed"]
+        worker["tasks"] += 1
+
+    for worker in stats.values():
+        worker["pages_per_second"] = worker["pages"] / worker["elapsed"] if worker["elapsed"] else 0.0
+    return stats
+
+#Extract every page of every file using a pool of processes.
+#Small files go to a single worker whole, large files are cut into page ranges so they spread over the pool.
+#Returns {file_path: [pages in page order]} and the per worker stats. Token counts are left for the caller, after
+#the boilerplate is stripped.
+def extract_pdfs_parallel(file_paths, workers=None, pages_per_task=None):
+    workers = workers or os.cpu_count() or 1
+    pages_per_task = pages_per_task or extract_pages_per_task
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        page_counts = dict(pool.map(count_pdf_pages, file_paths))
+
+        futures = []
+        for file_path in file_paths:
+            logger.debug(f'Found {page_counts[file_path]} pages in {file_path}')
+            for start, end in plan_page_ranges(page_counts[file_path], pages_per_task):
+                futures.append(pool.submit(extract_page_range, file_path, start, end))
+
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    documents = {file_path: [] for file_path in file_paths}
+    for result in sorted(results, key=lambda r: (r["file_path"], r["start"])):
+        documents[result["file_path"]].extend(result["pages"])
+        #Workers time each page, the parent records them
+        for page, elapsed in zip(result["pages"], result["page_times"]):
+            record_span('extract', elapsed, file=os.path.basename(result["file_path"]), page=page["page_number"], worker=result["worker"])
+        count('extract', 'pages', len(result["pages"]))
+
+    return documents, summarise_workers(results)
@@ -0,0 +1,131 @@
+#OS imports
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+#Which chunk ids are in the vector store for each document, so a re-ingest only touches what changed.
+def init_chunk_manifest(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS chunk_manifest (
+                        chunk_id TEXT PRIMARY KEY,
+                        document TEXT NOT NULL,
+                        page INTEGER NOT NULL,
+                        chunk_hash TEXT NOT NULL,
+                        ingested REAL NOT NULL
+                    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS chunk_manifest_document ON chunk_manifest (document, page)')
+    conn.commit()
+    return conn
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+#A chunk's id is derived from where it came from and what it says, so the same chunk always gets the same id.
+#The same text repeated on one page is told apart by its occurrence number.
+def chunk_ids(chunks):
+    seen = {}
+    ids = []
+    for chunk in chunks:
+        key = (chunk.metadata["source"], chunk.metadata.get("page", 0), chunk_hash(chunk.page_content))
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        ids.append((hashlib.sha256(f'{key[0]}\0{key[1]}\0{key[2]}\0{occurrence}'.encode('utf-8')).hexdigest(), key))
+    return ids
+
+#Bring a Chroma collection in line with the chunks of one or more documents:
+#chunks we already hold are kept, new or changed chunks are added and chunks that are no longer
+#in the document (changed text or a page that has gone) are deleted.
+#Pass the chunks' embeddings, in the same order, when they have already been worked out (python watcher.py).
+def incremental_ingest(vectordb, chunks, conn, embeddings=None):
+    init_chunk_manifest(conn)
+    report = {"added": 0, "kept": 0, "removed": 0}
+    chunks = list(chunks)
+    embeddings = [None] * len(chunks) if embeddings is None else embeddings
+
+    by_document = {}
+    for chunk, vector, (chunk_id, key) in zip(chunks, embeddings, chunk_ids(chunks)):
+        by_document.setdefault(key[0], {})[chunk_id] = (chunk, key, vector)
+
+    for document, current in by_document.items():
+        existing = {row[0] for row in conn.execute('SELECT chunk_id FROM chunk_manifest WHERE document = ?', (document,))}
+
+        if not existing:
+            # First incremental run for this document, clear out anything an earlier full load added without ids we know
+            vectordb._collection.delete(where={"source": document})
+
+        new_ids = [chunk_id for chunk_id in current if chunk_id not in existing]
+        stale_ids = [chunk_id for chunk_id in existing if chunk_id not in current]
+
+        if new_ids and current[new_ids[0]][2] is not None:
+            vectordb._collection.add(ids=new_ids,
+                                     embeddings=[list(current[chunk_id][2]) for chunk_id in new_ids],
+                                     documents=[current[chunk_id][0].page_content for chunk_id in new_ids],
+                                     metadatas=[current[chunk_id][0].metadata for chunk_id in new_ids])
+        elif new_ids:
+            vectordb.add_texts(texts=[current[chunk_id][0].page_content for chunk_id in new_ids],
+                               metadatas=[current[chunk_id][0].metadata for chunk_id in new_ids],
+                               ids=new_ids)
+        if stale_ids:
+            vectordb._collection.delete(ids=stale_ids)
+
+        now = time.time()
+        conn.executemany('DELETE FROM chunk_manifest WHERE chunk_id = ?', [(chunk_id,) for chunk_id in stale_ids])
+        conn.executemany('INSERT INTO chunk_manifest (chunk_id, document, page, chunk_hash, ingested) VALUES (?, ?, ?, ?, ?)',
+                         [(chunk_id, document, current[chunk_id][1][1], current[chunk_id][1][2], now) for chunk_id in new_ids])
+        conn.commit()
+
+        kept = len(current) - len(new_ids)
+        logger.info(f'{document}: added {len(new_ids)}, kept {kept}, removed {len(stale_ids)} chunks')
+        report["added"] += len(new_ids)
+        report["kept"] += kept
+        report["removed"] += len(stale_ids)
+
+    return report
+
+#Bring one document in line with its chunks a batch at a time, for documents too big to chunk in one go. Chunk ids
+#come from the text, so a chunk the store already holds is kept as it is, only chunks it hasn't seen are embedded and
+#added, and what the document no longer has is deleted once the last batch is in. A run that fails part way leaves
+#the old chunks searchable next to the new ones added so far, the next run picks up from there without embedding
+#those again. Batches must hold whole pages.
+def stream_ingest(vectordb, document, chunk_batches, conn):
+    init_chunk_manifest(conn)
+    report = {"added": 0, "kept": 0, "removed": 0}
+    #Chunks from an earlier full load are in the collection but not the manifest
+    existing = {row[0] for row in conn.execute('SELECT chunk_id FROM chunk_manifest WHERE document = ?', (document,))}
+    existing.update(vectordb._collection.get(where={"source": document}, include=[])["ids"])
+
+    seen = set()
+    for chunks in chunk_batches:
+        ids = chunk_ids(chunks)
+        new = [(chunk, chunk_id, key) for chunk, (chunk_id, key) in zip(chunks, ids) if chunk_id not in existing and chunk_id not in seen]
+        seen.update(chunk_id for chunk_id, _ in ids)
+        if new:
+            vectordb.add_texts(texts=[chunk.page_content for chunk, _, _ in new], metadatas=[chunk.metadata for chunk, _, _ in new],
+                               ids=[chunk_id for _, chunk_id, _ in new])
+            now = time.time()
+            conn.executemany('INSERT OR REPLACE INTO chunk_manifest (chunk_id, document, page, chunk_hash, ingested) VALUES (?, ?, ?, ?, ?)',
+                             [(chunk_id, key[0], key[1], key[2], now) for _, chunk_id, key in new])
+            conn.commit()
+        report["added"] += len(new)
+
+    stale_ids = list(existing - seen)
+    if stale_ids:
+        vectordb._collection.delete(ids=stale_ids)
+    conn.executemany('DELETE FROM chunk_manifest WHERE chunk_id = ?', [(chunk_id,) for chunk_id in stale_ids])
+    conn.commit()
+    report["kept"] = len(existing & seen)
+    report["removed"] = len(stale_ids)
+
+    logger.info(f'{document}: added {report["added"]}, kept {report["kept"]}, removed {report["removed"]} chunks')
+    return report
+
+#Remove a document from the vector store and the manifest altogether.
+def remove_document(vectordb, document, conn):
+    init_chunk_manifest(conn)
+    ids = [row[0] for row in conn.execute('SELECT chunk_id FROM chunk_manifest WHERE document = ?', (document,))]
+    if ids:
+        vectordb._collection.delete(ids=ids)
+    conn.execute('DELETE FROM chunk_manifest WHERE document = ?', (document,))
+    conn.commit()
+    return len(ids)
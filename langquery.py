@@ -2,8 +2,6 @@ import os
 
 #Env Mgt
 from dotenv import load_dotenv
-from pypdf import PdfReader
-from torch import embedding
 
 api_key = os.getenv('OPENAI_API_KEY')
 data_conn = os.getenv('DATA_CONNECTION_STRING', './data/database.db')
@@ -14,12 +12,14 @@ data_directory= os.getenv('DATA_DIRECTORY', './data')
 log_level = 'INFORMATION'
 
 from langchain.vectorstores import Chroma
-from langchain.embeddings import OpenAIEmbeddings
+from embeddings import get_embeddings
+from vectorstore import open_vector_store
+from lexical import LexicalIndex
+from retrieval import HybridRetriever
+
+#Bring in the utils
+from utils import init_db
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.llms import OpenAI
-from langchain.chains import RetrievalQA
-from langchain.document_loaders import TextLoader
-from langchain.document_loaders import DirectoryLoader
 from langchain.document_loaders import PyPDFLoader
 
 def load_data():
@@ -29,13 +29,28 @@ def load_data():
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
     texts = text_splitter.split_documents(documents)
 
-    embedding = OpenAIEmbeddings()
+    embedding = get_embeddings()
     
     vectordb = Chroma.from_documents(documents=texts, 
                                  embedding=embedding,
                                  persist_directory=data_directory)
     vectordb.persist()
 
+#Both the vector store and the BM25 page index (python lexical.py build) behind one retriever.
+#VECTOR_BACKEND=numpy searches the in process copy built by vectorstore.py instead of going through Chroma.
+def build_retriever(k=2, conn=None):
+    vectordb = open_vector_store(get_embeddings())
+    return HybridRetriever(vectordb, LexicalIndex(conn or init_db(data_conn)), k=k)
+
+#Answer a question, python service.py keeps the retriever loaded between questions.
+def query(question, k=2):
+    return build_retriever(k).get_relevant_documents(question)
+
 if __name__ == '__main__':
-    load_data()
+    import sys
+    if len(sys.argv) > 1:
+        for doc in query(' '.join(sys.argv[1:])):
+            print(doc.metadata, doc.page_content[:200])
+    else:
+        load_data()
 
@@ -3,9 +3,6 @@ import json
 
 #Env Mgt
 from dotenv import load_dotenv
-from pypdf import PdfReader
-from sympy import per
-#from torch import embedding
 
 
 load_dotenv()
@@ -17,13 +14,14 @@ data_source= os.getenv('DATA_SOURCE_DIR', './source')
 data_directory= os.getenv('DATA_DIRECTORY', './data')
 log_level = 'INFORMATION'
 
-from langchain.vectorstores import Chroma
-from langchain.embeddings import OpenAIEmbeddings
+from embeddings import get_embeddings
+#Chroma, or the in process NumPy store with VECTOR_BACKEND=numpy
+from vectorstore import open_vector_store
 
 def load_data():
-    embedding = OpenAIEmbeddings()
+    embedding = get_embeddings()
 
-    vectordb = Chroma(embedding_function=embedding,persist_directory=data_directory)
+    vectordb = open_vector_store(embedding)
     retriever = vectordb.as_retriever(search_kwargs={"k": 2})
     docs = retriever.get_relevant_documents('what are the key deliverables?')
     
@@ -1,15 +1,14 @@
 import os
 import json
-from click import prompt
+import argparse
 
 #Env Mgt
 from dotenv import load_dotenv
-from pypdf import PdfReader
-#from torch import embedding
 
 
 from langchain.vectorstores import Chroma
-from langchain.embeddings import OpenAIEmbeddings
+from embeddings import get_embeddings
+from retrieval import retrieve_many, indexed_documents
 
 load_dotenv()
 
@@ -31,12 +30,26 @@ task = ["What are the key dates?",
     "What are the key constraints?"]
 
 def load_data():
-    embedding = OpenAIEmbeddings()
+    embedding = get_embeddings()
     vectordb = Chroma(embedding_function=embedding,persist_directory=data_directory)
     retriever = vectordb.as_retriever(search_kwargs={"k": 2})
     docs = retriever.get_relevant_documents("What are the key dates?")
 
     print(docs)
+
+#Run the whole task list against every indexed contract (or just the ones asked for),
+#one embedding call for all the questions up front and one query per contract.
+def run_tasks(documents=None, k=2, questions=task):
+    embedding = get_embeddings()
+    vectordb = Chroma(embedding_function=embedding,persist_directory=data_directory)
+
+    vectors = embedding.embed_documents(questions)
+    results = {}
+    for document in documents or indexed_documents(vectordb):
+        answers = retrieve_many(vectordb, questions, k=k, where={"source": document}, vectors=vectors)
+        results[document] = {question: [{"content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+                             for question, docs in answers.items()}
+    return results
     
 def get_more():
     prompt = f'''ROLE:
@@ -63,5 +76,10 @@ def get_more():
     print(response.choices[0].text)
 
 if __name__ == '__main__':
-    load_data()
+    parser = argparse.ArgumentParser(description='Retrieve the top k chunks for every task question from each indexed contract')
+    parser.add_argument('--document', action='append', help='source of a contract to search, repeat for more, default is every indexed contract')
+    parser.add_argument('--k', type=int, default=2)
+    args = parser.parse_args()
+
+    print(json.dumps(run_tasks(args.document, args.k), indent=4))
 
@@ -0,0 +1,333 @@
+#OS imports
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import logging
+from collections import Counter
+
+#Vector maths
+import numpy as np
+
+#Page stores written by the pre processing step
+from pagestore import PageStore, list_stores, INDEX_EXT
+
+data_conn = os.getenv('DATA_CONNECTION_STRING', './data/database.db')
+data_processed= os.getenv('DATA_PROCESSED_DIR', './source/processed')
+data_pre_processed= os.getenv('DATA_PRE_PROCESSED_DIR', './source/preprocessed')
+#BM25 term frequency saturation and length normalisation
+bm25_k1 = float(os.getenv('BM25_K1', 1.2))
+bm25_b = float(os.getenv('BM25_B', 0.75))
+
+logger = logging.getLogger(__name__)
+
+#A BM25 inverted index over the pre processed pages, kept in the same sqlite database as the other caches.
+#   bm25_pages   one row per indexed page: its id, document, page number, length in terms and content hash
+#   bm25_terms   one row per term: the posting list as a varint blob of (page id gap, term frequency) pairs
+#Page ids only ever go up, so new pages are appended to the end of a posting list without rewriting it.
+#A changed or removed page is marked dead and skipped at query time, compact() drops dead pages from the lists.
+def init_lexical_index(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS bm25_pages (
+                        id INTEGER PRIMARY KEY,
+                        document TEXT NOT NULL,
+                        page_number INTEGER NOT NULL,
+                        length INTEGER NOT NULL,
+                        content_hash TEXT NOT NULL,
+                        live INTEGER NOT NULL DEFAULT 1
+                    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS bm25_pages_document ON bm25_pages (document, live)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS bm25_terms (
+                        term TEXT PRIMARY KEY,
+                        last_id INTEGER NOT NULL,
+                        postings BLOB NOT NULL
+                    ) WITHOUT ROWID''')
+    conn.commit()
+    return conn
+
+#Lower case words, keeping clause numbers (4.2.1), codes (SOW_INF, NAB41496) and hyphenated terms whole.
+TERM = re.compile(r'\w+(?:[./-]\w+)*')
+
+def tokenize(text):
+    return TERM.findall(text.lower())
+
+def page_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+#Bytes in each value's varint, up to 10 for the top of the uint64 range.
+def varint_sizes(values):
+    sizes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        sizes += values >= np.uint64(1 << shift)
+    return sizes
+
+#Unsigned LEB128 varints for a whole array at once.
+def encode_varints(values):
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b''
+    sizes = varint_sizes(values)
+    ends = np.cumsum(sizes)
+    out = np.zeros(ends[-1], dtype=np.uint8)
+    position_in_value = np.arange(ends[-1]) - np.repeat(ends - sizes, sizes)
+    owners = np.repeat(values, sizes)
+    out[:] = (owners >> (7 * position_in_value).astype(np.uint64)) & 0x7F
+    out[:-1][np.repeat(sizes, sizes)[:-1] - 1 > position_in_value[:-1]] |= 0x80
+    return out.tobytes()
+
+def decode_varints(data):
+    data = np.frombuffer(data, dtype=np.uint8)
+    if not len(data):
+        return np.empty(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    position_in_value = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7F).astype(np.uint64) << (7 * position_in_value).astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+#A posting list fragment: ids must be increasing and follow previous_id.
+def encode_postings(ids, frequencies, previous_id=0):
+    ids = np.asarray(ids, dtype=np.int64)
+    gaps = np.diff(ids, prepend=previous_id)
+    return encode_varints(np.column_stack([gaps, frequencies]).ravel())
+
+#Many posting list fragments in one go, encoded as a single varint run and cut back up per list.
+def encode_posting_lists(id_lists, frequency_lists, previous_ids):
+    lengths = np.array([len(ids) for ids in id_lists], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    ids = np.concatenate(id_lists).astype(np.int64)
+    gaps = np.diff(ids, prepend=0)
+    gaps[starts] = ids[starts] - np.asarray(previous_ids, dtype=np.int64)
+
+    values = np.column_stack([gaps, np.concatenate(frequency_lists)]).ravel().astype(np.uint64)
+    data = encode_varints(values)
+    posting_sizes = varint_sizes(values).reshape(-1, 2).sum(axis=1)
+    ends = np.cumsum(np.add.reduceat(posting_sizes, starts))
+    return [data[start:end] for start, end in zip(np.concatenate([[0], ends[:-1]]), ends)]
+
+def decode_postings(data):
+    pairs = decode_varints(data).astype(np.int64).reshape(-1, 2)
+    return np.cumsum(pairs[:, 0]), pairs[:, 1]
+
+#Add pages to the index, each page a (document, page_number, content) tuple. Returns the number added.
+def add_pages(conn, pages):
+    pages = list(pages)
+    if not pages:
+        return 0
+    next_id = (conn.execute('SELECT MAX(id) FROM bm25_pages').fetchone()[0] or 0) + 1
+
+    postings = {}
+    rows = []
+    for page_id, (document, page_number, content) in enumerate(pages, next_id):
+        terms = tokenize(content)
+        rows.append((page_id, document, page_number, len(terms), page_hash(content)))
+        for term, frequency in Counter(terms).items():
+            ids, frequencies = postings.setdefault(term, ([], []))
+            ids.append(page_id)
+            frequencies.append(frequency)
+
+    conn.executemany('INSERT INTO bm25_pages (id, document, page_number, length, content_hash) VALUES (?, ?, ?, ?, ?)', rows)
+
+    terms = list(postings)
+    last_ids = {}
+    for start in range(0, len(terms), 500):
+        chunk = terms[start:start + 500]
+        last_ids.update(conn.execute(f'SELECT term, last_id FROM bm25_terms WHERE term IN ({",".join("?" * len(chunk))})', chunk).fetchall())
+
+    conn.executemany('''INSERT INTO bm25_terms (term, last_id, postings) VALUES (?, ?, ?)
+                        ON CONFLICT (term) DO UPDATE SET last_id = excluded.last_id, postings = CAST(postings || excluded.postings AS BLOB)''',
+                     zip(terms, [ids[-1] for ids, _ in postings.values()],
+                         encode_posting_lists([ids for ids, _ in postings.values()], [frequencies for _, frequencies in postings.values()],
+                                              [last_ids.get(term, 0) for term in terms])))
+    return len(pages)
+
+#Bring one document in line with its current pages: unchanged pages are kept, changed and removed pages are
+#marked dead and new or changed pages are added. Returns added/kept/removed counts.
+def index_document(conn, document, pages):
+    current = {page["page_number"]: page["content"] for page in pages}
+    existing = {page_number: (page_id, content_hash) for page_id, page_number, content_hash in
+                conn.execute('SELECT id, page_number, content_hash FROM bm25_pages WHERE document = ? AND live = 1', (document,))}
+
+    dead = [page_id for page_number, (page_id, content_hash) in existing.items()
+            if page_number not in current or page_hash(current[page_number]) != content_hash]
+    new = [(document, page_number, content) for page_number, content in current.items()
+           if page_number not in existing or existing[page_number][0] in dead]
+
+    conn.executemany('UPDATE bm25_pages SET live = 0 WHERE id = ?', [(page_id,) for page_id in dead])
+    added = add_pages(conn, new)
+    conn.commit()
+    return {"added": added, "kept": len(existing) - len(dead), "removed": len(set(existing) - set(current))}
+
+def remove_document(conn, document):
+    conn.execute('UPDATE bm25_pages SET live = 0 WHERE document = ?', (document,))
+    conn.commit()
+
+#Rewrite the posting lists without dead pages and forget the dead pages.
+def compact(conn):
+    dead = np.array([row[0] for row in conn.execute('SELECT id FROM bm25_pages WHERE live = 0')], dtype=np.int64)
+    if not len(dead):
+        return 0
+
+    updates = []
+    deletes = []
+    for term, data in conn.execute('SELECT term, postings FROM bm25_terms'):
+        ids, frequencies = decode_postings(data)
+        keep = ~np.isin(ids, dead)
+        if keep.all():
+            continue
+        if keep.any():
+            updates.append((int(ids[keep][-1]), encode_postings(ids[keep], frequencies[keep]), term))
+        else:
+            deletes.append((term,))
+
+    conn.executemany('UPDATE bm25_terms SET last_id = ?, postings = ? WHERE term = ?', updates)
+    conn.executemany('DELETE FROM bm25_terms WHERE term = ?', deletes)
+    conn.execute('DELETE FROM bm25_pages WHERE live = 0')
+    conn.commit()
+    logger.info(f'Compacted {len(updates)} posting lists, dropped {len(deletes)} terms and {len(dead)} pages')
+    return len(dead)
+
+#Every page store (and any legacy JSON) in the pre processed and processed directories, as (document, pages).
+def corpus_documents(directories=(data_pre_processed, data_processed)):
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for stem in list_stores(directory):
+            with PageStore(stem, writable=False) as store:
+                yield store.metadata.get("document_name", os.path.basename(stem)), list(store.iter_pages())
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.json') and not filename.startswith('.'):
+                with open(os.path.join(directory, filename), 'r') as f:
+                    document = json.load(f)
+                yield document.get("document_name", filename), document["pages"]
+
+#Where a document's pages are now: its page store (named after the pdf) or legacy JSON, pre processed first.
+def find_document(document, directories=(data_pre_processed, data_processed)):
+    stem = os.path.splitext(document)[0]
+    for directory in directories:
+        if os.path.exists(os.path.join(directory, stem + INDEX_EXT)):
+            return os.path.join(directory, stem)
+        if os.path.exists(os.path.join(directory, stem + '.json')):
+            return os.path.join(directory, stem + '.json')
+    return None
+
+#Index the whole corpus incrementally and drop documents that are no longer in it.
+def build_index(conn, directories=(data_pre_processed, data_processed)):
+    init_lexical_index(conn)
+    started = time.perf_counter()
+    report = {"documents": 0, "added": 0, "kept": 0, "removed": 0}
+    seen = set()
+    for document, pages in corpus_documents(directories):
+        seen.add(document)
+        result = index_document(conn, document, pages)
+        report["documents"] += 1
+        for key in ("added", "kept", "removed"):
+            report[key] += result[key]
+
+    for (document,) in conn.execute('SELECT DISTINCT document FROM bm25_pages WHERE live = 1').fetchall():
+        if document not in seen:
+            report["removed"] += conn.execute('SELECT COUNT(*) FROM bm25_pages WHERE document = ? AND live = 1', (document,)).fetchone()[0]
+            remove_document(conn, document)
+
+    dead, total = conn.execute('SELECT SUM(live = 0), COUNT(*) FROM bm25_pages').fetchone()
+    if dead and dead * 2 > total:
+        compact(conn)
+    logger.info(f'Lexical index: {report} in {time.perf_counter() - started:.2f}s')
+    return report
+
+#Scores queries against a snapshot of the page table, posting lists are read from sqlite per query term.
+class LexicalIndex:
+    def __init__(self, conn, k1=bm25_k1, b=bm25_b, directories=(data_pre_processed, data_processed)):
+        self.conn = init_lexical_index(conn)
+        self.k1 = k1
+        self.b = b
+        self.directories = directories
+        self.sources = {}
+        self.refresh()
+
+    def refresh(self):
+        rows = self.conn.execute('SELECT id, document, page_number, length, live FROM bm25_pages ORDER BY id').fetchall()
+        size = (rows[-1][0] + 1) if rows else 1
+        self.lengths = np.zeros(size, dtype=np.float32)
+        self.live = np.zeros(size, dtype=bool)
+        self.documents = np.full(size, '', dtype=object)
+        self.pages = {}
+        for page_id, document, page_number, length, live in rows:
+            self.lengths[page_id] = length
+            self.live[page_id] = bool(live)
+            self.documents[page_id] = document
+            self.pages[page_id] = (document, page_number)
+        self.count = int(self.live.sum())
+        self.average_length = float(self.lengths[self.live].mean()) if self.count else 0.0
+
+    def __len__(self):
+        return self.count
+
+    def postings(self, term):
+        row = self.conn.execute('SELECT postings FROM bm25_terms WHERE term = ?', (term,)).fetchone()
+        if row is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        ids, frequencies = decode_postings(row[0])
+        #Pages added since the last refresh are beyond the snapshot
+        keep = ids < len(self.live)
+        ids, frequencies = ids[keep], frequencies[keep]
+        keep = self.live[ids]
+        return ids[keep], frequencies[keep]
+
+    #The text of an indexed page, read from the document's page store so the index doesn't hold a copy.
+    def page_text(self, document, page_number):
+        if document not in self.sources:
+            path = find_document(document, self.directories)
+            if path is None:
+                self.sources[document] = None
+            elif path.endswith('.json'):
+                with open(path, 'r') as f:
+                    self.sources[document] = {page["page_number"]: page["content"] for page in json.load(f)["pages"]}
+            else:
+                self.sources[document] = PageStore(path, writable=False)
+
+        source = self.sources[document]
+        if source is None:
+            return ''
+        if isinstance(source, dict):
+            return source.get(page_number, '')
+        return source.get_page(page_number)["content"] if page_number in source.positions else ''
+
+    #BM25 over the live pages, optionally narrowed to one document.
+    #Returns [(document, page_number, score), ...] best first, only pages that match at least one term.
+    def search(self, query, k=4, document=None):
+        if not self.count:
+            return []
+        scores = np.zeros(len(self.live), dtype=np.float32)
+        for term in set(tokenize(query)):
+            ids, frequencies = self.postings(term)
+            if not len(ids):
+                continue
+            idf = np.log(1 + (self.count - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[ids] / self.average_length)
+            scores[ids] += idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+
+        if document is not None:
+            scores[self.documents != document] = 0
+        matched = np.flatnonzero(scores > 0)
+        best = matched[np.argsort(-scores[matched], kind='stable')[:k]]
+        return [(*self.pages[int(page_id)], float(scores[page_id])) for page_id in best]
+
+if __name__ == '__main__':
+    #python lexical.py build           index (or re-index) the pre processed and processed pages
+    #python lexical.py search <query>  top pages for a query
+    #python lexical.py compact         drop dead pages from the posting lists
+    from utils import init_db
+    logging.basicConfig(level=logging.INFO)
+    conn = init_lexical_index(init_db(data_conn))
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'build':
+        print(json.dumps(build_index(conn), indent=4))
+    elif command == 'search':
+        for document, page_number, score in LexicalIndex(conn).search(' '.join(sys.argv[2:]), k=10):
+            print(f'{score:8.3f}  {document} page {page_number}')
+    elif command == 'compact':
+        print(f'Dropped {compact(conn)} dead pages')
+    else:
+        raise SystemExit(f'Unknown command {command}, expected build, search or compact')
@@ -0,0 +1,154 @@
+#OS imports
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+
+#AI Client
+import openai
+
+#Bring in the utils
+from utils import init_db
+from metrics import record_llm_call
+
+data_conn = os.getenv('DATA_CONNECTION_STRING', './data/database.db')
+llm_cache_ttl_days = float(os.getenv('LLM_CACHE_TTL_DAYS', 30))
+llm_cache_max_mb = float(os.getenv('LLM_CACHE_MAX_MB', 256))
+#Skip reading the cache (answers are still written back), for when we want fresh answers
+llm_cache_bypass = os.getenv('LLM_CACHE_BYPASS', 'false').lower() in ('1', 'true', 'yes')
+
+logger = logging.getLogger(__name__)
+
+stats = {"hits": 0, "misses": 0, "bypassed": 0}
+
+#SQLite connections can't be shared across threads, the expert reviews call in from a thread pool.
+_local = threading.local()
+
+def init_llm_cache(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS llm_cache (
+                        request_hash TEXT PRIMARY KEY,
+                        model TEXT NOT NULL,
+                        response TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        created REAL NOT NULL,
+                        last_used REAL NOT NULL,
+                        hits INTEGER NOT NULL DEFAULT 0
+                    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)')
+    conn.execute('CREATE INDEX IF NOT EXISTS llm_cache_created ON llm_cache (created)')
+    conn.commit()
+    return conn
+
+def get_cache_conn():
+    if not hasattr(_local, 'conn'):
+        _local.conn = init_llm_cache(init_db(data_conn))
+    return _local.conn
+
+#Everything that decides the answer goes in the key: model, messages, function schemas and function_call, and
+#the backend when it isn't OpenAI, so the stub's canned answers are never served to a real run.
+def request_hash(request, backend=None):
+    key = {name: request.get(name) for name in ("model", "messages", "functions", "function_call", "temperature")}
+    if backend:
+        key["backend"] = backend
+    return hashlib.sha256(json.dumps(key, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+def lookup(conn, key):
+    row = conn.execute('SELECT response, created FROM llm_cache WHERE request_hash = ?', (key,)).fetchone()
+    if row is None:
+        return None
+    if row[1] < time.time() - llm_cache_ttl_days * 86400:
+        conn.execute('DELETE FROM llm_cache WHERE request_hash = ?', (key,))
+        conn.commit()
+        return None
+
+    conn.execute('UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE request_hash = ?', (time.time(), key))
+    conn.commit()
+    return openai.util.convert_to_openai_object(json.loads(row[0]))
+
+def store(conn, key, request, response):
+    data = json.dumps(response)
+    now = time.time()
+    conn.execute('INSERT OR REPLACE INTO llm_cache (request_hash, model, response, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                 (key, request.get("model", ""), data, len(data), now, now))
+    evict(conn)
+
+#Drop expired answers, then the least recently used until the cache is back under its size limit.
+def evict(conn):
+    conn.execute('DELETE FROM llm_cache WHERE created < ?', (time.time() - llm_cache_ttl_days * 86400,))
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+    max_bytes = llm_cache_max_mb * 1024 * 1024
+    if total > max_bytes:
+        for key, size in conn.execute('SELECT request_hash, size FROM llm_cache ORDER BY last_used').fetchall():
+            if total <= max_bytes:
+                break
+            conn.execute('DELETE FROM llm_cache WHERE request_hash = ?', (key,))
+            total -= size
+    conn.commit()
+
+def cacheable(response):
+    try:
+        return bool(response["choices"]) and bool(response["choices"][0]["message"])
+    except (KeyError, IndexError, TypeError):
+        return False
+
+#The create function standing in for OpenAI's, e.g. llmstub.stub_create, None for OpenAI itself.
+def backend_name(create):
+    if create is None:
+        return None
+    return f'{getattr(create, "__module__", "")}.{getattr(create, "__qualname__", type(create).__name__)}'
+
+def _check(request, bypass, create=None):
+    bypass = llm_cache_bypass if bypass is None else bypass
+    key = request_hash(request, backend_name(create))
+    if bypass:
+        stats["bypassed"] += 1
+        return key, None
+
+    response = lookup(get_cache_conn(), key)
+    if response is None:
+        stats["misses"] += 1
+    else:
+        stats["hits"] += 1
+        logger.debug(f'LLM cache hit {key[:12]} for {request.get("model")}')
+    return key, response
+
+#Drop in for openai.ChatCompletion.create: answers an identical earlier request from the cache.
+#Every call is recorded in the run metrics, cache hits included.
+def cached_create(create=None, bypass=None, **request):
+    started = time.perf_counter()
+    key, response = _check(request, bypass, create)
+    cached = response is not None
+    if response is None:
+        response = (create or openai.ChatCompletion.create)(**request)
+        if cacheable(response):
+            store(get_cache_conn(), key, request, response)
+    record_llm_call(request.get("model"), response.get("usage"), time.perf_counter() - started, cached)
+    return response
+
+#Drop in for openai.ChatCompletion.acreate.
+async def cached_acreate(create=None, bypass=None, **request):
+    started = time.perf_counter()
+    key, response = _check(request, bypass, create)
+    cached = response is not None
+    if response is None:
+        response = await (create or openai.ChatCompletion.acreate)(**request)
+        if cacheable(response):
+            store(get_cache_conn(), key, request, response)
+    record_llm_call(request.get("model"), response.get("usage"), time.perf_counter() - started, cached)
+    return response
+
+def cache_report(conn=None):
+    conn = conn or get_cache_conn()
+    entries, size, hits = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM llm_cache').fetchone()
+    return {"entries": entries, "size_mb": round(size / 1024 / 1024, 3), "stored_hits": hits, **stats}
+
+if __name__ == '__main__':
+    #python llmcache.py [stats|clear]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if command == 'clear':
+        get_cache_conn().execute('DELETE FROM llm_cache')
+        get_cache_conn().commit()
+    print(json.dumps(cache_report(), indent=4))
@@ -0,0 +1,131 @@
+#OS imports
+import os
+import json
+import time
+import asyncio
+import logging
+
+#Token counter for modeling size to stuff into GPT
+from tokens import count_tokens
+
+#Content addressed cache of LLM responses
+from llmcache import cached_acreate
+
+content_model = os.getenv('CONTENT_MODEL', 'gpt-3.5-turbo-16k')
+llm_concurrency = int(os.getenv('LLM_CONCURRENCY', 8))
+llm_requests_per_minute = int(os.getenv('LLM_REQUESTS_PER_MINUTE', 3500))
+llm_tokens_per_minute = int(os.getenv('LLM_TOKENS_PER_MINUTE', 180000))
+#What we budget for each completion before we know how long it really is
+llm_completion_tokens = int(os.getenv('LLM_COMPLETION_TOKENS', 1000))
+
+logger = logging.getLogger(__name__)
+
+#Classic token bucket: holds up to capacity, refills at capacity per minute.
+#The level can go negative when a call turns out to use more than was reserved, later calls then wait it off.
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    #How long until amount is available, 0 if it can be taken now.
+    def wait_time(self, amount):
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+#Requests per minute and tokens per minute limits together, a call goes once both buckets have room.
+class RateLimiter:
+    def __init__(self, requests_per_minute=llm_requests_per_minute, tokens_per_minute=llm_tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens):
+        async with self.lock:
+            while True:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+
+    #Settle up once the real usage is known.
+    def adjust(self, reserved, used):
+        self.tokens.take(used - reserved)
+
+def content_request(prompt, batch, content_schema, model=content_model):
+    prompttext = f'''{prompt} Dont populate the reviewers list at this stage.
+    INPUT:
+    {batch}
+    '''
+    return {
+        "model": model,
+        "messages": [{"role": "assistant", "content": prompttext}],
+        "functions": [content_schema],
+        "function_call": {"name": content_schema["name"]}
+    }
+
+def estimate_tokens(request):
+    return count_tokens([json.dumps(request["messages"]) + json.dumps(request.get("functions", []))])[0] + llm_completion_tokens
+
+def function_arguments(response):
+    return json.loads(response["choices"][0]["message"]["function_call"]["arguments"])
+
+#Send every request to the model concurrently, at most concurrency in flight and inside the rate limits.
+#Results come back in the same order as the requests, a failed call gives {"Error": ...} in its slot.
+async def run_requests(requests, create=None, concurrency=llm_concurrency, limiter=None):
+    create = create or cached_acreate
+    limiter = limiter or RateLimiter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(i, request):
+        reserved = estimate_tokens(request)
+        async with semaphore:
+            await limiter.acquire(reserved)
+            started = time.perf_counter()
+            try:
+                response = await create(**request)
+            except Exception as e:
+                logger.error(f'Request {i} failed: {e}')
+                limiter.adjust(reserved, 0)
+                return {"Error": str(e)}
+
+            usage = response.get("usage") or {}
+            limiter.adjust(reserved, usage.get("total_tokens", reserved))
+            logger.debug(f'Request {i} took {time.perf_counter() - started:.2f}s, {usage.get("total_tokens")} tokens')
+            return response
+
+    return await asyncio.gather(*(run_one(i, request) for i, request in enumerate(requests)))
+
+#Run get_content over every batch at once and return the content_summary results in page order.
+async def run_content_batches(batches, prompt, content_schema, create=None, concurrency=llm_concurrency, limiter=None, model=content_model):
+    started = time.perf_counter()
+    requests = [content_request(prompt, batch, content_schema, model) for batch in batches]
+    responses = await run_requests(requests, create, concurrency, limiter)
+
+    results = []
+    for response in responses:
+        if "Error" in response:
+            results.append(response)
+            continue
+        try:
+            results.append(function_arguments(response))
+        except (KeyError, IndexError, ValueError) as e:
+            logger.error(f'Chatgpt output: {response}')
+            results.append({"Error": f"Chat GPT Error: {e}"})
+
+    elapsed = time.perf_counter() - started
+    logger.info(f'Ran {len(batches)} batches in {elapsed:.2f}s, {len(batches) / elapsed if elapsed else 0:.1f} batches/second')
+    return results
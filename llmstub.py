@@ -0,0 +1,115 @@
+#OS imports
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import logging
+
+#AI Client, the in process stub hands back the same response objects the client does
+import openai
+
+#A stand in for the OpenAI chat completions endpoint so the LLM stages can be run and timed offline.
+#Either call stub_acreate in process in place of openai.ChatCompletion.acreate, or run this file and point
+#OPENAI_API_BASE at http://127.0.0.1:<port>/v1 to go through the real client.
+stub_latency = float(os.getenv('LLM_STUB_LATENCY', 0.5))
+stub_port = int(os.getenv('LLM_STUB_PORT', 8765))
+
+logger = logging.getLogger(__name__)
+
+PAGE_NUMBER = re.compile(r"""['"]page_number['"]:\s*(\d+)""")
+
+#Build a minimal object that fits a JSON schema, following pydantic's $ref definitions. Arrays get one item.
+def stub_value(schema, definitions, name='stub'):
+    if '$ref' in schema:
+        return stub_value(definitions[schema['$ref'].split('/')[-1]], definitions, name)
+    if 'allOf' in schema:
+        return stub_value(schema['allOf'][0], definitions, name)
+
+    kind = schema.get('type')
+    if kind == 'object':
+        return {key: stub_value(value, definitions, key) for key, value in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [stub_value(schema.get('items', {}), definitions, name)]
+    if kind == 'integer':
+        return 1
+    if kind == 'number':
+        return 1.0
+    if kind == 'boolean':
+        return True
+    if schema.get('format') == 'date':
+        return time.strftime("%Y-%m-%d")
+    return f'Stub {name}'
+
+#Answer in the shape of a chat completion. A function call gets arguments built from the function's schema,
+#with one content section per page seen in the prompt when the schema has content_sections.
+def stub_response(request):
+    prompttext = ' '.join(message.get("content") or '' for message in request.get("messages", []))
+    prompt_tokens = len(prompttext) // 4
+    message = {"role": "assistant", "content": None}
+
+    function_call = request.get("function_call")
+    if isinstance(function_call, dict):
+        functions = {function["name"]: function for function in request.get("functions", [])}
+        schema = functions.get(function_call["name"], {}).get("parameters", {})
+        arguments = stub_value(schema, schema.get("definitions", {}))
+        if isinstance(arguments, dict) and "content_sections" in arguments:
+            pages = sorted({int(page) for page in PAGE_NUMBER.findall(prompttext)})
+            arguments["content_sections"] = [{"page_number": page, "summary": f"Summary of page {page}", "reference": []} for page in pages]
+        message["function_call"] = {"name": function_call["name"], "arguments": json.dumps(arguments)}
+    else:
+        message["content"] = json.dumps({"reviewers": [{"name": "Stub reviewer", "feedback": "Stub feedback"}]})
+
+    completion_tokens = len(json.dumps(message)) // 4
+    return {
+        "id": "stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+    }
+
+async def stub_acreate(latency=None, **request):
+    await asyncio.sleep(stub_latency if latency is None else latency)
+    return openai.util.convert_to_openai_object(stub_response(request))
+
+def stub_create(latency=None, **request):
+    time.sleep(stub_latency if latency is None else latency)
+    return openai.util.convert_to_openai_object(stub_response(request))
+
+async def handle_http(reader, writer):
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        if len(request_line) >= 2 and request_line[0] == 'POST' and request_line[1].endswith('/chat/completions'):
+            payload = await stub_acreate(**json.loads(body or b'{}'))
+            status = '200 OK'
+        else:
+            payload = {"error": {"message": f"Not found: {' '.join(request_line)}"}}
+            status = '404 Not Found'
+
+        data = json.dumps(payload).encode('utf-8')
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + data)
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def serve(port=stub_port):
+    server = await asyncio.start_server(handle_http, '127.0.0.1', port)
+    logger.info(f'Stub model listening on http://127.0.0.1:{port}/v1 with {stub_latency}s latency')
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(int(sys.argv[1]) if len(sys.argv) > 1 else stub_port))
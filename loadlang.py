@@ -2,8 +2,6 @@ import os
 
 #Env Mgt
 from dotenv import load_dotenv
-from pypdf import PdfReader
-from torch import embedding
 
 api_key = os.getenv('OPENAI_API_KEY')
 data_conn = os.getenv('DATA_CONNECTION_STRING', './data/database.db')
@@ -11,30 +9,75 @@ data_processed= os.getenv('DATA_PROCESSED_DIR', './source/processed')
 data_pre_processed= os.getenv('DATA_PRE_PROCESSED_DIR', './source/preprocessed')
 data_source= os.getenv('DATA_SOURCE_DIR', './source')
 data_directory= os.getenv('DATA_DIRECTORY', './data')
+ingest_mode= os.getenv('INGEST_MODE', 'incremental')
 log_level = 'INFORMATION'
 
 from langchain.vectorstores import Chroma
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.llms import OpenAI
-from langchain.chains import RetrievalQA
-from langchain.document_loaders import TextLoader
-from langchain.document_loaders import DirectoryLoader
+from embeddings import get_embeddings
 from langchain.document_loaders import PyPDFLoader
 
-def load_data():
-    loader = PyPDFLoader(f'{data_source}/NAP NPP Final with print outs 09.06.16.pdf')
+#Bring in the utils
+from utils import init_db, batched
+from tokens import count_tokens
+from boilerplate import strip_document
+from chunker import chunk_pages
+from dedup import dedup_chunks, NearDuplicateIndex
+from ingest import incremental_ingest, stream_ingest
+from preprocess import stream_document, stream_batch_pages
+
+#Pages are chunked by tokens, CHUNK_TOKENS long and CHUNK_OVERLAP_TOKENS into the chunk before (chunker.py).
+#In incremental mode only new or changed chunks are embedded and added, chunks that have gone are deleted.
+#Full mode adds every chunk again. Stream mode never holds more than STREAM_BATCH_PAGES pages, see load_data_streaming.
+#Near duplicate chunks are dropped before embedding, the copies are recorded against the chunk kept (dedup.py) once
+#the chunks are in the vector store.
+def load_data(mode=ingest_mode):
+    if mode == 'stream':
+        return load_data_streaming()
+
+    file_path = f'{data_source}/NAP NPP Final with print outs 09.06.16.pdf'
+    loader = PyPDFLoader(file_path)
     documents = loader.load()
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    texts = text_splitter.split_documents(documents)
+    pages = [{"page_number": document.metadata["page"] + 1, "content": document.page_content} for document in documents]
+    strip_document(pages)
+    for page, token_count in zip(pages, count_tokens([page["content"] for page in pages])):
+        page["token_count"] = token_count
+    conn = init_db(data_conn)
+    duplicates = NearDuplicateIndex().load(conn)
+    pending = duplicates.pending()
+    texts = dedup_chunks(chunk_pages(pages, file_path), duplicates, pending=pending)
+    print(f'Dropped {duplicates.stats["duplicates"]} near duplicate chunks of {duplicates.stats["chunks"]}')
+
+    embedding = get_embeddings()
+
+    if mode == 'incremental':
+        vectordb = Chroma(embedding_function=embedding, persist_directory=data_directory)
+        report = incremental_ingest(vectordb, texts, conn)
+        print(f'Added {report["added"]}, kept {report["kept"]}, removed {report["removed"]} chunks')
+    else:
+        vectordb = Chroma.from_documents(documents=texts, 
+                                     embedding=embedding,
+                                     persist_directory=data_directory)
+    vectordb.persist()
+    duplicates.commit(pending, conn)
+
+#Pages go from the PDF to the page store, the chunker and the vector store a batch at a time,
+#so a multi thousand page bundle loads in the same memory as a short contract.
+def load_data_streaming(file_path=f'{data_source}/NAP NPP Final with print outs 09.06.16.pdf', batch_size=stream_batch_pages):
+    vectordb = Chroma(embedding_function=get_embeddings(), persist_directory=data_directory)
+    conn = init_db(data_conn)
+    duplicates = NearDuplicateIndex().load(conn)
+    pending = duplicates.pending()
+
+    def chunk_batches():
+        for pages in batched(stream_document(file_path, batch_size), batch_size):
+            yield dedup_chunks(chunk_pages(pages, file_path), duplicates, pending=pending)
 
-    embedding = OpenAIEmbeddings(openai_api_key=api_key)
-    
-    vectordb = Chroma.from_documents(documents=texts, 
-                                 embedding=embedding,
-                                 persist_directory=data_directory)
+    report = stream_ingest(vectordb, file_path, chunk_batches(), conn)
+    print(f'Added {report["added"]}, kept {report["kept"]}, removed {report["removed"]} chunks, '
+          f'dropped {duplicates.stats["duplicates"]} near duplicates')
     vectordb.persist()
+    duplicates.commit(pending, conn)
 
 if __name__ == '__main__':
     load_dotenv()
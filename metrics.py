@@ -0,0 +1,198 @@
+#OS imports
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+#Bring in the utils
+from utils import init_db
+
+data_conn = os.getenv('DATA_CONNECTION_STRING', './data/database.db')
+metrics_enabled = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+#Set to group several processes (or a rerun) under one run
+run_id = os.getenv('METRICS_RUN_ID') or f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}'
+#Events are kept in memory and written in one transaction once this many have built up, and at exit
+METRICS_FLUSH_EVENTS = 500
+
+logger = logging.getLogger(__name__)
+
+#US dollars per 1000 prompt and completion tokens, matched on the longest model name prefix.
+#METRICS_PRICES takes a JSON object of the same shape to add or override models.
+PRICES = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "text-embedding-ada-002": (0.0001, 0.0),
+}
+PRICES.update({model: tuple(price) for model, price in json.loads(os.getenv('METRICS_PRICES', '{}')).items()})
+
+_lock = threading.Lock()
+_spans = []
+_counters = {}
+_started = time.time()
+
+#Where a run spent its time:
+#   metric_runs       one row per run: id, command line, when it started and its last flush
+#   metric_spans      one row per timed call: stage, start, duration and whatever the caller attached (tokens, pages, ...)
+#   metric_counters   running totals per run, stage and name
+def init_metrics(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS metric_runs (
+                        run_id TEXT PRIMARY KEY,
+                        command TEXT NOT NULL,
+                        started REAL NOT NULL,
+                        finished REAL NOT NULL
+                    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS metric_spans (
+                        run_id TEXT NOT NULL,
+                        stage TEXT NOT NULL,
+                        started REAL NOT NULL,
+                        duration REAL NOT NULL,
+                        attributes TEXT NOT NULL
+                    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS metric_spans_run ON metric_spans (run_id, stage)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS metric_counters (
+                        run_id TEXT NOT NULL,
+                        stage TEXT NOT NULL,
+                        name TEXT NOT NULL,
+                        value REAL NOT NULL,
+                        PRIMARY KEY (run_id, stage, name)
+                    )''')
+    conn.commit()
+    return conn
+
+def estimate_cost(model, prompt_tokens, completion_tokens=0):
+    matches = [name for name in PRICES if (model or '').startswith(name)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+def record_span(stage, duration, started=None, **attributes):
+    if not metrics_enabled:
+        return
+    with _lock:
+        _spans.append((run_id, stage, started if started is not None else time.time() - duration, duration, json.dumps(attributes, default=str)))
+        full = len(_spans) >= METRICS_FLUSH_EVENTS
+    if full:
+        flush()
+
+def count(stage, name, value=1):
+    if not metrics_enabled:
+        return
+    with _lock:
+        _counters[(stage, name)] = _counters.get((stage, name), 0) + value
+
+#Time a block. Attributes can be added to the yielded dict inside the block, e.g. the number of cache misses.
+@contextmanager
+def span(stage, **attributes):
+    started = time.time()
+    clock = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        record_span(stage, time.perf_counter() - clock, started, **attributes)
+
+#One chat completion: latency, token usage and what it would have cost. Cache hits cost nothing.
+def record_llm_call(model, usage, duration, cached=False, stage='llm'):
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+    cost = 0.0 if cached else estimate_cost(model, prompt_tokens, completion_tokens)
+    record_span(stage, duration, model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                cost=round(cost, 6), cached=cached)
+    count(stage, 'calls')
+    count(stage, 'cache_hits' if cached else 'api_calls')
+    if not cached:
+        count(stage, 'prompt_tokens', prompt_tokens)
+        count(stage, 'completion_tokens', completion_tokens)
+        count(stage, 'cost_usd', cost)
+
+def flush():
+    with _lock:
+        spans = _spans[:]
+        del _spans[:]
+        counters = dict(_counters)
+        _counters.clear()
+    if not spans and not counters:
+        return
+
+    try:
+        conn = init_metrics(init_db(data_conn))
+        now = time.time()
+        conn.execute('''INSERT INTO metric_runs (run_id, command, started, finished) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (run_id) DO UPDATE SET finished = excluded.finished''',
+                     (run_id, ' '.join(sys.argv), _started, now))
+        conn.executemany('INSERT INTO metric_spans (run_id, stage, started, duration, attributes) VALUES (?, ?, ?, ?, ?)', spans)
+        conn.executemany('''INSERT INTO metric_counters (run_id, stage, name, value) VALUES (?, ?, ?, ?)
+                            ON CONFLICT (run_id, stage, name) DO UPDATE SET value = value + excluded.value''',
+                         [(run_id, stage, name, value) for (stage, name), value in counters.items()])
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f'Could not write metrics: {e}')
+
+atexit.register(flush)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] if values else 0.0
+
+#Per stage timings, the counters and the LLM token usage and cost by model for one run, the latest by default.
+def run_report(conn, report_run_id=None):
+    init_metrics(conn)
+    if report_run_id is None:
+        row = conn.execute('SELECT run_id FROM metric_runs ORDER BY started DESC LIMIT 1').fetchone()
+        if row is None:
+            return {}
+        report_run_id = row[0]
+    run = conn.execute('SELECT command, started, finished FROM metric_runs WHERE run_id = ?', (report_run_id,)).fetchone()
+    if run is None:
+        raise ValueError(f'No metrics for run {report_run_id}')
+
+    durations = {}
+    models = {}
+    for stage, duration, attributes in conn.execute('SELECT stage, duration, attributes FROM metric_spans WHERE run_id = ?', (report_run_id,)):
+        durations.setdefault(stage, []).append(duration)
+        attributes = json.loads(attributes)
+        if "model" in attributes and "prompt_tokens" in attributes:
+            model = models.setdefault(attributes["model"], {"calls": 0, "cached": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+            model["calls"] += 1
+            if attributes.get("cached"):
+                model["cached"] += 1
+                continue
+            model["prompt_tokens"] += attributes["prompt_tokens"]
+            model["completion_tokens"] += attributes["completion_tokens"]
+            model["cost_usd"] = round(model["cost_usd"] + attributes.get("cost", 0.0), 6)
+
+    stages = {stage: {"spans": len(values), "total_s": round(sum(values), 3), "mean_ms": round(sum(values) / len(values) * 1000, 3),
+                      "p50_ms": round(percentile(values, 0.5) * 1000, 3), "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+                      "max_ms": round(max(values) * 1000, 3)}
+              for stage, values in sorted(durations.items())}
+    counters = {}
+    for stage, name, value in conn.execute('SELECT stage, name, value FROM metric_counters WHERE run_id = ? ORDER BY stage, name', (report_run_id,)):
+        counters.setdefault(stage, {})[name] = round(value, 6)
+
+    return {"run_id": report_run_id, "command": run[0], "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run[1])),
+            "elapsed_s": round(run[2] - run[1], 3), "stages": stages, "counters": counters, "llm": models}
+
+def list_runs(conn, limit=20):
+    init_metrics(conn)
+    return [{"run_id": run, "command": command, "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started))}
+            for run, command, started in conn.execute('SELECT run_id, command, started FROM metric_runs ORDER BY started DESC LIMIT ?', (limit,))]
+
+if __name__ == '__main__':
+    #python metrics.py runs              the most recent runs
+    #python metrics.py report [run_id]   summary of a run, the latest by default
+    conn = init_db(data_conn)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'report'
+    if command == 'runs':
+        print(json.dumps(list_runs(conn), indent=4))
+    elif command == 'report':
+        print(json.dumps(run_report(conn, sys.argv[2] if len(sys.argv) > 2 else None), indent=4))
+    else:
+        raise SystemExit(f'Unknown command {command}, expected runs or report')
@@ -0,0 +1,64 @@
+#JSON Structures
+from pydantic import BaseModel
+from typing import List
+from datetime import date
+
+#The pydantic models behind the function call schemas. Only imported when schemas.py has to regenerate its cache.
+class Reference(BaseModel):
+    folder: str
+    document: str
+    page: str
+    paragraph: str
+    content: str
+
+class Content(BaseModel):
+    summary: str
+    create_date: date
+    last_updated: date
+    token_count: int
+    references: List[Reference]
+
+class Action(BaseModel):
+    create_date: date
+    due_date: date
+    priority: str
+    reference: str
+    who: str
+    name: str
+    description: str
+    next_steps: str
+
+class ReviewDate(BaseModel):
+    date: date
+    instruction: str
+    findings: str
+    actions: List[Action]
+
+class Contract(BaseModel):
+    contact_name: str
+    contract_number: str
+    client_name: str
+    date_created: date
+    number_of_pages: int
+    header: str
+    footer: str
+    review_dates: List[ReviewDate]
+    content: List[Content]
+
+class ContentSection(BaseModel):
+    page_number: int
+    summary: str
+    reference: List[str]
+
+class Document(BaseModel):
+    document_name: str
+    document_directory: str
+    document_processed_date: str
+    content_sections: List[ContentSection]
+
+class Expert(BaseModel):
+    Name: str
+    Description: str
+
+class ExpertsModel(BaseModel):
+    experts: List[Expert]
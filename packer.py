@@ -0,0 +1,140 @@
+#OS imports
+import os
+import re
+import sys
+import json
+import time
+import logging
+
+#Token counter for modeling size to stuff into GPT
+from tokens import count_tokens, get_encoding
+
+#Offset indexed page store for the pre processed pages
+from pagestore import PageStore, list_stores
+
+#Run metrics
+from metrics import record_span
+
+data_pre_processed= os.getenv('DATA_PRE_PROCESSED_DIR', './source/preprocessed')
+
+logger = logging.getLogger(__name__)
+
+#Extracted PDF text marks a paragraph with a line that is blank apart from spaces.
+PARAGRAPH_BREAK = re.compile(r'(\n[ \t]*\n)')
+LINE_BREAK = re.compile(r'(\n)')
+
+#Split on a pattern, keeping each separator on the end of the part before it so the parts join back to the text.
+def split_keep(pattern, text):
+    pieces = pattern.split(text)
+    parts = [pieces[i] + (pieces[i + 1] if i + 1 < len(pieces) else '') for i in range(0, len(pieces), 2)]
+    return [part for part in parts if part]
+
+#Split text into pieces that each fit in token_limit: paragraphs first, then lines, then a hard cut on tokens.
+def split_text(text, token_limit):
+    for pattern in (PARAGRAPH_BREAK, LINE_BREAK):
+        parts = split_keep(pattern, text)
+        if len(parts) > 1:
+            break
+    else:
+        encoding = get_encoding()
+        tokens = encoding.encode_ordinary(text)
+        return [encoding.decode(tokens[i:i + token_limit]) for i in range(0, len(tokens), token_limit)]
+
+    #Greedily join the parts back together as far as the limit allows, recursing into any part that is too big on its own
+    pieces = []
+    current, current_tokens = '', 0
+    for part, part_tokens in zip(parts, count_tokens(parts)):
+        if part_tokens > token_limit:
+            if current:
+                pieces.append(current)
+                current, current_tokens = '', 0
+            pieces.extend(split_text(part, token_limit))
+        elif current_tokens + part_tokens <= token_limit:
+            current += part
+            current_tokens += part_tokens
+        else:
+            pieces.append(current)
+            current, current_tokens = part, part_tokens
+    if current:
+        pieces.append(current)
+    return pieces
+
+#A page that is bigger than a whole batch is split into parts, each part keeps the page number.
+#The split only depends on the page text and the limit, so the same page always splits the same way.
+def split_page(page, token_limit):
+    if page["token_count"] <= token_limit:
+        return [page]
+
+    pieces = split_text(page["content"], token_limit)
+    logger.debug(f'Split page {page["page_number"]} ({page["token_count"]} tokens) into {len(pieces)} parts')
+    return [{"page_number": page["page_number"], "token_count": token_count, "content": piece, "part": part + 1, "parts": len(pieces)}
+            for part, (piece, token_count) in enumerate(zip(pieces, count_tokens(pieces)))]
+
+#Pack pages into batches of at most token_limit tokens, keeping page order.
+#Filling each batch before starting the next gives the fewest batches possible without reordering pages.
+#Only pages over the limit need their content, the rest can come straight from the page store index.
+def pack_pages(pages, token_limit):
+    started = time.perf_counter()
+    batches = []
+    current = None
+    pages = list(pages)
+    for page in pages:
+        for piece in split_page(page, token_limit):
+            if current is None or current["token_count"] + piece["token_count"] > token_limit:
+                current = {"token_count": 0, "pages": []}
+                batches.append(current)
+            current["pages"].append(piece)
+            current["token_count"] += piece["token_count"]
+    record_span('batch', time.perf_counter() - started, pages=len(pages), batches=len(batches), token_limit=token_limit)
+    return batches
+
+#Pack a whole document into batches shaped like the process_json output, one JSON object per batch.
+def pack_document(document, pages, token_limit):
+    return [{
+        "document_name": document["document_name"],
+        "document_directory": document["document_directory"],
+        "document_processed_date": document["document_processed_date"],
+        "pages": batch["pages"]
+    } for batch in pack_pages(pages, token_limit)]
+
+#Plan the batches for an open page store from its index, reading the content of only the pages that have to be split.
+def plan_store(store, token_limit):
+    pages = [store.get_page(info["page_number"]) if info["token_count"] > token_limit else info
+             for info in store.page_infos() if not info["processed"]]
+    return pack_pages(pages, token_limit)
+
+#Read back the pages of a planned batch from its [page_number, part] list, re-splitting any page it holds only part of.
+def load_batch_pages(store, pages, token_limit):
+    loaded = []
+    for page_number, part in pages:
+        page = store.get_page(page_number)
+        loaded.append(split_page(page, token_limit)[part - 1] if part else page)
+    return loaded
+
+def pack_store(stem, token_limit, unprocessed_only=True):
+    with PageStore(stem, writable=False) as store:
+        pages = [page for page in store.iter_pages() if not (unprocessed_only and page.get("processed"))]
+        return pack_document(store.metadata, pages, token_limit)
+
+#Pack every page store in the pre processed directory. Batches never mix documents.
+def pack_corpus(token_limit, directory=data_pre_processed, unprocessed_only=True):
+    batches = []
+    for stem in list_stores(directory):
+        batches.extend(pack_store(stem, token_limit, unprocessed_only))
+    return batches
+
+def packing_report(batches, token_limit):
+    fills = [sum(page["token_count"] for page in batch["pages"]) / token_limit for batch in batches]
+    return {
+        "batches": len(batches),
+        "total_tokens": sum(page["token_count"] for batch in batches for page in batch["pages"]),
+        "split_pages": len({(batch["document_name"], page["page_number"]) for batch in batches for page in batch["pages"] if "part" in page}),
+        "mean_fill": sum(fills) / len(fills) if fills else 0.0,
+        "min_fill": min(fills) if fills else 0.0,
+        "fills": [round(fill, 3) for fill in fills]
+    }
+
+if __name__ == '__main__':
+    #python packer.py [token_limit]   packs every document in the pre processed directory and prints the report
+    token_limit = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(json.dumps(packing_report(pack_corpus(token_limit), token_limit), indent=4))
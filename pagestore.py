@@ -0,0 +1,197 @@
+#OS imports
+import os
+import sys
+import json
+import mmap
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+#A page store is three files sharing a path stem:
+#   <stem>.pages      the page text, utf-8, appended one page after another
+#   <stem>.idx        a fixed size record per page pointing into the .pages file
+#   <stem>.meta       the small document level fields as JSON (name, directory, processed date)
+#Pages are read by seeking into the mmapped content file, and the processed flag is
+#flipped in place in the mmapped index, so nothing is parsed or rewritten wholesale.
+PAGES_EXT = '.pages'
+INDEX_EXT = '.idx'
+META_EXT = '.meta'
+
+INDEX_MAGIC = b'KSPIDX01'
+#page_number, token_count, offset, length, flags
+INDEX_RECORD = struct.Struct('<IIQIB3x')
+FLAG_PROCESSED = 1
+
+def store_exists(stem):
+    return os.path.exists(stem + INDEX_EXT) and os.path.exists(stem + PAGES_EXT)
+
+def store_files(stem):
+    return [stem + PAGES_EXT, stem + INDEX_EXT, stem + META_EXT]
+
+#Find the page stores in a directory, returned as path stems. Stores still being written are hidden behind a leading dot.
+def list_stores(directory):
+    return sorted(os.path.join(directory, f[:-len(INDEX_EXT)]) for f in os.listdir(directory)
+                  if f.endswith(INDEX_EXT) and not f.startswith('.') and store_exists(os.path.join(directory, f[:-len(INDEX_EXT)])))
+
+class PageStoreWriter:
+    def __init__(self, stem, metadata):
+        self.stem = stem
+        self.offset = os.path.getsize(stem + PAGES_EXT) if os.path.exists(stem + PAGES_EXT) else 0
+        self.pages_file = open(stem + PAGES_EXT, 'ab')
+        new_index = not os.path.exists(stem + INDEX_EXT) or os.path.getsize(stem + INDEX_EXT) == 0
+        self.index_file = open(stem + INDEX_EXT, 'ab')
+        if new_index:
+            self.index_file.write(INDEX_MAGIC)
+        #Written on close, so fields only known once every page is through (the boilerplate found) make it in
+        self.metadata = metadata
+
+    def append(self, page_number, token_count, content, processed=False):
+        data = content.encode('utf-8')
+        self.pages_file.write(data)
+        self.index_file.write(INDEX_RECORD.pack(page_number, token_count, self.offset, len(data),
+                                                FLAG_PROCESSED if processed else 0))
+        self.offset += len(data)
+
+    def close(self):
+        self.pages_file.close()
+        self.index_file.close()
+        with open(self.stem + META_EXT, 'w') as meta_file:
+            json.dump(self.metadata, meta_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class PageStore:
+    def __init__(self, stem, writable=True):
+        self.stem = stem
+        with open(stem + META_EXT) as meta_file:
+            self.metadata = json.load(meta_file)
+
+        self.pages_file = open(stem + PAGES_EXT, 'rb')
+        self.pages_map = mmap.mmap(self.pages_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(stem + PAGES_EXT) else b''
+
+        self.index_file = open(stem + INDEX_EXT, 'r+b' if writable else 'rb')
+        self.index_map = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        if self.index_map[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError(f'Not a page store index: {stem + INDEX_EXT}')
+
+        self.count = (len(self.index_map) - len(INDEX_MAGIC)) // INDEX_RECORD.size
+        self.positions = {self._record(i)[0]: i for i in range(self.count)}
+
+    def _record(self, i):
+        return INDEX_RECORD.unpack_from(self.index_map, len(INDEX_MAGIC) + i * INDEX_RECORD.size)
+
+    def __len__(self):
+        return self.count
+
+    #Index only view of every page, in the order they were appended, without touching the content file.
+    def page_infos(self):
+        for i in range(self.count):
+            page_number, token_count, _, _, flags = self._record(i)
+            yield {"page_number": page_number, "token_count": token_count, "processed": bool(flags & FLAG_PROCESSED)}
+
+    #The raw index records, (page_number, token_count, offset, length, flags), for working on the content file directly.
+    def records(self):
+        return [self._record(i) for i in range(self.count)]
+
+    def get_page(self, page_number):
+        page_number, token_count, offset, length, flags = self._record(self.positions[page_number])
+        page = {
+            "page_number": page_number,
+            "token_count": token_count,
+            "content": bytes(self.pages_map[offset:offset + length]).decode('utf-8')
+        }
+        if flags & FLAG_PROCESSED:
+            page["processed"] = True
+        return page
+
+    def get_pages(self, page_numbers):
+        return [self.get_page(page_number) for page_number in page_numbers]
+
+    def iter_pages(self):
+        for i in range(self.count):
+            yield self.get_page(self._record(i)[0])
+
+    def set_processed(self, page_numbers, processed=True):
+        for page_number in page_numbers:
+            position = len(INDEX_MAGIC) + self.positions[page_number] * INDEX_RECORD.size
+            record = list(INDEX_RECORD.unpack_from(self.index_map, position))
+            record[4] = (record[4] | FLAG_PROCESSED) if processed else (record[4] & ~FLAG_PROCESSED)
+            INDEX_RECORD.pack_into(self.index_map, position, *record)
+        self.index_map.flush()
+
+    def all_processed(self):
+        return all(info["processed"] for info in self.page_infos())
+
+    def to_json(self):
+        return {**self.metadata, "pages": list(self.iter_pages())}
+
+    def close(self):
+        if isinstance(self.pages_map, mmap.mmap):
+            self.pages_map.close()
+        self.index_map.close()
+        self.pages_file.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#Write pages as a new page store as they come, yielding each page once it has been written.
+#The files are written under a hidden name and renamed into place, index last, once the last page is through,
+#so readers never see half a store.
+def stream_store(stem, metadata, pages):
+    temp_stem = os.path.join(os.path.dirname(stem), '.' + os.path.basename(stem))
+    for path in store_files(temp_stem):
+        if os.path.exists(path):
+            os.remove(path)
+
+    with PageStoreWriter(temp_stem, metadata) as writer:
+        for page in pages:
+            writer.append(page["page_number"], page["token_count"], page["content"], page.get("processed") == True)
+            yield page
+
+    for temp_path, path in sorted(zip(store_files(temp_stem), store_files(stem)), key=lambda paths: paths[1].endswith(INDEX_EXT)):
+        os.replace(temp_path, path)
+
+#Write a full document (the same shape as the preprocessed JSON) as a new page store.
+def write_store(stem, document):
+    metadata = {key: value for key, value in document.items() if key != "pages"}
+    for _ in stream_store(stem, metadata, document["pages"]):
+        pass
+    return stem
+
+#Convert a preprocessed JSON file into a page store next to it.
+def convert_json(json_path, stem=None):
+    stem = stem or json_path[:-len('.json')]
+    with open(json_path, 'r') as f:
+        document = json.load(f)
+    write_store(stem, document)
+    logger.info(f'Converted {json_path} to page store {stem}')
+    return stem
+
+#Export a page store back to the preprocessed JSON format for anything that still needs it.
+def export_json(stem, json_path=None):
+    json_path = json_path or stem + '.json'
+    with PageStore(stem, writable=False) as store:
+        document = store.to_json()
+    with open(json_path, 'w') as f:
+        json.dump(document, f, indent=4)
+    return json_path
+
+if __name__ == '__main__':
+    #python pagestore.py convert <file.json>...   or   python pagestore.py export <stem>...
+    command, paths = sys.argv[1], sys.argv[2:]
+    for path in paths:
+        if command == 'convert':
+            print(convert_json(path))
+        elif command == 'export':
+            print(export_json(path))
+        else:
+            raise ValueError(f'Unknown command: {command}')
@@ -0,0 +1,119 @@
+#OS imports
+import os
+import shutil
+import logging
+from datetime import datetime
+
+#Token counter for modeling size to stuff into GPT
+from tokens import count_tokens, count_page_tokens
+
+#Running headers and footers, stripped before anything counts or embeds them
+from boilerplate import strip_document, strip_pages
+
+#Page extraction, in parallel or one page at a time
+from extract import extract_pdfs_parallel, iter_pdf_pages
+
+#Offset indexed page store for the pre processed pages
+from pagestore import write_store, stream_store
+
+#Run metrics
+from metrics import record_span, count
+
+data_source= os.getenv('DATA_SOURCE_DIR', './source')
+data_pre_processed= os.getenv('DATA_PRE_PROCESSED_DIR', './source/preprocessed')
+extract_workers= int(os.getenv('EXTRACT_WORKERS', 1))
+#Pages whose tokens are counted together while streaming
+stream_batch_pages= int(os.getenv('STREAM_BATCH_PAGES', 64))
+
+logger = logging.getLogger(__name__)
+
+#Grab the pdf files from the source directory and process them into page sized bites.
+#With workers > 1 the pages of every file are extracted across a process pool, otherwise each file is streamed
+#into its page store a page at a time.
+def split_pdfs_in_directory(workers=extract_workers):
+    # Ensure the output directory exists
+    if not os.path.exists(data_pre_processed):
+        logger.debug('Creating pre processing directory: %s', data_pre_processed)
+        os.makedirs(data_pre_processed)
+    else:
+        logger.debug('Found pre processing directory: %s', data_pre_processed)
+
+    # Ensure the processed directory exists
+    processed_dir = os.path.join(data_source, 'processed')
+    if not os.path.exists(processed_dir):
+        logger.debug('Creating processed directory: %s', processed_dir)
+        os.makedirs(processed_dir)
+    else:
+        logger.debug('Found processed directory: %s', processed_dir)
+
+    # List all files in the directory
+    pdf_files = [filename for filename in os.listdir(data_source)
+                 if filename.endswith('.pdf') and not os.path.isdir(os.path.join(data_source, filename))]
+
+    if workers > 1 and pdf_files:
+        file_paths = [os.path.join(data_source, filename) for filename in pdf_files]
+        logger.debug('Extracting %s files with %s workers', len(file_paths), workers)
+        documents, worker_stats = extract_pdfs_parallel(file_paths, workers=workers)
+
+        for worker, stats in worker_stats.items():
+            logger.info('Worker %s: %s pages in %s tasks, %.1f pages/second', worker, stats["pages"], stats["tasks"], stats["pages_per_second"])
+
+        for filename, file_path in zip(pdf_files, file_paths):
+            pages = documents[file_path]
+            boilerplate = strip_document(pages)
+            for page, token_count in zip(pages, count_tokens([page["content"] for page in pages])):
+                page["token_count"] = token_count
+            save_document_store(filename, pages, boilerplate)
+            move_to_processed(file_path, processed_dir)
+            logger.info("Moved %s to processed directory", filename)
+    else:
+        for filename in pdf_files:
+            file_path = os.path.join(data_source, filename)
+            logger.debug('Processing file: %s', file_path)
+
+            total_pages = sum(1 for _ in stream_document(file_path))
+            logger.debug('Processed %s pages in %s', total_pages, filename)
+
+            # Move the processed file to the processed directory
+            move_to_processed(file_path, processed_dir)
+            logger.info("Moved %s to processed directory", filename)
+
+    logger.info("PDF processing completed.")
+
+def document_metadata(filename):
+    return {
+        "document_name": filename,
+        "document_directory": data_source,
+        "document_processed_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+#Save the extracted pages of a document as a page store in the pre processed directory, with the header and footer
+#strip_document found.
+def save_document_store(filename, pages, boilerplate=None):
+    # Save the pages to the reference directory
+    output_path = write_store(os.path.join(data_pre_processed, filename[:-4]),
+                              {**document_metadata(filename), **(boilerplate or {}), "pages": pages})
+
+    logger.info("Processed %s and saved page store to %s", filename, output_path)
+    return output_path
+
+#Extract, strip, count and store a PDF a page at a time, yielding each page once it is in the page store, so the
+#caller can chunk and embed as it goes. Memory stays flat however long the document is, see python bench.py stream.
+#The boilerplate is learnt from the first BOILERPLATE_SAMPLE_PAGES pages. The store only appears under its own name
+#once the last page is through.
+def stream_document(file_path, batch_size=stream_batch_pages):
+    filename = os.path.basename(file_path)
+
+    def extracted():
+        for page, elapsed in iter_pdf_pages(file_path):
+            record_span('extract', elapsed, file=filename, page=page["page_number"])
+            count('extract', 'pages')
+            yield page
+
+    stem = os.path.join(data_pre_processed, filename[:-4])
+    metadata = document_metadata(filename)
+    yield from stream_store(stem, metadata, count_page_tokens(strip_pages(extracted(), metadata), batch_size))
+    logger.info("Processed %s and saved page store to %s", filename, stem)
+
+def move_to_processed(file_path, processed_dir):
+    shutil.move(file_path, processed_dir)
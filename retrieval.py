@@ -0,0 +1,117 @@
+#OS imports
+import os
+import re
+import logging
+
+#Langchain document, what the retrievers hand back
+from langchain.schema import Document
+
+#Run metrics
+from metrics import span
+
+#Share of the fused score that comes from the lexical ranking, and the usual reciprocal rank fusion constant
+hybrid_lexical_weight = float(os.getenv('HYBRID_LEXICAL_WEIGHT', 0.5))
+hybrid_rank_constant = int(os.getenv('HYBRID_RANK_CONSTANT', 60))
+
+logger = logging.getLogger(__name__)
+
+#Answer a list of questions against a Chroma store with one embedding call and one query.
+#Returns {question: [Document, ...]} with the top k documents for each question, nearest first.
+#where narrows the search with a Chroma metadata filter, e.g. {"source": path} for a single contract.
+#Pass vectors to reuse question embeddings across several searches.
+def retrieve_many(vectordb, questions, k=2, where=None, vectors=None):
+    questions = list(questions)
+    if not questions:
+        return {}
+
+    with span('retrieve', mode='batch', questions=len(questions), k=k):
+        vectors = vectors or vectordb._embedding_function.embed_documents(questions)
+        results = vectordb._collection.query(query_embeddings=vectors, n_results=k, where=where,
+                                             include=["documents", "metadatas", "distances"])
+
+    answers = {}
+    for question, documents, metadatas, distances in zip(questions, results["documents"], results["metadatas"], results["distances"]):
+        answers[question] = [Document(page_content=document, metadata={**(metadata or {}), "distance": distance})
+                             for document, metadata, distance in zip(documents, metadatas, distances)]
+    logger.debug(f'Retrieved top {k} for {len(questions)} questions')
+    return answers
+
+#Every document that has chunks in the store, by the source recorded when it was loaded.
+def indexed_documents(vectordb):
+    metadatas = vectordb._collection.get(include=["metadatas"])["metadatas"]
+    return sorted({metadata["source"] for metadata in metadatas if metadata and "source" in metadata})
+
+#Top k documents for each of several queries with one embedding call, from either store.
+#Returns {query: [Document, ...]}.
+def dense_search_batch(vectordb, queries, k=2):
+    queries = list(dict.fromkeys(queries))
+    if hasattr(vectordb, 'similarity_search_batch'):
+        return vectordb.similarity_search_batch(queries, k)
+    return retrieve_many(vectordb, queries, k)
+
+#Queries made only of codes, clause numbers and quoted phrases are answered from the lexical index alone.
+LEXICAL_TERM = re.compile(r'^(?=.*(\d|_))[\w./-]+$|^[A-Z][A-Z0-9]+$')
+
+def is_lexical_query(query):
+    query = query.strip()
+    if len(query) > 1 and query[0] == query[-1] == '"':
+        return True
+    words = query.split()
+    return bool(words) and all(LEXICAL_TERM.match(word) for word in words)
+
+#Lexical pages and dense chunks fused by reciprocal rank on (document, page), so neither side's raw scores need
+#to be on the same scale. A page found by both is returned once, as the dense chunk, with the fused score in its metadata.
+#Lexical looking queries (see is_lexical_query) skip the embedding call, and fall back to dense search if nothing matches.
+class HybridRetriever:
+    def __init__(self, vectordb, lexical, k=2, lexical_weight=hybrid_lexical_weight, rank_constant=hybrid_rank_constant):
+        self.vectordb = vectordb
+        self.lexical = lexical
+        self.k = k
+        self.lexical_weight = lexical_weight
+        self.rank_constant = rank_constant
+
+    def lexical_documents(self, query, k, document=None):
+        documents = []
+        for source, page_number, score in self.lexical.search(query, k, document):
+            #Pages are numbered from 1, Chroma's page metadata from 0
+            documents.append(Document(page_content=self.lexical.page_text(source, page_number),
+                                      metadata={"source": source, "page": page_number - 1, "bm25": score}))
+        return documents
+
+    def get_relevant_documents(self, query):
+        with span('retrieve', k=self.k) as attributes:
+            return self._relevant_documents(query, attributes)
+
+    def _relevant_documents(self, query, attributes):
+        candidates = self.k * 4
+        lexical = self.lexical_documents(query, candidates)
+        if lexical and is_lexical_query(query):
+            attributes["mode"] = 'lexical'
+            return lexical[:self.k]
+
+        attributes["mode"] = 'hybrid'
+        return self.fuse(self.vectordb.similarity_search(query, candidates), lexical, self.k)
+
+    #Several queries at once, as get_relevant_documents would answer them one by one. The queries that need
+    #dense search share one embedding call and one vector search. Returns a list of documents per query.
+    def get_relevant_documents_batch(self, queries, k=None):
+        k = k or self.k
+        queries = list(queries)
+        with span('retrieve', mode='hybrid_batch', questions=len(queries), k=k) as attributes:
+            candidates = k * 4
+            lexical = [self.lexical_documents(query, candidates) for query in queries]
+            dense_queries = [query for query, documents in zip(queries, lexical) if not (documents and is_lexical_query(query))]
+            dense = dense_search_batch(self.vectordb, dense_queries, candidates) if dense_queries else {}
+            attributes["embedded"] = len(dense)
+            return [self.fuse(dense[query], documents, k) if query in dense else documents[:k]
+                    for query, documents in zip(queries, lexical)]
+
+    def fuse(self, dense, lexical, k):
+        fused = {}
+        for weight, documents in ((1 - self.lexical_weight, dense), (self.lexical_weight, lexical)):
+            for rank, document in enumerate(documents):
+                key = (os.path.basename(document.metadata.get("source", "")), document.metadata.get("page"))
+                score, best = fused.get(key, (0.0, document))
+                fused[key] = (score + weight / (self.rank_constant + rank + 1), best)
+        ranked = sorted(fused.values(), key=lambda item: -item[0])[:k]
+        return [Document(page_content=document.page_content, metadata={**document.metadata, "fused": score}) for score, document in ranked]
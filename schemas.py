@@ -0,0 +1,67 @@
+#OS imports
+import os
+import json
+import hashlib
+import logging
+from importlib import metadata
+
+#Generated function call schemas, cached as JSON so a run doesn't import pydantic and rebuild them every time.
+#The cache is keyed on the source of models.py and the pydantic version, change either and it is regenerated.
+schema_cache = os.getenv('SCHEMA_CACHE', './data/schemas.json')
+
+logger = logging.getLogger(__name__)
+
+MODELS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models.py')
+
+#name: (description, model class in models.py)
+SCHEMAS = {
+    "contract_summary": ("output object for a contract summary", "Contract"),
+    "content_summary": ("output object for a content summary", "Document"),
+    "get_experts": ("Get a list of experts for answering this question", "ExpertsModel"),
+}
+
+def schema_key():
+    digest = hashlib.sha256()
+    with open(MODELS_FILE, 'rb') as f:
+        digest.update(f.read())
+    try:
+        digest.update(metadata.version('pydantic').encode('utf-8'))
+    except metadata.PackageNotFoundError:
+        pass
+    digest.update(json.dumps(SCHEMAS, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def build_schemas():
+    import models
+    return {name: {
+                "name" : name,
+                "description" : description,
+                "parameters" : getattr(models, model).schema(),
+                "return_type" : "json"
+                }
+            for name, (description, model) in SCHEMAS.items()}
+
+#Every schema by name, from the cache when it is current.
+def load_schemas(path=schema_cache):
+    key = schema_key()
+    try:
+        with open(path, 'r') as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return cached["schemas"]
+    except (OSError, ValueError):
+        pass
+
+    logger.info(f'Generating function schemas into {path}')
+    schemas = build_schemas()
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({"key": key, "schemas": schemas}, f)
+    os.replace(temp_path, path)
+    return schemas
+
+def get_schema(name):
+    return load_schemas()[name]
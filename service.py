@@ -0,0 +1,247 @@
+#OS imports
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+#Env Mgt
+from dotenv import load_dotenv
+
+#Run metrics
+from metrics import record_span, count
+
+#A long running query service over the hybrid retriever, so the embedder, the vector store and the BM25 index
+#are loaded once rather than per question.
+#   POST /query   {"question": "...", "k": 2}  ->  {"question": ..., "documents": [{"page_content": ..., "metadata": {...}}]}
+#   GET /health   request, batch and dedup counts
+#Questions arriving within QUERY_BATCH_WINDOW_MS of each other are answered together, one embedding call and one
+#vector search for the lot (up to QUERY_BATCH_MAX). A question already waiting or being answered is not asked
+#again, the later request waits for the same answer.
+#Listens on QUERY_SERVICE_HOST:QUERY_SERVICE_PORT, or on the Unix socket QUERY_SERVICE_SOCKET if it is set.
+service_host = os.getenv('QUERY_SERVICE_HOST', '127.0.0.1')
+service_port = int(os.getenv('QUERY_SERVICE_PORT', 8766))
+service_socket = os.getenv('QUERY_SERVICE_SOCKET')
+query_batch_window = float(os.getenv('QUERY_BATCH_WINDOW_MS', 10)) / 1000
+query_batch_max = int(os.getenv('QUERY_BATCH_MAX', 32))
+#The BM25 statistics and the numpy vector store are reloaded at most this often, so documents indexed since
+#start (python watcher.py) are found
+query_refresh_seconds = float(os.getenv('QUERY_REFRESH_SECONDS', 5))
+log_level = os.getenv('LOG_LEVEL', 'INFO')
+
+logger = logging.getLogger(__name__)
+
+#Biggest request body accepted, a question is a few hundred bytes
+MAX_BODY = 64 * 1024
+MAX_K = 50
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+
+#Same question, give or take spacing
+def question_key(question, k):
+    return ' '.join(question.split()), k
+
+#Collects the questions that come in over a short window and answers them as one batch.
+#The retriever is built and only ever used on one worker thread (its sqlite connection can't be shared), so while a
+#batch runs the next one builds up behind it, and the event loop keeps accepting requests.
+class QueryBatcher:
+    def __init__(self, build_retriever, window=query_batch_window, max_batch=query_batch_max, refresh_seconds=query_refresh_seconds):
+        self.build_retriever = build_retriever
+        self.window = window
+        self.max_batch = max_batch
+        self.refresh_seconds = refresh_seconds
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='query')
+        self.retriever = None
+        self.refreshed = 0.0
+        self.waiting = {}
+        self.inflight = {}
+        self.tasks = set()
+        self.timer = None
+        self.stats = {"requests": 0, "deduplicated": 0, "batches": 0, "batched_questions": 0, "errors": 0}
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.retriever = await loop.run_in_executor(self.executor, self.build_retriever)
+        self.refreshed = time.monotonic()
+
+    #The documents for a question, from a batch shared with whatever else arrives in the window.
+    async def query(self, question, k):
+        loop = asyncio.get_running_loop()
+        key = question_key(question, k)
+        self.stats["requests"] += 1
+        count('service', 'requests')
+
+        future = self.inflight.get(key)
+        if future is not None:
+            self.stats["deduplicated"] += 1
+            count('service', 'deduplicated')
+        else:
+            future = loop.create_future()
+            self.inflight[key] = future
+            self.waiting[key] = future
+            if len(self.waiting) >= self.max_batch:
+                self.flush()
+            elif self.timer is None:
+                self.timer = loop.call_later(self.window, self.flush)
+        #A client going away mustn't cancel an answer other requests are waiting on
+        return await asyncio.shield(future)
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.waiting = self.waiting, {}
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    def _answer(self, questions, k):
+        if self.refresh_seconds and time.monotonic() - self.refreshed > self.refresh_seconds:
+            self.retriever.lexical.refresh()
+            if hasattr(self.retriever.vectordb, 'refresh'):
+                self.retriever.vectordb.refresh()
+            self.refreshed = time.monotonic()
+        return self.retriever.get_relevant_documents_batch(questions, k)
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        by_k = {}
+        for key in batch:
+            by_k.setdefault(key[1], []).append(key)
+
+        for k, keys in by_k.items():
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self.executor, self._answer, [question for question, _ in keys], k)
+                for key, documents in zip(keys, results):
+                    batch[key].set_result(documents)
+            except Exception as e:
+                logger.exception(f'Batch of {len(keys)} questions failed')
+                self.stats["errors"] += 1
+                for key in keys:
+                    if not batch[key].done():
+                        batch[key].set_exception(e)
+            finally:
+                for key in keys:
+                    self.inflight.pop(key, None)
+            self.stats["batches"] += 1
+            self.stats["batched_questions"] += len(keys)
+            record_span('service_batch', time.perf_counter() - started, questions=len(keys), k=k)
+
+    #Answer everything already asked, then stop the worker thread.
+    async def close(self):
+        self.flush()
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    def report(self):
+        batches = self.stats["batches"]
+        return {**self.stats, "mean_batch": round(self.stats["batched_questions"] / batches, 2) if batches else 0.0}
+
+def document_json(document):
+    return {"page_content": document.page_content, "metadata": document.metadata}
+
+#Just enough HTTP/1.1 for a JSON API: one request per connection, answered and closed.
+class QueryServer:
+    def __init__(self, batcher, default_k=2):
+        self.batcher = batcher
+        self.default_k = default_k
+
+    async def handle(self, reader, writer):
+        try:
+            status, payload = await self.respond(reader)
+        except Exception as e:
+            logger.exception('Request failed')
+            status, payload = 500, {"error": str(e)}
+
+        body = json.dumps(payload, default=str).encode('utf-8')
+        writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def respond(self, reader):
+        try:
+            method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        except ValueError:
+            return 400, {"error": 'Malformed request line'}
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        path = urlsplit(target).path
+        if path == '/health':
+            if method != 'GET':
+                return 405, {"error": f'{method} not allowed on {path}'}
+            return 200, self.batcher.report()
+        if path != '/query':
+            return 404, {"error": f'No such endpoint {path}'}
+        if method != 'POST':
+            return 405, {"error": f'{method} not allowed on {path}'}
+
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY:
+            return 413, {"error": f'Request body over {MAX_BODY} bytes'}
+        try:
+            request = json.loads(await reader.readexactly(length))
+        except (ValueError, asyncio.IncompleteReadError):
+            return 400, {"error": 'Body must be a JSON object'}
+        question = request.get("question") if isinstance(request, dict) else None
+        k = request.get("k", self.default_k) if isinstance(request, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            return 400, {"error": 'question must be a non empty string'}
+        if not isinstance(k, int) or not 1 <= k <= MAX_K:
+            return 400, {"error": f'k must be a whole number from 1 to {MAX_K}'}
+
+        started = time.perf_counter()
+        documents = await self.batcher.query(question, k)
+        return 200, {"question": question, "documents": [document_json(document) for document in documents],
+                     "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+#Run until SIGINT or SIGTERM, then stop accepting, answer what was already asked and exit.
+async def serve(build_retriever, host=service_host, port=service_port, socket_path=service_socket):
+    batcher = QueryBatcher(build_retriever)
+    started = time.perf_counter()
+    await batcher.start()
+    logger.info(f'Retriever loaded in {time.perf_counter() - started:.2f}s')
+
+    server = QueryServer(batcher)
+    if socket_path:
+        listener = await asyncio.start_unix_server(server.handle, path=socket_path)
+        logger.info(f'Listening on {socket_path}')
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+        logger.info(f'Listening on {host}:{port}')
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    async with listener:
+        await stop.wait()
+        listener.close()
+        await listener.wait_closed()
+    await batcher.close()
+    logger.info(f'Stopped after {json.dumps(batcher.report())}')
+
+if __name__ == '__main__':
+    #python service.py   see above for the settings
+    from utils import init_logging
+    from langquery import build_retriever
+    load_dotenv()
+    init_logging(log_level)
+    asyncio.run(serve(build_retriever))
@@ -1,281 +1,197 @@
 #OS imports
 import os
 import json
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 #Env Mgt
 from dotenv import load_dotenv
 
-#JSON Structures
-from pydantic import BaseModel
-from typing import List
-from datetime import date
-
 #AI Client
 import openai
 
-#PDF tools
-import PyPDF2
-
 #File/shell tools
 import shutil
 
-#Token counter for modeling size to stuff into GPT
-import tiktoken
-encoding = tiktoken.encoding_for_model("gpt-4-0613")
-
 #Bring in the utils
 from utils import init_logging, init_db
 
+#Pull the PDFs apart into page stores
+from preprocess import split_pdfs_in_directory
+
+#Offset indexed page store for the pre processed pages
+from pagestore import PageStore, convert_json, list_stores, store_exists, store_files
+
+#Work queue so several workers can share the pre processed pages
+from workqueue import init_work_queue, document_queued, enqueue_document, claim_batch, complete_batch, release_batch, fail_batch, document_done, forget_document, worker_name
+
+#Token packer to cut documents into LLM sized batches
+from packer import plan_store, load_batch_pages, pack_corpus, packing_report
+
+#Concurrent, rate limited LLM calls and the offline stub model
+import asyncio
+from functools import partial
+from llmrunner import RateLimiter, run_content_batches
+from llmstub import stub_acreate, stub_create
+
+#Content addressed cache of LLM responses, set LLM_CACHE_BYPASS to go to the model regardless
+from llmcache import cached_create, cached_acreate, cache_report
+
+#Function call schemas, cached so pydantic is only imported when the models change
+from schemas import load_schemas
+
 #Load env variables:
 load_dotenv()
 openai.api_key = os.getenv('OPENAI_API_KEY')  # get OpenAI key from environment variables
 debug = os.getenv('getSkills_DEBUG', True)
-log_level = 'DEBUG'
+log_level = os.getenv('LOG_LEVEL', 'DEBUG')
 data_conn = os.getenv('DATA_CONNECTION_STRING', './data/database.db')
-data_source= os.getenv('DATA_SOURCE_DIR', './source')
 data_processed= os.getenv('DATA_PROCESSED_DIR', './source/processed')
 data_pre_processed= os.getenv('DATA_PRE_PROCESSED_DIR', './source/preprocessed')
+run_mode= os.getenv('RUN_MODE', 'batch')
+llm_backend= os.getenv('LLM_BACKEND', 'openai')
+llm_round_size= int(os.getenv('LLM_ROUND_SIZE', 32))
+llm_max_attempts= int(os.getenv('LLM_MAX_ATTEMPTS', 3))
+run_review= os.getenv('RUN_REVIEW', 'false').lower() in ('1', 'true', 'yes')
+review_workers= int(os.getenv('REVIEW_WORKERS', 0))
+llm_create = stub_create if llm_backend == 'stub' else None
 
 # Initialize logging
 logger = init_logging(log_level)
 
-logger.info(f'debug: {debug}')
-logger.info(f'log_level: {log_level}')
-logger.info(f'Data connection string: {data_conn}')
-logger.info(f'Data source directory: {data_conn}')
-logger.info(f'Data processed directory: {data_conn}')
+logger.info('debug: %s', debug)
+logger.info('log_level: %s', log_level)
+logger.info('Data connection string: %s', data_conn)
+logger.info('Data source directory: %s', data_conn)
+logger.info('Data processed directory: %s', data_conn)
 
 # Initialize database connection
 conn = init_db(data_conn)
+init_work_queue(conn)
+worker_id = worker_name()
 
 current_answer = ""
 current_json = ""
+current_batch = None
 prompt = ""
-
-#Set up our pydantic models.
-class Reference(BaseModel):
-    folder: str
-    document: str
-    page: str
-    paragraph: str
-    content: str
-
-class Content(BaseModel):
-    summary: str
-    create_date: date
-    last_updated: date
-    token_count: int
-    references: List[Reference]
-
-class Action(BaseModel):
-    create_date: date
-    due_date: date
-    priority: str
-    reference: str
-    who: str
-    name: str
-    description: str
-    next_steps: str
-
-class ReviewDate(BaseModel):
-    date: date
-    instruction: str
-    findings: str
-    actions: List[Action]
-
-class Contract(BaseModel):
-    contact_name: str
-    contract_number: str
-    client_name: str
-    date_created: date
-    number_of_pages: int
-    header: str
-    footer: str
-    review_dates: List[ReviewDate]
-    content: List[Content]
-
-contract_schema = {
-    "name" : "contract_summary",
-    "description" : "output object for a contract summary",
-    "parameters" : Contract.schema(),
-    "return_type" : "json" 
-    } 
-logger.debug(f'contract schema: {contract_schema}')
-
-class ContentSection(BaseModel):
-    page_number: int
-    summary: str
-    reference: List[str]
-
-class Document(BaseModel):
-    document_name: str
-    document_directory: str
-    document_processed_date: str
-    content_sections: List[ContentSection]
-
-content_schema = {
-    "name" : "content_summary",
-    "description" : "output object for a content summary",
-    "parameters" : Document.schema(),
-    "return_type" : "json" 
-    }
-
-class Expert(BaseModel):
-    Name: str
-    Description: str
-
-class ExpertsModel(BaseModel):
-    experts: List[Expert]
-
-expert_schema = {
-    "name" : "get_experts",
-    "description" : "Get a list of experts for answering this question",
-    "parameters" : ExpertsModel.schema(),
-    "return_type" : "json" 
-    } 
-logger.debug(f'expert schema: {expert_schema}')
-
-#Grab the pdf files from the source directory and process them into page sized bites.
-def split_pdfs_in_directory():
-    # Ensure the output directory exists
-    if not os.path.exists(data_pre_processed):
-        logger.debug(f'Creating pre processing directory: {data_pre_processed}')
-        os.makedirs(data_pre_processed)
-    else:
-        logger.debug(f'Found pre processing directory: {data_pre_processed}')
-
-    # Ensure the processed directory exists
-    processed_dir = os.path.join(data_source, 'processed')
-    if not os.path.exists(processed_dir):
-        logger.debug(f'Creating processed directory: {processed_dir}')
-        os.makedirs(processed_dir)
-    else:
-        logger.debug(f'Found processed directory: {processed_dir}')
-
-    # List all files in the directory
-    for filename in os.listdir(data_source):
-        if filename.endswith('.pdf') and not os.path.isdir(os.path.join(data_source, filename)):
-            file_path = os.path.join(data_source, filename)
-            logger.debug(f'Processing file: {file_path}')
-            
-            with open(file_path, 'rb') as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                total_pages = len(pdf_reader.pages)
-                logger.debug(f'Found {total_pages} pages in {filename}')
-
-                # Create the JSON data object
-                document_data = {
-                    "document_name": filename,
-                    "document_directory": data_source,
-                    "document_processed_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "pages": []
-                }
-
-                # Extract content for each page and add to the JSON data object
-                for page_num in range(total_pages):
-                    page_content = pdf_reader.pages[page_num].extract_text()
-                    token_count =len(encoding.encode(page_content))
-                    document_data["pages"].append({
-                        "page_number": page_num + 1,
-                        "token_count": token_count,
-                        "content": page_content
-                    })
-                logger.debug(f'Processed {total_pages} pages in {filename}')
-
-                # Save the JSON data object to the reference directory
-                output_filename = f"{filename[:-4]}.json"
-                output_path = os.path.join(data_pre_processed, output_filename)
-                with open(output_path, 'w') as json_file:
-                    json.dump(document_data, json_file, indent=4)
-
-                logger.info(f"Processed {filename} and saved JSON to {output_path}")
-
-            # Move the processed file to the processed directory
-            move_to_processed(file_path, processed_dir)
-            logger.info(f"Moved {filename} to processed directory")
-
-    logger.info("PDF processing completed.")
-
-def move_to_processed(file_path, processed_dir):
-    shutil.move(file_path, processed_dir)
-
-def process_json(token_limit):
-    # List all .json files in the directory
-    json_files = [f for f in os.listdir(data_pre_processed) if f.endswith('.json')]
-    logger.debug(f'Found {len(json_files)} JSON files in {data_pre_processed}')
-    
-    if not json_files:
-        return {"document_name":"No files found for pre processing"}
-
-    # Find the youngest .json file
-    youngest_file = max(json_files, key=lambda f: os.path.getctime(os.path.join(data_pre_processed, f)))
-    file_path = os.path.join(data_pre_processed, youngest_file)
-
-    with open(file_path, 'r') as f:
-        data = json.load(f)
-
-    total_tokens = 0
-    processed_sections = []
-
-    for page in data["pages"]:
-        # Skip sections that have processed=True
-        if page.get('processed') == True:
-            logger.debug(f'Skipping page {page["page_number"]} as it has already been processed')
+#The running header and footer boilerplate.py took off the pages, from the page store metadata. The first document
+#with one sets it, as the prompt used to have the LLM do, and the final answer's Contract gets them.
+current_boilerplate = {"header": '', "footer": ''}
+
+#Function call schemas, generated from the pydantic models in models.py.
+schemas = load_schemas()
+contract_schema = schemas["contract_summary"]
+logger.debug('contract schema: %s', contract_schema)
+content_schema = schemas["content_summary"]
+expert_schema = schemas["get_experts"]
+logger.debug('expert schema: %s', expert_schema)
+
+#Convert any legacy JSON, then pack and queue the batches of every page store not queued yet.
+def queue_json(token_limit):
+    # Convert any .json files preprocessed before the page store existed. The JSON stays where it is, it isn't converted
+    # again once its store exists, here or moved to processed when summarised. Creating the claim file first means
+    # only one worker converts it.
+    for f in os.listdir(data_pre_processed):
+        stem = f[:-5]
+        if not f.endswith('.json') or any(store_exists(os.path.join(directory, stem)) for directory in (data_pre_processed, data_processed)):
+            continue
+        claim_path = os.path.join(data_pre_processed, f'.{f}.claim')
+        try:
+            os.close(os.open(claim_path, os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
             continue
-        else:
-            logger.debug(f'Processing page {page["page_number"]}')
-
-        section_tokens = page["token_count"]
-        logger.debug(f'''
-                     -----------------------------------
-                        Processing Page: 
-                     ------------------------------
-                     {page}''')
-
-        if total_tokens + section_tokens <= token_limit:
-            total_tokens += section_tokens
-            logger.debug(f'''Total tokens: {total_tokens}
-                     ---------------------------''')
-                         
-            page['processed'] = True
-            processed_sections.append(page)
-        else:
-            logger.debug(f'''
+        try:
+            if not store_exists(os.path.join(data_pre_processed, stem)):
+                convert_json(os.path.join(data_pre_processed, f), os.path.join(data_pre_processed, stem))
+        finally:
+            os.remove(claim_path)
+
+    stores = list_stores(data_pre_processed)
+    logger.debug('Found %s page stores in %s', len(stores), data_pre_processed)
+
+    # Pack and queue every batch for any store we haven't seen yet
+    for store_path in stores:
+        if not document_queued(conn, store_path):
+            with PageStore(store_path, writable=False) as store:
+                enqueue_document(conn, store_path, plan_store(store, token_limit), token_limit)
+
+#Read the pages of a claimed batch into the JSON object we hand to the LLM.
+def load_batch_json(batch):
+    logger.debug('''
                      ----------------------------------
-                        Finished run at page {page["page_number"]}
-                        Total tokens: {total_tokens}
-                        Token limit: {token_limit}
-                     ----------------------------------''')
-            break
-
-    # Update the JSON object with processed sections
-    new_json_object = {
-        "document_name": data["document_name"],
-        "document_directory": data["document_directory"],
-        "document_processed_date": data["document_processed_date"],
-        "pages": processed_sections
-    }
-    logger.debug(f'JSON object: {new_json_object}')
-
-    # Save the updated JSON object (overwriting the existing file)
-    for page in processed_sections:
-        data["pages"][page["page_number"] - 1] = page  # Assuming page_number starts from 1
+                        Claimed batch %s of %s
+                        Pages: %s to %s
+                        Total tokens: %s
+                        Token limit: %s
+                     ----------------------------------''', batch["id"], batch["document"], batch["page_start"], batch["page_end"],
+                 batch["token_count"], batch["token_limit"])
+
+    with PageStore(batch["document"], writable=False) as store:
+        processed_sections = load_batch_pages(store, batch["pages"], batch["token_limit"])
+
+        # Update the JSON object with processed sections
+        new_json_object = {
+            "document_name": store.metadata["document_name"],
+            "document_directory": store.metadata["document_directory"],
+            "document_processed_date": store.metadata["document_processed_date"],
+            "header": store.metadata.get("header", ''),
+            "footer": store.metadata.get("footer", ''),
+            "pages": processed_sections
+        }
+        for field in current_boilerplate:
+            current_boilerplate[field] = current_boilerplate[field] or new_json_object[field]
+        logger.debug('JSON object: %s', new_json_object)
 
-    with open(file_path, 'w') as f:
-        json.dump(data, f, indent=4)
+    return new_json_object
 
-    # Check if all sections have been processed
-    all_processed = all(page.get('processed') == True for page in data["pages"])
+def process_json(token_limit):
+    queue_json(token_limit)
 
-    # Move the processed file to the ../processed directory if all sections have been processed
-    if all_processed:
-        logger.debug(f'Moving {file_path} to {data_processed}')
-        shutil.move(file_path, os.path.join(data_processed, youngest_file))
+    # Claim the next batch of pages, another worker running at the same time will get a different one
+    global current_batch
+    current_batch = claim_batch(conn, worker_id)
 
-    return new_json_object
+    if not current_batch:
+        return {"document_name":"No files found for pre processing"}
 
-def get_review(data):
+    return load_batch_json(current_batch)
+
+#Pack every unprocessed page in the pre processed directory into token bounded batches in one pass,
+#in page order, so the LLM stages can run over all of them rather than one batch per run.
+def process_json_batches(token_limit):
+    batches = pack_corpus(token_limit, data_pre_processed)
+    report = packing_report(batches, token_limit)
+    logger.info('Packed %s tokens into %s batches, mean fill %.0f%%, min fill %.0f%%', report["total_tokens"], report["batches"],
+                report["mean_fill"] * 100, report["min_fill"] * 100)
+    return batches
+
+#Mark the claimed batch as done once its answer is in, flip the processed flags in the page store
+#and move the store to the processed directory when it was the last batch of the document.
+def complete_json_batch(batch):
+    if not batch:
+        return
+
+    if not complete_batch(conn, batch):
+        logger.error('Lost the lease on batch %s of %s, another worker will redo it', batch["id"], batch["document"])
+        return
+
+    file_path = batch["document"]
+    with PageStore(file_path) as store:
+        # Flip the processed flags in place rather than rewriting the document, a split page is flagged with its last part
+        pages = load_batch_pages(store, batch["pages"], batch["token_limit"])
+        store.set_processed([page["page_number"] for page in pages if page.get("part", 1) == page.get("parts", 1)])
+
+    # Move the processed store to the ../processed directory if all sections have been processed
+    if document_done(conn, file_path):
+        logger.debug('Moving %s to %s', file_path, data_processed)
+        os.makedirs(data_processed, exist_ok=True)
+        for store_file in store_files(file_path):
+            shutil.move(store_file, os.path.join(data_processed, os.path.basename(store_file)))
+        forget_document(conn, file_path)
+
+#answer defaults to the current answer, the concurrent review stage passes the same answer to every expert.
+def get_review(data, answer=None):
+    answer = current_answer if answer is None else answer
     prompttext = f'''
     Your role is {data} reviewing the output of a task. In this capacity, you're a critical yet supportive reviewer aiming to enhance the quality of the work.
         
@@ -285,7 +201,7 @@ def get_review(data):
 
     The JSON object is as follows:
     
-    {current_answer}
+    {answer}
     
     As {data}, your task is to review the list methodically for completeness. 
     Then, add your name and a feedback to the reviewers array with comprehensive feedback on how the list could be improved. 
@@ -294,7 +210,8 @@ def get_review(data):
     The final output should be the JSON object, with your feedback in the reviewers array.'''
     logger.info(prompttext)
 
-    response = openai.ChatCompletion.create(
+    response = cached_create(
+      create=llm_create,
       model="gpt-4",
       messages=[
         {
@@ -309,7 +226,8 @@ def get_review(data):
       logger.info(response['choices'][0]['message']['content'].strip())  #type: ignore
       return response['choices'][0]['message']['content'].strip() #type: ignore
 
-def get_final_answer():
+def get_final_answer(answer=None):
+    answer = current_answer if answer is None else answer
     prompttext = '''role:
     You are a HR consultant in a large financial institution.
 
@@ -326,9 +244,10 @@ def get_final_answer():
     
     The current list is:
     {current_answer}
-    '''
+    '''.replace('{current_answer}', str(answer))
 
-    response = openai.ChatCompletion.create(
+    response = cached_create(
+      create=llm_create,
       model="gpt-4",
       messages=[
         {
@@ -342,26 +261,32 @@ def get_final_answer():
     logger.debug(response)
 
     if response['choices'] and response['choices'][0]['message']: #type: ignore
+      if response['choices'][0]['message'].get('function_call'): #type: ignore
+        return_json = json.loads(response['choices'][0]['message']['function_call']['arguments']) #type: ignore
+        return_json.update({field: text for field, text in current_boilerplate.items() if text})
+        logger.info('Final answer: %s', return_json)
+        return return_json
       logger.info(response['choices'][0]['message']['content'].strip()) #type: ignore
       return response['choices'][0]['message']['content'].strip() #type: ignore
 
 def get_content():
-    logger.debug(f'Prompt: {prompt}')
-    logger.debug(f'content schema: {content_schema}')
-    logger.debug(f'current_json: {current_json}')
+    logger.debug('Prompt: %s', prompt)
+    logger.debug('content schema: %s', content_schema)
+    logger.debug('current_json: %s', current_json)
 
     prompttext = f'''{prompt} Dont populate the reviewers list at this stage.
     INPUT:
     {current_json}
     '''
 
-    logger.debug(f'''----------------------
+    logger.debug('''----------------------
                  current_prompt: 
                  -------------------------
-                 {prompttext}
-                 -------------------------''')
+                 %s
+                 -------------------------''', prompttext)
 
-    response = openai.ChatCompletion.create(
+    response = cached_create(
+      create=llm_create,
       model="gpt-3.5-turbo-16k",
       messages=[
         {
@@ -372,18 +297,56 @@ def get_content():
       functions = [content_schema],
       function_call = {"name":"content_summary"}
     )
-    logger.debug(f'response:{response}')
+    logger.debug('response:%s', response)
 
     #if we have a response
     if response.choices[0] and response.choices[0]['message']:
       return_json = json.loads(response.choices[0]["message"]["function_call"]["arguments"]) #type: ignore
-      logger.info(f'First Answer run: {return_json}')
-      logger.debug(f'''First Answer message: {response.choices[0]['message']}''')
+      logger.info('First Answer run: %s', return_json)
+      logger.debug('First Answer message: %s', response.choices[0]['message'])
       return return_json
     else:
-        logger.error(f'Chatgpt output: {response}')
+        logger.error('Chatgpt output: %s', response)
         return {"Error": "Chat GPT Error"}
 
+#Claim the queued batches a round at a time and run get_content over each round concurrently,
+#inside the rate limits. A batch that errors is handed back for the next round, up to LLM_MAX_ATTEMPTS tries,
+#then marked failed so a batch that can never succeed doesn't keep the loop going. Returns the content_summary
+#results in page order, a failed batch's last error in its place.
+def get_content_all(token_limit):
+    queue_json(token_limit)
+    return asyncio.run(get_content_rounds())
+
+async def get_content_rounds():
+    create = partial(cached_acreate, create=stub_acreate) if llm_backend == 'stub' else cached_acreate
+    limiter = RateLimiter()
+    results = {}
+
+    while True:
+        batches = []
+        while len(batches) < llm_round_size:
+            batch = claim_batch(conn, worker_id)
+            if not batch:
+                break
+            batches.append(batch)
+        if not batches:
+            break
+
+        round_results = await run_content_batches([load_batch_json(batch) for batch in batches], prompt, content_schema,
+                                                  create=create, limiter=limiter)
+        for batch, result in zip(batches, round_results):
+            if "Error" in result and batch["attempts"] >= llm_max_attempts:
+                logger.error('Giving up on batch %s of %s after %s attempts: %s', batch["id"], batch["document"], batch["attempts"], result)
+                fail_batch(conn, batch)
+            elif "Error" in result:
+                release_batch(conn, batch)
+            else:
+                complete_json_batch(batch)
+            results[batch["id"]] = result
+
+    logger.info('Got content for %s batches, LLM cache: %s', len(results), cache_report())
+    return [results[batch_id] for batch_id in sorted(results)]
+
 def get_experts():
     prompttext = '''I want a response to the following question:
     
@@ -394,7 +357,8 @@ def get_experts():
         '''
     logger.info(prompttext)
 
-    response = openai.ChatCompletion.create(
+    response = cached_create(
+        create=llm_create,
         model="gpt-4",
         messages=[
           {
@@ -408,16 +372,88 @@ def get_experts():
     logger.debug(response)
 
     if response['choices'] and response['choices'][0]['message']: #type: ignore
-      return_json = json.loads(response.choices[0]["message"]["function_call"]["arguments"]) #type: ignore
-      logger.info(f'List of Experts: {return_json}')
+      try:
+        return_json = json.loads(response.choices[0]["message"]["function_call"]["arguments"]) #type: ignore
+      except (KeyError, TypeError, ValueError) as e:
+        logger.error('Could not read the experts from %s: %s', response, e)
+        return None
+      logger.info('List of Experts: %s', return_json)
       return return_json
 
-if __name__ == '__main__':
+#Pull the JSON object out of a review, the reviewers are asked for JSON but sometimes wrap it in prose.
+def parse_review(text):
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError):
+        pass
+    if text and '{' in text:
+        try:
+            return json.loads(text[text.index('{'):text.rindex('}') + 1])
+        except ValueError:
+            pass
+    return None
+
+#Merge the reviews into one reviewers array on the answer. Reviews are taken in the order the experts were named,
+#not the order they finished in, so the same reviews always merge to the same result.
+def merge_reviews(answer, experts, reviews):
+    merged = dict(answer) if isinstance(answer, dict) else {"answer": answer}
+    existing = list(merged.get("reviewers") or [])
+    reviewers = list(existing)
+
+    for expert, review in zip(experts, reviews):
+        parsed = parse_review(review)
+        feedback = [reviewer for reviewer in (parsed or {}).get("reviewers") or [] if reviewer not in existing] if isinstance(parsed, dict) else []
+        if not feedback:
+            feedback = [{"name": expert["Name"], "feedback": review or ""}]
+        for reviewer in feedback:
+            if isinstance(reviewer, dict):
+                reviewer.setdefault("name", expert["Name"])
+            reviewers.append(reviewer)
+
+    merged["reviewers"] = reviewers
+    return merged
+
+#Get the experts, run all of their reviews at the same time against the same answer,
+#merge the feedback and hand the consolidated answer to the final pass.
+#Without a list of experts (the LLM call or its parsing failed) the answer goes on unreviewed.
+def review_stage(answer):
+    stage_started = time.perf_counter()
+    experts = (get_experts() or {}).get("experts")
+    if not experts:
+        logger.warning('No experts came back, skipping the review stage')
+        return answer, {"experts": 0, "stage_wall_clock": round(time.perf_counter() - stage_started, 3)}
+
+    def timed_review(expert):
+        started = time.perf_counter()
+        review = get_review(expert["Name"], answer)
+        return review, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=review_workers or len(experts) or 1) as pool:
+        timed = list(pool.map(timed_review, experts))
+    reviews_done = time.perf_counter()
+
+    merged = merge_reviews(answer, experts, [review for review, _ in timed])
+    final_answer = get_final_answer(merged)
+
+    timings = {
+        "experts": len(experts),
+        "review_latency": {expert["Name"]: round(elapsed, 3) for expert, (_, elapsed) in zip(experts, timed)},
+        "reviews_wall_clock": round(reviews_done - stage_started, 3),
+        "stage_wall_clock": round(time.perf_counter() - stage_started, 3)
+    }
+    logger.info('Review stage: %s', timings)
+    return final_answer, timings
+
+#The whole run: pre process, queue and pack, summarise and optionally review. python cli.py summarize runs this too.
+def main():
+    global current_json, current_answer, prompt
+
     #grab the source files, split them into pages, and stick them into a preprocessed directory.
     split_pdfs_in_directory()
 
-    #build the input dataset, get together a total of 1k tokens.
-    current_json = process_json(2000)
+    #build the input dataset, get together a total of 1k tokens. In all mode the batches are claimed as they are run.
+    if run_mode != 'all':
+        current_json = process_json(2000)
 
     prompt = '''
     Role:
@@ -432,23 +468,22 @@ if __name__ == '__main__':
     Remeber that the subject of a sentence is whats relevent to managing a project.
     Every time a sentence changes subject, create a new content section in the output json object, add a sumary of the content, then and add all the sentences since the last subject change as reference objects, splitting them as appropriate if the subject crosses paragraphs.
     If json object already has a content section, take care to track the relevent page change.
-    If the sentence is a header or footer, and the header or footer section of the json object is blank, then add it, otherwise ignore it.'''
+    The running header and footer have already been taken off the pages and are in the header and footer of the input, ignore any that are left.'''
 
 
-    #Get the first answer
-    current_answer = get_content()
+    #Get the first answer, RUN_MODE=all runs every queued batch concurrently instead of one per run
+    if run_mode == 'all':
+        current_answer = get_content_all(2000)
+    else:
+        current_answer = get_content()
+        if "Error" not in current_answer:
+            complete_json_batch(current_batch)
     logger.info(current_answer)
 
-    #get some experts to delibarate
-    #experts = get_experts()
-    
-
-
-    # Now we go and get the reviewers comments
-    #data = json.loads(experts)
-    #for expert in data['experts']:
-    #    current_answer = get_review(expert['Name'])
-    #    logger.info(current_answer)
+    #get some experts to delibarate, their reviews run at the same time and are merged before the final pass
+    if run_review:
+        current_answer, review_timings = review_stage(current_answer)
+        logger.info(current_answer)
 
-    #current_answer = get_final_answer()
-    #logger.info(current_answer)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -21,8 +21,7 @@ import PyPDF2
 import shutil
 
 #Token counter for modeling size to stuff into GPT
-import tiktoken
-encoding = tiktoken.encoding_for_model("gpt-4-0613")
+from tokens import count_tokens
 
 #Bring in the utils
 from utils import init_logging, init_db
@@ -172,10 +171,9 @@ def split_pdfs_in_directory():
                     "pages": []
                 }
 
-                # Extract content for each page and add to the JSON data object
-                for page_num in range(total_pages):
-                    page_content = pdf_reader.pages[page_num].extract_text()
-                    token_count =len(encoding.encode(page_content))
+                # Extract content for each page, count the tokens for the whole document in one batch and add to the JSON data object
+                page_contents = [pdf_reader.pages[page_num].extract_text() for page_num in range(total_pages)]
+                for page_num, (page_content, token_count) in enumerate(zip(page_contents, count_tokens(page_contents))):
                     document_data["pages"].append({
                         "page_number": page_num + 1,
                         "token_count": token_count,
@@ -0,0 +1,27 @@
+#OS imports
+import os
+import sys
+import shutil
+import tempfile
+
+#The modules read their settings from the environment when they are imported, so everything they write goes to a
+#scratch directory, set up before any test imports them.
+work_dir = tempfile.mkdtemp(prefix='knowledgesummary-tests-')
+os.environ.update(DATA_CONNECTION_STRING=os.path.join(work_dir, 'database.db'),
+                  DATA_SOURCE_DIR=os.path.join(work_dir, 'source'),
+                  DATA_PRE_PROCESSED_DIR=os.path.join(work_dir, 'source', 'preprocessed'),
+                  DATA_PROCESSED_DIR=os.path.join(work_dir, 'source', 'processed'),
+                  DATA_DIRECTORY=os.path.join(work_dir, 'data'),
+                  LOG_DIR=os.path.join(work_dir, 'log'),
+                  METRICS_ENABLED='false',
+                  VECTOR_BACKEND='numpy',
+                  EMBEDDING_BACKEND='hashing',
+                  EMBEDDING_DIM='64',
+                  WATCH_INTERVAL='0.05')
+for directory in ('source', 'data', 'log'):
+    os.makedirs(os.path.join(work_dir, directory), exist_ok=True)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(work_dir, ignore_errors=True)
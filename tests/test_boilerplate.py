@@ -0,0 +1,38 @@
+from collections import Counter
+
+import pytest
+
+from bench import clause_pages
+from boilerplate import strip_document, strip_pages, common_runs, meaningful, edge_keys
+
+@pytest.mark.parametrize('fixture', [{}, {"footer": None}, {"header": None}, {"header": None, "footer": None}],
+                         ids=['header_footer', 'header', 'footer', 'none'])
+@pytest.mark.parametrize('count', [10, 20, 243])
+def test_only_the_running_header_and_footer_are_stripped(fixture, count):
+    pages, bodies = clause_pages(count, **fixture)
+    report = strip_document(pages)
+    assert [page["content"] for page in pages] == bodies
+    assert report["header"].startswith('Acme Managed Services Agreement') == ("header" not in fixture)
+    assert report["footer"].startswith('Commercial in confidence') == ("footer" not in fixture)
+    assert report["boilerplate_pages"] == (0 if len(fixture) == 2 else count)
+
+def test_streamed_pages_learn_from_the_sample():
+    pages, bodies = clause_pages(100)
+    report = {}
+    stripped = list(strip_pages(iter(pages), report, sample=30))
+    assert [page["content"] for page in stripped] == bodies
+    assert report["boilerplate_pages"] == 100
+
+def test_numbers_and_stopwords_are_not_a_header():
+    assert not meaningful('The\x00#.#\x00')
+    assert not meaningful('Clause\x00#\x00of\x00the\x00')
+    assert meaningful('NAB\x00&\x00SUPPLIER\x00CONFIDENTIAL\x00')
+
+def test_a_run_stops_where_most_pages_go_their_own_way():
+    keys = Counter()
+    for page in range(20):
+        words = 'Acme Services CONFIDENTIAL Page # of #'.split() + (['12.1'] if page % 5 == 0 else [f'word{page}'])
+        keys.update(edge_keys(words))
+    runs = common_runs(keys, 3)
+    assert 'Acme\x00Services\x00CONFIDENTIAL\x00Page\x00#\x00of\x00#\x00' in runs
+    assert not any(key.endswith('#.#\x00') for key in runs)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from chunker import chunk_spans, chunk_pages
+from tokens import count_tokens
+
+PAGES = ['Clause 1.1 The Supplier must provide the services.\n\n1.2 Fees are payable in AUD — within 30 days.',
+         '',
+         'Schedule 2 – Service Levels\n\nAvailability ≥ 99.95% measured monthly, “Critical” incidents resolved in 4 hours. ' * 40,
+         'Ünïcödé café naïve résumé 日本語のテキスト ' * 60]
+
+def pages(texts):
+    return [{"page_number": number, "content": text, "token_count": count}
+            for number, (text, count) in enumerate(zip(texts, count_tokens(texts)), 1)]
+
+def test_spans_cover_each_page_with_overlap():
+    page_numbers, starts, stops = chunk_spans([250, 0, 100, 101], size=100, overlap=20)
+    assert page_numbers.tolist() == [0, 0, 0, 2, 3, 3]
+    assert starts.tolist() == [0, 80, 160, 0, 0, 80]
+    assert stops.tolist() == [100, 180, 250, 100, 100, 101]
+
+def test_spans_reject_overlap_as_big_as_the_chunk():
+    with pytest.raises(ValueError):
+        chunk_spans([10], size=10, overlap=10)
+
+@pytest.mark.parametrize('size,overlap', [(64, 16), (1000, 100)])
+def test_chunk_char_spans_match_the_page_text(size, overlap):
+    chunks = chunk_pages(pages(PAGES), '/contracts/sow.pdf', size, overlap)
+    assert chunks
+    for chunk in chunks:
+        text = PAGES[chunk.metadata["page_number"] - 1]
+        assert chunk.page_content == text[chunk.metadata["char_start"]:chunk.metadata["char_end"]]
+        assert chunk.metadata["page"] == chunk.metadata["page_number"] - 1
+        assert chunk.metadata["source"] == '/contracts/sow.pdf' and chunk.metadata["document"] == 'sow.pdf'
+        assert 0 < chunk.metadata["tokens"] <= size
+    #The empty page has no chunks, every other page is covered from its first character to its last
+    for number, text in enumerate(PAGES, 1):
+        spans = [(chunk.metadata["char_start"], chunk.metadata["char_end"]) for chunk in chunks if chunk.metadata["page_number"] == number]
+        if not text:
+            assert not spans
+            continue
+        assert spans[0][0] == 0 and spans[-1][1] == len(text)
+        assert all(start < end and next_start <= end for (start, end), (next_start, _) in zip(spans, spans[1:]))
+
+def test_paragraph_is_where_the_chunk_starts():
+    chunks = chunk_pages(pages([PAGES[0]]), 'sow.pdf', 8, 0)
+    paragraphs = [chunk.metadata["paragraph"] for chunk in chunks]
+    second = PAGES[0].index('1.2')
+    assert paragraphs == [1 if chunk.metadata["char_start"] < second else 2 for chunk in chunks]
+    assert np.all(np.diff(paragraphs) >= 0)
@@ -0,0 +1,92 @@
+import json
+import random
+import sqlite3
+
+import numpy as np
+
+from bench import WORDS
+from chunker import Chunk
+from dedup import minhash_signatures, dedup_chunks, duplicate_locations, NearDuplicateIndex
+
+def clause(seed, words=60):
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+def chunks(source, texts):
+    return [Chunk(text, {"source": source, "page": page, "char_start": 0, "char_end": len(text), "paragraph": 1})
+            for page, text in enumerate(texts)]
+
+def test_signatures_estimate_jaccard_similarity():
+    base = clause(1, 200).split()
+    edited = base[:180] + clause(2, 20).split()
+    signatures = minhash_signatures([' '.join(base), ' '.join(base), ' '.join(edited), clause(3, 200)])
+    assert signatures.shape == (4, 128) and signatures.dtype == np.uint32
+    assert np.array_equal(signatures[0], signatures[1])
+    assert np.mean(signatures[0] == signatures[2]) > 0.6
+    assert np.mean(signatures[0] == signatures[3]) < 0.2
+
+def test_signatures_do_not_depend_on_the_block():
+    texts = [clause(seed, 5 + seed % 40) for seed in range(150)] + ['', 'one']
+    together = minhash_signatures(texts)
+    assert all(np.array_equal(together[i], minhash_signatures([text])[0]) for i, text in enumerate(texts))
+
+def test_copies_are_dropped_and_recorded():
+    conn = sqlite3.connect(':memory:')
+    index = NearDuplicateIndex()
+    kept = dedup_chunks(chunks('sow.pdf', [clause(1), clause(2), clause(1)]), index, conn)
+    assert [chunk.metadata["page"] for chunk in kept] == [0, 1]
+    assert json.loads(kept[0].metadata["also_in"])[0]["page"] == 2
+
+    kept = dedup_chunks(chunks('moa.pdf', [clause(2), clause(3)]), index, conn)
+    assert [chunk.page_content for chunk in kept] == [clause(3)]
+    assert index.report()["duplicates"] == 2
+    assert [row["source"] for row in duplicate_locations(conn, {"source": 'sow.pdf', "page": 1, "char_start": 0})] == ['moa.pdf']
+
+def test_a_new_version_replaces_the_old_one():
+    conn = sqlite3.connect(':memory:')
+    index = NearDuplicateIndex()
+    dedup_chunks(chunks('sow.pdf', [clause(1), clause(1)]), index, conn)
+    #Same source again, nothing matches the version it replaces
+    kept = dedup_chunks(chunks('sow.pdf', [clause(1), clause(4)]), index, conn)
+    assert len(kept) == 2
+    assert conn.execute('SELECT COUNT(*) FROM chunk_duplicates').fetchone()[0] == 0
+    assert index.sources == {'sow.pdf'} and len(index.signatures) == 2
+
+def test_pending_chunks_are_not_matched_until_committed():
+    index = NearDuplicateIndex()
+    pending = index.pending()
+    dedup_chunks(chunks('sow.pdf', [clause(1)]), index, pending=pending)
+    assert len(dedup_chunks(chunks('ito.pdf', [clause(5)]), index)) == 1
+    index.commit(pending)
+    assert dedup_chunks(chunks('moa.pdf', [clause(1)]), index) == []
+
+def test_documents_in_flight_are_matched_against_each_other():
+    conn = sqlite3.connect(':memory:')
+    index = NearDuplicateIndex()
+    sow, moa = index.pending(), index.pending()
+    assert len(dedup_chunks(chunks('sow.pdf', [clause(1), clause(2)]), index, pending=sow)) == 2
+    kept = dedup_chunks(chunks('moa.pdf', [clause(2), clause(6)]), index, pending=moa)
+    assert [chunk.page_content for chunk in kept] == [clause(6)]
+    #Committed in either order, the copy points at the chunk the SOW kept
+    index.commit(moa, conn)
+    index.commit(sow, conn)
+    assert conn.execute('SELECT source, canonical_source, canonical_page FROM chunk_duplicates').fetchall() == [('moa.pdf', 'sow.pdf', 1)]
+    assert not index.in_flight
+
+def test_a_discarded_document_is_no_longer_matched():
+    index = NearDuplicateIndex()
+    failed = index.pending()
+    dedup_chunks(chunks('sow.pdf', [clause(1)]), index, pending=failed)
+    index.discard(failed)
+    assert len(dedup_chunks(chunks('moa.pdf', [clause(1)]), index)) == 1
+
+def test_committed_signatures_are_loaded_by_the_next_run(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'dedup.db')
+    dedup_chunks(chunks('sow.pdf', [clause(1), clause(2)]), NearDuplicateIndex(), conn)
+    dedup_chunks(chunks('sow.pdf', [clause(1), clause(7)]), NearDuplicateIndex().load(conn), conn)
+
+    index = NearDuplicateIndex().load(sqlite3.connect(tmp_path / 'dedup.db'))
+    assert index.sources == {'sow.pdf'} and len(index.signatures) == 2
+    kept = dedup_chunks(chunks('ito.pdf', [clause(1), clause(2), clause(7)]), conn=conn)
+    assert [chunk.page_content for chunk in kept] == [clause(2)]
+    assert conn.execute("SELECT COUNT(*) FROM chunk_duplicates WHERE source = 'ito.pdf'").fetchone()[0] == 2
@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+from chunker import Chunk
+from ingest import stream_ingest, incremental_ingest, chunk_ids
+
+#Just the parts of a Chroma store ingest.py uses
+class Collection:
+    def __init__(self):
+        self.rows = {}
+
+    def get(self, where, include):
+        return {"ids": [chunk_id for chunk_id, (_, metadata) in self.rows.items() if metadata["source"] == where["source"]]}
+
+    def add(self, ids, embeddings, documents, metadatas):
+        self.rows.update(zip(ids, zip(documents, metadatas)))
+
+    def delete(self, ids=None, where=None):
+        for chunk_id in list(self.rows) if ids is None else ids:
+            if ids is not None or self.rows[chunk_id][1]["source"] == where["source"]:
+                del self.rows[chunk_id]
+
+class VectorStore:
+    def __init__(self):
+        self._collection = Collection()
+        self.added = 0
+
+    def add_texts(self, texts, metadatas, ids):
+        self.added += len(ids)
+        self._collection.add(ids, None, texts, metadatas)
+
+SOURCE = '/contracts/sow.pdf'
+
+def document(texts_per_page):
+    return [[Chunk(text, {"source": SOURCE, "page": page}) for text in texts] for page, texts in enumerate(texts_per_page)]
+
+@pytest.fixture
+def conn():
+    return sqlite3.connect(':memory:')
+
+def test_second_run_keeps_what_is_there(conn):
+    vectordb = VectorStore()
+    batches = document([['a', 'b'], ['c'], ['d', 'd']])
+    assert stream_ingest(vectordb, SOURCE, batches, conn) == {"added": 5, "kept": 0, "removed": 0}
+    assert stream_ingest(vectordb, SOURCE, batches, conn) == {"added": 0, "kept": 5, "removed": 0}
+    assert vectordb.added == 5
+
+def test_resumes_after_a_partial_failure(conn):
+    vectordb = VectorStore()
+    stream_ingest(vectordb, SOURCE, document([['a', 'b'], ['c'], ['old']]), conn)
+    revised = document([['a', 'b2'], ['c', 'c2'], ['new']])
+
+    def failing():
+        yield revised[0]
+        raise RuntimeError('embedding service went away')
+
+    with pytest.raises(RuntimeError):
+        stream_ingest(vectordb, SOURCE, failing(), conn)
+    #Nothing was taken out, the new chunks so far are in next to the old ones
+    texts = {text for text, _ in vectordb._collection.rows.values()}
+    assert texts == {'a', 'b', 'b2', 'c', 'old'}
+
+    added = vectordb.added
+    report = stream_ingest(vectordb, SOURCE, revised, conn)
+    assert report == {"added": 2, "kept": 3, "removed": 2}
+    assert vectordb.added - added == 2
+    expected = {chunk_id for chunk_id, _ in chunk_ids([chunk for batch in revised for chunk in batch])}
+    assert set(vectordb._collection.rows) == expected
+    assert {row[0] for row in conn.execute('SELECT chunk_id FROM chunk_manifest')} == expected
+
+def test_picks_up_chunks_from_a_full_load(conn):
+    vectordb = VectorStore()
+    chunks = [chunk for batch in document([['a'], ['b']]) for chunk in batch]
+    for chunk_id, _ in chunk_ids(chunks):
+        vectordb._collection.rows[chunk_id] = ('', {"source": SOURCE})
+    assert stream_ingest(vectordb, SOURCE, [chunks], conn) == {"added": 0, "kept": 2, "removed": 0}
+
+def test_incremental_ingest_only_adds_changes(conn):
+    vectordb = VectorStore()
+    assert incremental_ingest(vectordb, document([['a', 'b']])[0], conn) == {"added": 2, "kept": 0, "removed": 0}
+    assert incremental_ingest(vectordb, document([['a', 'c']])[0], conn) == {"added": 1, "kept": 1, "removed": 1}
+    assert sorted(text for text, _ in vectordb._collection.rows.values()) == ['a', 'c']
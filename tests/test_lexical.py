@@ -0,0 +1,33 @@
+import numpy as np
+
+from lexical import encode_varints, decode_varints, encode_postings, encode_posting_lists, decode_postings
+
+def test_varints_roundtrip_across_byte_boundaries():
+    values = np.array([0, 1, 127, 128, 255, 16383, 16384, 2**21 - 1, 2**21, 2**28, 2**35 - 1, 2**35, 2**42 + 5, 2**63 + 1, 2**64 - 1], dtype=np.uint64)
+    data = encode_varints(values)
+    assert np.array_equal(decode_varints(data), values)
+    #One byte for each 7 bits
+    assert len(data) == sum(max(1, -(-int(value).bit_length() // 7)) for value in values)
+
+def test_varints_match_leb128():
+    assert encode_varints([300]) == bytes([0xAC, 0x02])
+    assert encode_varints([0, 1]) == bytes([0, 1])
+    assert encode_varints([]) == b''
+    assert len(decode_varints(b'')) == 0
+
+def test_varints_random_roundtrip():
+    rng = np.random.default_rng(0)
+    values = (rng.integers(0, 2**40, 5000, dtype=np.uint64) >> rng.integers(0, 40, 5000).astype(np.uint64))
+    assert np.array_equal(decode_varints(encode_varints(values)), values)
+
+def test_posting_lists_match_one_at_a_time():
+    id_lists = [[3, 7, 8], [1], [10, 200, 20000]]
+    frequency_lists = [[1, 2, 1], [5], [1, 1, 300]]
+    previous_ids = [0, 0, 9]
+    encoded = encode_posting_lists([np.array(ids) for ids in id_lists], [np.array(f) for f in frequency_lists], previous_ids)
+    assert encoded == [encode_postings(ids, frequencies, previous_id)
+                       for ids, frequencies, previous_id in zip(id_lists, frequency_lists, previous_ids)]
+
+    ids, frequencies = decode_postings(encoded[2])
+    assert (ids + previous_ids[2]).tolist() == id_lists[2]
+    assert frequencies.tolist() == frequency_lists[2]
@@ -0,0 +1,33 @@
+import llmrunner
+from llmrunner import TokenBucket
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_token_bucket_refills_at_its_rate(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llmrunner.time, 'monotonic', clock)
+    bucket = TokenBucket(600)
+    assert bucket.wait_time(600) == 0.0
+    bucket.take(600)
+    #600 a minute is 10 a second
+    assert bucket.wait_time(50) == 5.0
+    clock.now += 2
+    assert bucket.wait_time(50) == 3.0
+    clock.now += 3
+    assert bucket.wait_time(50) == 0.0
+
+def test_token_bucket_waits_off_an_overrun(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llmrunner.time, 'monotonic', clock)
+    bucket = TokenBucket(60)
+    bucket.take(90)
+    assert bucket.level == -30
+    assert bucket.wait_time(1) == 31.0
+    #Never more than a full bucket to wait for, however much is asked
+    clock.now += 10000
+    assert bucket.level <= 60 and bucket.wait_time(1000) == 0.0
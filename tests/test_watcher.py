@@ -0,0 +1,108 @@
+import os
+import queue
+import sqlite3
+import threading
+
+import pytest
+
+import bench
+import watcher
+from watcher import FolderWatcher, Pipeline, Stage, parse_workers
+from vectorstore import NumpyVectorStore
+
+#The stages move documents under watcher.data_source, so the tests feed that directory. Each test uses its own seeds,
+#every document is new to the store and the dedup index.
+@pytest.fixture
+def source():
+    os.makedirs(watcher.data_source, exist_ok=True)
+    yield watcher.data_source
+    for entry in os.scandir(watcher.data_source):
+        if entry.is_file():
+            os.remove(entry.path)
+
+def add_pdfs(directory, seeds, pages=6):
+    for seed in seeds:
+        bench.make_pdf(os.path.join(directory, f'contract-{seed}.pdf'), bench.synthetic_pages(pages, seed=seed))
+
+def run_once(folder_watcher):
+    thread = threading.Thread(target=folder_watcher.run, args=(threading.Event(), True), daemon=True)
+    thread.start()
+    thread.join(timeout=120)
+    assert not thread.is_alive(), 'the watcher did not drain'
+
+def test_parse_workers():
+    assert parse_workers('extract=3, embed=2') == {"extract": 3, "tokenize": 1, "chunk": 1, "embed": 2, "index": 1}
+    with pytest.raises(ValueError):
+        parse_workers('ocr=2')
+    with pytest.raises(ValueError):
+        parse_workers('index=2')
+
+def test_once_ingests_everything_there_and_drains(source):
+    rows = len(NumpyVectorStore())
+    add_pdfs(source, [101, 102, 103])
+    run_once(FolderWatcher(directory=source, workers=parse_workers('extract=2,embed=2')))
+    assert not [name for name in os.listdir(source) if name.endswith('.pdf')]
+    processed = os.listdir(os.path.join(source, 'processed'))
+    assert {f'contract-{seed}.pdf' for seed in [101, 102, 103]} <= set(processed)
+    assert len(NumpyVectorStore()) > rows
+
+def test_a_broken_document_fails_without_holding_up_the_rest(source):
+    add_pdfs(source, [201, 202])
+    with open(os.path.join(source, 'broken.pdf'), 'wb') as f:
+        f.write(b'not a pdf')
+    run_once(FolderWatcher(directory=source, workers=parse_workers('extract=1')))
+    assert os.listdir(os.path.join(source, 'failed')) == ['broken.pdf']
+    assert {'contract-201.pdf', 'contract-202.pdf'} <= set(os.listdir(os.path.join(source, 'processed')))
+
+def test_a_failing_job_goes_to_on_error_and_the_rest_carry_on():
+    done, failed = [], []
+
+    def check(job, context):
+        if job["name"] == 'bad':
+            raise ValueError('unreadable')
+        return job
+
+    pipeline = Pipeline([Stage('check', check, 2), Stage('pass', lambda job, context: job)],
+                        on_done=lambda job: done.append(job["name"]),
+                        on_error=lambda job, stage, error: failed.append((job["name"], stage)))
+    pipeline.start()
+    for name in ['a', 'bad', 'b', 'c']:
+        assert pipeline.submit({"name": name})
+    pipeline.drain()
+    assert sorted(done) == ['a', 'b', 'c'] and failed == [('bad', 'check')]
+
+def test_a_setup_error_is_raised_and_nothing_is_left_running():
+    def setup():
+        raise RuntimeError('no database')
+
+    stages = [Stage('first', lambda job, context: job, 1, queue_size=1), Stage('second', lambda job, context: job, 3, setup, queue_size=1)]
+    errors = queue.Queue()
+    thread = threading.Thread(target=lambda: errors.put(pytest.raises(RuntimeError, Pipeline(stages).start)), daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive(), 'start hung on the failed setup'
+    assert 'no database' in str(errors.get().value)
+    assert not any(worker.is_alive() for stage in stages for worker in stage.threads)
+
+def test_copies_arriving_together_are_embedded_once(source):
+    rows = len(NumpyVectorStore())
+    pages = bench.synthetic_pages(30, seed=301)
+    for name in ['sow.pdf', 'sow-copy.pdf']:
+        bench.make_pdf(os.path.join(source, name), pages)
+    run_once(FolderWatcher(directory=source, workers=parse_workers('extract=2,chunk=2')))
+    store = NumpyVectorStore()
+    added = {record["metadata"]["document"] for record in store.records[rows:]}
+    assert len(added) == 1
+
+    kept = added.pop()
+    copy = 'sow-copy.pdf' if kept == 'sow.pdf' else 'sow.pdf'
+    conn = sqlite3.connect(watcher.data_conn)
+    copies = conn.execute('SELECT COUNT(*) FROM chunk_duplicates WHERE source = ? AND canonical_source = ?',
+                          (os.path.join(source, copy), os.path.join(source, kept))).fetchone()[0]
+    assert copies == len(store) - rows
+
+    #A restarted watcher still knows them
+    bench.make_pdf(os.path.join(source, 'sow-again.pdf'), pages)
+    run_once(FolderWatcher(directory=source, workers=parse_workers('extract=1')))
+    assert len(NumpyVectorStore()) == len(store)
+    assert conn.execute('SELECT COUNT(*) FROM chunk_duplicates WHERE source = ?', (os.path.join(source, 'sow-again.pdf'),)).fetchone()[0] == copies
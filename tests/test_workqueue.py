@@ -0,0 +1,65 @@
+import time
+import json
+import sqlite3
+
+import pytest
+
+from workqueue import (init_work_queue, enqueue_document, claim_batch, renew_lease, complete_batch, release_batch, fail_batch,
+                       document_done, forget_document, queue_status)
+
+def packed(*page_runs):
+    return [{"pages": [{"page_number": page} for page in pages], "token_count": 100 * len(pages)} for pages in page_runs]
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = init_work_queue(sqlite3.connect(tmp_path / 'queue.db'))
+    enqueue_document(conn, 'sow', packed([1, 2], [3]), 2000)
+    return conn
+
+def test_enqueue_is_once_per_document(conn):
+    assert enqueue_document(conn, 'sow', packed([1]), 2000) == 0
+    assert queue_status(conn) == {"sow": {"pending": 2}}
+
+def test_two_workers_get_different_batches(conn):
+    first, second = claim_batch(conn, 'a'), claim_batch(conn, 'b')
+    assert (first["pages"], second["pages"]) == ([[1, 0], [2, 0]], [[3, 0]])
+    assert claim_batch(conn, 'c') is None
+
+def test_an_expired_lease_is_claimed_again(conn):
+    lost = claim_batch(conn, 'a', lease=-1)
+    again = claim_batch(conn, 'b')
+    assert again["id"] == lost["id"] and again["attempts"] == 2
+    #The first worker finds out it lost the batch
+    assert not renew_lease(conn, lost) and not complete_batch(conn, lost)
+    assert renew_lease(conn, again) and complete_batch(conn, again)
+
+def test_released_batches_go_back_and_failed_ones_never_do(conn):
+    batch = claim_batch(conn, 'a')
+    assert release_batch(conn, batch)
+    batch = claim_batch(conn, 'a')
+    assert batch["attempts"] == 2
+    assert fail_batch(conn, batch)
+    other = claim_batch(conn, 'a')
+    assert other["id"] != batch["id"] and claim_batch(conn, 'a') is None
+    assert complete_batch(conn, other)
+    assert not document_done(conn, 'sow')
+
+def test_document_done_and_forgotten(conn):
+    for owner in 'ab':
+        complete_batch(conn, claim_batch(conn, owner))
+    assert document_done(conn, 'sow')
+    forget_document(conn, 'sow')
+    assert enqueue_document(conn, 'sow', packed([1]), 2000) == 1
+
+def test_old_queue_is_migrated(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'old.db')
+    conn.execute('''CREATE TABLE page_queue (id INTEGER PRIMARY KEY, document TEXT, page_start INTEGER, page_end INTEGER,
+                    token_count INTEGER, status TEXT, lease_owner TEXT, lease_expiry REAL, attempts INTEGER, updated REAL)''')
+    conn.executemany('INSERT INTO page_queue VALUES (?, ?, ?, ?, ?, ?, NULL, NULL, ?, ?)',
+                     [(4, 'sow', 5, 6, 900, 'pending', 0, time.time()), (2, 'sow', 1, 4, 1800, 'done', 1, time.time())])
+    conn.commit()
+    init_work_queue(conn)
+    rows = conn.execute('SELECT id, seq, pages, token_limit, status FROM page_queue ORDER BY id').fetchall()
+    assert [(row[0], row[1], json.loads(row[2]), row[3], row[4]) for row in rows] == [
+        (2, 0, [[1, 0], [2, 0], [3, 0], [4, 0]], 1800, 'done'), (4, 1, [[5, 0], [6, 0]], 900, 'pending')]
+    assert claim_batch(conn, 'a')["id"] == 4
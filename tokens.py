@@ -0,0 +1,100 @@
+#OS imports
+import os
+import time
+import hashlib
+import logging
+
+#Token counter for modeling size to stuff into GPT
+import tiktoken
+
+#Bring in the utils
+from utils import init_db, batched
+from metrics import record_span, count
+
+data_conn = os.getenv('DATA_CONNECTION_STRING', './data/database.db')
+token_model = os.getenv('TOKEN_MODEL', 'gpt-4-0613')
+token_threads = int(os.getenv('TOKEN_THREADS', 8))
+
+logger = logging.getLogger(__name__)
+
+#SQLite caps the number of bound variables per statement, so cache lookups go in chunks.
+LOOKUP_CHUNK = 500
+
+#Encodings are loaded on first use and shared by everything in the process.
+_encodings = {}
+_conn = None
+
+def get_encoding(model=token_model):
+    if model not in _encodings:
+        _encodings[model] = tiktoken.encoding_for_model(model)
+    return _encodings[model]
+
+def init_token_cache(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS token_counts (
+                        content_hash TEXT NOT NULL,
+                        encoding_name TEXT NOT NULL,
+                        token_count INTEGER NOT NULL,
+                        PRIMARY KEY (content_hash, encoding_name)
+                    ) WITHOUT ROWID''')
+    conn.commit()
+    return conn
+
+def get_token_cache():
+    global _conn
+    if _conn is None:
+        _conn = init_token_cache(init_db(data_conn))
+    return _conn
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+#Count the tokens in a list of texts, returning the counts in the same order.
+#Counts come from the cache where we have seen the text before, the rest are
+#encoded in one batch across threads and written back to the cache.
+def count_tokens(texts, model=token_model, conn=None, num_threads=token_threads):
+    texts = list(texts)
+    if not texts:
+        return []
+
+    started = time.perf_counter()
+    encoding = get_encoding(model)
+    conn = conn or get_token_cache()
+    hashes = [content_hash(text) for text in texts]
+
+    cached = {}
+    unique_hashes = list(dict.fromkeys(hashes))
+    for i in range(0, len(unique_hashes), LOOKUP_CHUNK):
+        chunk = unique_hashes[i:i + LOOKUP_CHUNK]
+        rows = conn.execute(
+            f'SELECT content_hash, token_count FROM token_counts WHERE encoding_name = ? AND content_hash IN ({",".join("?" * len(chunk))})',
+            [encoding.name, *chunk])
+        cached.update(rows)
+
+    misses = {}
+    for text, text_hash in zip(texts, hashes):
+        if text_hash not in cached:
+            misses.setdefault(text_hash, text)
+    logger.debug(f'Token cache: {len(texts) - len(misses)} hits, {len(misses)} misses')
+
+    if misses:
+        encoded = encoding.encode_ordinary_batch(list(misses.values()), num_threads=num_threads)
+        counted = {text_hash: len(tokens) for text_hash, tokens in zip(misses, encoded)}
+        conn.executemany('INSERT OR REPLACE INTO token_counts (content_hash, encoding_name, token_count) VALUES (?, ?, ?)',
+                         [(text_hash, encoding.name, count) for text_hash, count in counted.items()])
+        conn.commit()
+        cached.update(counted)
+
+    record_span('tokenize', time.perf_counter() - started, texts=len(texts), misses=len(misses))
+    count('tokenize', 'texts', len(texts))
+    count('tokenize', 'cache_misses', len(misses))
+    return [cached[text_hash] for text_hash in hashes]
+
+#Fill in the token_count of a stream of pages, counting them batch_size at a time.
+def count_page_tokens(pages, batch_size=64, model=token_model, conn=None):
+    for batch in batched(pages, batch_size):
+        for page, token_count in zip(batch, count_tokens([page["content"] for page in batch], model=model, conn=conn)):
+            page["token_count"] = token_count
+            yield page
+
+def count_text_tokens(text, model=token_model, conn=None):
+    return count_tokens([text], model=model, conn=conn)[0]
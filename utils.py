@@ -1,33 +1,139 @@
 import os
+import re
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
 from datetime import datetime
 import sqlite3
 
+log_dir = os.getenv('LOG_DIR', 'log')
+#Each run's file rolls over at this size, keeping this many rolled over files
+log_max_mb = float(os.getenv('LOG_MAX_MB', 10))
+log_backups = int(os.getenv('LOG_BACKUPS', 3))
+#Log files older than this, or past this much in total (oldest first), are removed when logging starts
+log_retention_days = float(os.getenv('LOG_RETENTION_DAYS', 14))
+log_retention_mb = float(os.getenv('LOG_RETENTION_MB', 200))
+#Messages longer than this are cut short, and only 1 in LOG_SAMPLE_LARGE of the long DEBUG ones is kept at all
+log_max_message = int(os.getenv('LOG_MAX_MESSAGE', 4000))
+log_sample_large = int(os.getenv('LOG_SAMPLE_LARGE', 1))
+#Records waiting for the writer thread, past this the caller waits for the writer to catch up
+log_queue_size = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+#Libraries that are chatty at DEBUG and not what we are looking for
+QUIET_LOGGERS = ('urllib3', 'openai', 'chromadb', 'httpx', 'httpcore', 'PyPDF2', 'pypdf', 'asyncio')
+LEVEL_ALIASES = {'INFORMATION': 'INFO'}
+
+_listener = None
+
+#The files init_logging writes, log_<date>_<time>_<pid>.log, and the handler's rolled over copies of them (.1, .2 ...).
+#Logs named any other way, e.g. the ones kept in the repo, are never pruned.
+LOG_FILE = re.compile(r'log_\d{4}(_\d{2}){5}_\d+\.log(\.\d+)?')
+
+#Cuts long messages down and samples the long DEBUG ones. Runs on the writer thread, which is where the
+#message is first formatted, so the caller never pays for building the text of a record that gets dropped.
+class PayloadFilter(logging.Filter):
+    def __init__(self, max_chars=log_max_message, sample_every=log_sample_large):
+        super().__init__()
+        self.max_chars = max_chars
+        self.sample_every = max(1, sample_every)
+        self.large = 0
+
+    def filter(self, record):
+        message = record.getMessage()
+        if self.max_chars and len(message) > self.max_chars:
+            if record.levelno <= logging.DEBUG:
+                self.large += 1
+                if (self.large - 1) % self.sample_every:
+                    return False
+            record.msg = f'{message[:self.max_chars]} ... [{len(message) - self.max_chars} more characters]'
+            record.args = None
+        return True
+
+#Hands records to the writer thread as they are, without formatting them first (the stock QueueHandler
+#formats in the caller so records can be pickled, we never leave the process). The arguments are formatted
+#on the writer thread, so don't change an object after logging it.
+#The queue is bounded, so a writer that falls behind slows the callers down rather than eating memory.
+class BackgroundHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        self.queue.put(record)
+
+class BackgroundListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+#Remove old run logs, by age and then oldest first until they are under the size budget.
+def prune_logs(directory=log_dir, retention_days=log_retention_days, retention_mb=log_retention_mb):
+    files = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if LOG_FILE.fullmatch(name) and os.path.isfile(path):
+            files.append((os.path.getmtime(path), os.path.getsize(path), path))
+
+    cutoff = time.time() - retention_days * 86400
+    total = sum(size for _, size, _ in files)
+    for modified, size, path in sorted(files):
+        if modified < cutoff or total > retention_mb * 1024 * 1024:
+            os.remove(path)
+            total -= size
+
+#Log to a file per run under LOG_DIR, written by a background thread.
+#The handler goes on the root logger so the helper modules' loggers end up in the same file.
+#Calling it again only changes the level.
 def init_logging(log_level='DEBUG'):
-    numeric_level = getattr(logging, log_level, None)
+    global _listener
+    numeric_level = getattr(logging, LEVEL_ALIASES.get(log_level, log_level), None)
     if not isinstance(numeric_level, int):
         raise ValueError(f'Invalid log level: {log_level}')
 
     logger = logging.getLogger(__name__)
-    logger.setLevel(numeric_level)
+    root = logging.getLogger()
+    root.setLevel(numeric_level)
+    if _listener is not None:
+        return logger
+
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(numeric_level, logging.WARNING))
 
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(funcName)s - %(message)s')
 
-    log_dir = 'log'
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
+    prune_logs()
 
-    log_file = os.path.join(log_dir, f'log_{datetime.now().strftime("%Y_%m_%d_%H_%M_%S")}.log')
-    fh = logging.FileHandler(log_file, encoding='utf-8')
+    log_file = os.path.join(log_dir, f'log_{datetime.now().strftime("%Y_%m_%d_%H_%M_%S")}_{os.getpid()}.log')
+    fh = logging.handlers.RotatingFileHandler(log_file, maxBytes=int(log_max_mb * 1024 * 1024), backupCount=log_backups,
+                                              encoding='utf-8', delay=True)
     fh.setFormatter(formatter)
-    logger.addHandler(fh)
+    fh.addFilter(PayloadFilter())
+
+    handler = BackgroundHandler(queue.Queue(log_queue_size))
+    root.addHandler(handler)
+    _listener = BackgroundListener(handler.queue, fh)
+    _listener.start()
+    atexit.register(_listener.stop)
 
     return logger
 
+#Lists of up to size items from any iterable, without reading ahead any further than that.
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 def init_db(data_conn='./data/database.db'):
     db_dir = os.path.dirname(data_conn)
     if not os.path.exists(db_dir):
         os.makedirs(db_dir)
-    
+
     conn = sqlite3.connect(data_conn)
-    return conn
\ No newline at end of file
+    return conn
@@ -0,0 +1,256 @@
+#OS imports
+import os
+import sys
+import json
+import uuid
+import logging
+
+#Vector maths
+import numpy as np
+
+#Langchain document, what the retrievers hand back
+from langchain.schema import Document
+
+#Optional approximate index for when exact search gets too slow
+from annindex import IVFIndex, INDEX_FILE
+
+data_directory= os.getenv('DATA_DIRECTORY', './data')
+vector_store_dir= os.getenv('VECTOR_STORE_DIR', os.path.join(data_directory, 'numpy'))
+#chroma or numpy, which store the query scripts search
+vector_backend= os.getenv('VECTOR_BACKEND', 'chroma')
+
+logger = logging.getLogger(__name__)
+
+#An in process vector store for corpora small enough to search exhaustively.
+#   vectors.f32     unit length float32 rows, appended, opened as a memory map
+#   vectors.jsonl   one line per row: id, text and metadata
+#   header.json     the dimension
+#   ivf.npz         optional IVF index, see annindex.py. Searches use it when it exists, exact=True skips it
+#Rows are normalised when they are added so a query is one matrix product against the whole matrix.
+VECTORS_FILE = 'vectors.f32'
+METADATA_FILE = 'vectors.jsonl'
+HEADER_FILE = 'header.json'
+
+def normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+#Top k rows of a score matrix, best first, without sorting every score.
+def top_k(scores, k):
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+#Append rows to the store files without opening the store, for a writer that never searches what it writes, e.g. a
+#document streamed in a batch at a time, which then holds no more than the batch. The vectors go in before their
+#metadata lines, see refresh. Returns the normalised vectors and the new metadata records.
+def append_embeddings(persist_directory, texts, embeddings, metadatas=None, ids=None, dim=None):
+    texts = list(texts)
+    if not texts:
+        return np.empty((0, dim or 0), dtype=np.float32), []
+    vectors = normalise(embeddings)
+    metadatas = metadatas or [{} for _ in texts]
+    ids = ids or [str(uuid.uuid4()) for _ in texts]
+
+    os.makedirs(persist_directory, exist_ok=True)
+    header_path = os.path.join(persist_directory, HEADER_FILE)
+    if dim is None and os.path.exists(header_path):
+        with open(header_path) as f:
+            dim = json.load(f)["dim"]
+    if dim is None:
+        dim = vectors.shape[1]
+        with open(header_path, 'w') as f:
+            json.dump({"dim": dim}, f)
+    elif vectors.shape[1] != dim:
+        raise ValueError(f'Expected {dim} dimensional embeddings, got {vectors.shape[1]}')
+
+    with open(os.path.join(persist_directory, VECTORS_FILE), 'ab') as f:
+        f.write(vectors.tobytes())
+    new_records = [{"id": row_id, "text": text, "metadata": metadata} for row_id, text, metadata in zip(ids, texts, metadatas)]
+    with open(os.path.join(persist_directory, METADATA_FILE), 'ab') as f:
+        for record in new_records:
+            f.write((json.dumps(record) + '\n').encode('utf-8'))
+    return vectors, new_records
+
+class NumpyVectorStore:
+    def __init__(self, embedding_function=None, persist_directory=vector_store_dir):
+        self._embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.dim = None
+        self.records = []
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self.index = None
+        #How far into vectors.jsonl we have read, see refresh
+        self.metadata_offset = 0
+
+        header_path = os.path.join(persist_directory, HEADER_FILE)
+        if os.path.exists(header_path):
+            with open(header_path) as f:
+                self.dim = json.load(f)["dim"]
+            with open(os.path.join(persist_directory, METADATA_FILE), 'rb') as f:
+                self.records = [json.loads(line) for line in f]
+                self.metadata_offset = f.tell()
+            self._map()
+            self._load_index()
+
+    def _map(self):
+        path = os.path.join(self.persist_directory, VECTORS_FILE)
+        rows = len(self.records)
+        self.matrix = np.memmap(path, dtype=np.float32, mode='r', shape=(rows, self.dim)) if rows else np.empty((0, self.dim), dtype=np.float32)
+
+    def _load_index(self):
+        index_path = os.path.join(self.persist_directory, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        self.index = IVFIndex.load(index_path)
+        #Rows appended by something that didn't load the index
+        if len(self.index) < len(self.records):
+            self.index.add(self.matrix[len(self.index):])
+            self.index.save(index_path)
+
+    def __len__(self):
+        return len(self.records)
+
+    #Pick up rows another process has added since the store was opened, e.g. python watcher.py feeding python service.py.
+    #The writer appends the vectors before the metadata, so every complete metadata line has its vector.
+    #Returns the number of new rows.
+    def refresh(self):
+        header_path = os.path.join(self.persist_directory, HEADER_FILE)
+        if not os.path.exists(header_path):
+            return 0
+        if self.dim is None:
+            with open(header_path) as f:
+                self.dim = json.load(f)["dim"]
+
+        new_records = []
+        with open(os.path.join(self.persist_directory, METADATA_FILE), 'rb') as f:
+            f.seek(self.metadata_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                new_records.append(json.loads(line))
+                self.metadata_offset += len(line)
+        if new_records:
+            self.records.extend(new_records)
+            self._map()
+            if self.index is None:
+                self._load_index()
+            elif len(self.index) < len(self.records):
+                self.index.add(self.matrix[len(self.index):])
+        return len(new_records)
+
+    #Train the IVF index over every row, replacing any existing one.
+    def build_index(self, nlist=None):
+        if not len(self.records):
+            raise ValueError('Nothing to index, the store is empty')
+        self.index = IVFIndex.train(self.matrix, nlist)
+        self.index.save(os.path.join(self.persist_directory, INDEX_FILE))
+        return self.index
+
+    def drop_index(self):
+        self.index = None
+        index_path = os.path.join(self.persist_directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        vectors, new_records = append_embeddings(self.persist_directory, texts, embeddings, metadatas, ids, self.dim)
+        if not new_records:
+            return []
+        self.dim = vectors.shape[1]
+        self.metadata_offset = os.path.getsize(os.path.join(self.persist_directory, METADATA_FILE))
+
+        self.records.extend(new_records)
+        self._map()
+        if self.index is not None:
+            self.index.add(vectors)
+            self.index.save(os.path.join(self.persist_directory, INDEX_FILE))
+        return [record["id"] for record in new_records]
+
+    def add_texts(self, texts, metadatas=None, ids=None):
+        texts = list(texts)
+        return self.add_embeddings(texts, self._embedding_function.embed_documents(texts), metadatas, ids)
+
+    def add_documents(self, documents, ids=None):
+        return self.add_texts([doc.page_content for doc in documents], [doc.metadata for doc in documents], ids)
+
+    #Search with many query vectors at once: one (queries x rows) matrix product then a partial sort per row.
+    #Returns a list per query of (row, score) pairs, best first.
+    #With an IVF index only the nprobe nearest lists are scored, pass exact=True to search every row.
+    def search_batch(self, query_vectors, k=4, exact=False, nprobe=None):
+        if not len(self.records):
+            return [[] for _ in query_vectors]
+        if self.index is not None and not exact:
+            return self.index.search_batch(self.matrix, normalise(query_vectors), k, nprobe)
+        scores = normalise(query_vectors) @ self.matrix.T
+        best = top_k(scores, k)
+        return [[(int(row), float(scores[i, row])) for row in best[i]] for i in range(len(best))]
+
+    def _documents(self, hits):
+        return [Document(page_content=self.records[row]["text"], metadata={**self.records[row]["metadata"], "score": score})
+                for row, score in hits]
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        return self._documents(self.search_batch([embedding], k)[0])
+
+    def similarity_search(self, query, k=4):
+        return self.similarity_search_by_vector(self._embedding_function.embed_query(query), k)
+
+    #Many questions with one embedding call and one matrix product.
+    def similarity_search_batch(self, queries, k=4):
+        queries = list(queries)
+        hits = self.search_batch(self._embedding_function.embed_documents(queries), k)
+        return {query: self._documents(query_hits) for query, query_hits in zip(queries, hits)}
+
+    def as_retriever(self, search_kwargs=None):
+        return NumpyRetriever(self, (search_kwargs or {}).get("k", 4))
+
+    @classmethod
+    def from_documents(cls, documents, embedding, persist_directory=vector_store_dir, ids=None):
+        store = cls(embedding, persist_directory)
+        store.add_documents(documents, ids)
+        return store
+
+    #Copy the embeddings out of a persisted Chroma collection so nothing has to be embedded again.
+    @classmethod
+    def from_chroma(cls, vectordb, persist_directory=vector_store_dir):
+        data = vectordb._collection.get(include=["embeddings", "documents", "metadatas"])
+        store = cls(vectordb._embedding_function, persist_directory)
+        if data["ids"]:
+            store.add_embeddings(data["documents"], data["embeddings"], data["metadatas"], data["ids"])
+        logger.info(f'Copied {len(data["ids"])} vectors from Chroma into {persist_directory}')
+        return store
+
+#The bit of the langchain retriever interface the scripts use.
+class NumpyRetriever:
+    def __init__(self, store, k=4):
+        self.store = store
+        self.k = k
+
+    def get_relevant_documents(self, query):
+        return self.store.similarity_search(query, self.k)
+
+#The store langquery.py and langreader.py search: the persisted Chroma collection, or with VECTOR_BACKEND=numpy
+#the in process copy of it, which loads without starting a Chroma client.
+def open_vector_store(embedding_function=None, backend=vector_backend):
+    if backend == 'numpy':
+        return NumpyVectorStore(embedding_function=embedding_function)
+    from langchain.vectorstores import Chroma
+    return Chroma(embedding_function=embedding_function, persist_directory=data_directory)
+
+if __name__ == '__main__':
+    #python vectorstore.py            build the numpy store from the persisted Chroma collection under DATA_DIRECTORY
+    #python vectorstore.py index [n]  train the IVF index over it with n lists (IVF_NLIST or 4 * sqrt(rows))
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1 and sys.argv[1] == 'index':
+        index = NumpyVectorStore().build_index(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        print(f'{len(index)} rows in {index.nlist} lists, searching {index.nprobe} lists per query')
+    else:
+        from langchain.vectorstores import Chroma
+        if os.path.exists(os.path.join(vector_store_dir, HEADER_FILE)):
+            raise SystemExit(f'{vector_store_dir} already holds a vector store, remove it to rebuild')
+        NumpyVectorStore.from_chroma(Chroma(persist_directory=data_directory), vector_store_dir)
@@ -0,0 +1,361 @@
+#OS imports
+import os
+import sys
+import time
+import queue
+import signal
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+#Env Mgt
+from dotenv import load_dotenv
+
+#Bring in the utils
+from utils import init_logging, init_db
+
+#Whole document extraction, token counts and the page store
+from extract import extract_page_range
+from tokens import count_tokens, init_token_cache
+from preprocess import save_document_store, move_to_processed, data_pre_processed
+from boilerplate import strip_document
+
+#Search indexes
+from lexical import init_lexical_index, index_document
+from embeddings import get_embeddings
+from ingest import incremental_ingest, chunk_ids
+from chunker import chunk_pages
+from dedup import dedup_chunks, NearDuplicateIndex
+
+#Run metrics
+from metrics import record_span, count
+
+#Watches DATA_SOURCE_DIR and feeds each new PDF through extract -> tokenize -> chunk -> embed -> index.
+#Each stage has its own worker threads and a bounded queue in front of it. A slow stage fills its queue, and that
+#holds up the stage before it and in the end the watcher, so nothing piles up in memory.
+#The PDF is parsed once: index writes the page store, adds the pages to the BM25 index and the chunks to the vector
+#store, then moves the PDF to processed (or failed, if a stage raised). python service.py finds the new pages and
+#vectors within QUERY_REFRESH_SECONDS with VECTOR_BACKEND=numpy, Chroma is only re-read when the service restarts.
+#SIGINT or SIGTERM stops the watcher and drains every document already started before exiting.
+data_conn = os.getenv('DATA_CONNECTION_STRING', './data/database.db')
+data_source= os.getenv('DATA_SOURCE_DIR', './source')
+data_directory= os.getenv('DATA_DIRECTORY', './data')
+vector_backend= os.getenv('VECTOR_BACKEND', 'chroma')
+watch_interval = float(os.getenv('WATCH_INTERVAL', 1))
+watch_queue_size = int(os.getenv('WATCH_QUEUE_SIZE', 4))
+#Workers per stage, stages not named get one. index always has one, it is the only writer to the stores.
+watch_workers = os.getenv('WATCH_WORKERS', 'extract=2,embed=2')
+log_level = os.getenv('LOG_LEVEL', 'INFO')
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('extract', 'tokenize', 'chunk', 'embed', 'index')
+STOP = object()
+
+def parse_workers(spec):
+    workers = {stage: 1 for stage in STAGES}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        stage, _, number = item.partition('=')
+        if stage not in workers:
+            raise ValueError(f'Unknown stage {stage} in WATCH_WORKERS, expected one of {", ".join(STAGES)}')
+        workers[stage] = max(1, int(number))
+    if workers["index"] != 1:
+        raise ValueError('index runs on a single worker')
+    return workers
+
+#A stage's workers each take jobs off the input queue, run function(job, context) and put the job on the next
+#stage's queue. setup is run on each worker thread to make its context, e.g. its own sqlite connection.
+class Stage:
+    def __init__(self, name, function, workers=1, setup=None, queue_size=watch_queue_size):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.setup = setup
+        self.input = queue.Queue(queue_size)
+        self.output = None
+        self.threads = []
+
+    def start(self, output, on_done, on_error, ready):
+        self.output = output
+        self.on_done = on_done
+        self.on_error = on_error
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(ready,), name=f'{self.name}-{number}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self, ready):
+        try:
+            context = self.setup() if self.setup else None
+        except Exception as e:
+            ready.put(e)
+            return
+        ready.put(None)
+
+        while True:
+            job = self.input.get()
+            if job is STOP:
+                return
+            waited = time.perf_counter() - job["queued"]
+            started = time.perf_counter()
+            try:
+                job = self.function(job, context)
+            except Exception as e:
+                logger.exception(f'{self.name} failed for {job["name"]}')
+                self.on_error(job, self.name, e)
+                continue
+            record_span(f'watch_{self.name}', time.perf_counter() - started, file=job["name"], waited=round(waited, 6))
+            if self.output is None:
+                self.on_done(job)
+            else:
+                job["queued"] = time.perf_counter()
+                #Blocks while the next stage is behind, which is the back-pressure
+                self.output.put(job)
+
+    #Let the workers finish what is queued, then stop them. Only workers still running take a STOP off the queue, one
+    #whose setup failed has already gone and a STOP for it would fill the queue with nobody left to empty it.
+    def stop(self):
+        for thread in self.threads:
+            if thread.is_alive():
+                self.input.put(STOP)
+        for thread in self.threads:
+            thread.join()
+
+class Pipeline:
+    def __init__(self, stages, on_done=None, on_error=None, closers=()):
+        self.stages = stages
+        self.on_done = on_done or (lambda job: None)
+        self.on_error = on_error or (lambda job, stage, error: None)
+        self.closers = list(closers)
+
+    #Start every worker and wait for their setup, raising the first setup error.
+    def start(self):
+        ready = queue.Queue()
+        for stage, following in zip(self.stages, self.stages[1:] + [None]):
+            stage.start(following.input if following else None, self.on_done, self.on_error, ready)
+        errors = [error for error in (ready.get() for _ in range(sum(stage.workers for stage in self.stages))) if error]
+        if errors:
+            self.drain()
+            raise errors[0]
+
+    #False if the first stage stayed full for the whole timeout.
+    def submit(self, job, timeout=None):
+        job["queued"] = time.perf_counter()
+        try:
+            self.stages[0].input.put(job, timeout=timeout)
+        except queue.Full:
+            return False
+        return True
+
+    #Stages are stopped in order, so every job already submitted makes it through the rest of the pipeline.
+    def drain(self):
+        for stage in self.stages:
+            stage.stop()
+        for close in self.closers:
+            close()
+
+    def depths(self):
+        return {stage.name: stage.input.qsize() for stage in self.stages}
+
+#The tokenize, chunk and index workers write to the same database, each on its own connection. sqlite3 sends BEGIN
+#before an INSERT/UPDATE/DELETE even when executemany has no rows, so index_document's transaction can start with
+#add_pages' SELECT MAX(id) and only ask for the write lock afterwards. If the chunk worker commits in between, each
+#waits on the other's lock, sqlite fails the index worker straight away as locked and no timeout helps. BEGIN
+#IMMEDIATE takes the write lock when the transaction starts, so the second writer waits, for up to busy_timeout.
+def writer_db():
+    conn = init_db(data_conn)
+    conn.execute('PRAGMA busy_timeout=30000')
+    conn.isolation_level = 'IMMEDIATE'
+    return conn
+
+#The process pool the extract workers share. A worker process that dies (killed for memory, a crash in the PDF
+#parser) breaks the whole pool, so the first extract worker to see that puts a new one in its place. The documents
+#that were in the broken pool fail, the ones after them go to the new pool.
+class ExtractPool:
+    def __init__(self, workers):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def replace(self, broken):
+        with self.lock:
+            if self.executor is broken:
+                logger.warning('An extract process died, starting a new process pool')
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        broken.shutdown(wait=False)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+def extract_stage(job, pool):
+    executor = pool.executor
+    try:
+        result = executor.submit(extract_page_range, job["path"]).result()
+    except BrokenProcessPool:
+        pool.replace(executor)
+        raise
+    for page, elapsed in zip(result["pages"], result["page_times"]):
+        record_span('extract', elapsed, file=job["name"], page=page["page_number"], worker=result["worker"])
+    count('extract', 'pages', len(result["pages"]))
+    job["pages"] = result["pages"]
+    return job
+
+#The stages using a writer_db connection run in a with block, so a job that fails rolls back rather than leaving its
+#transaction, and the write lock, open for the next job.
+def tokenize_stage(job, conn):
+    with conn:
+        job["boilerplate"] = strip_document(job["pages"], conn=conn)
+        for page, token_count in zip(job["pages"], count_tokens([page["content"] for page in job["pages"]], conn=conn)):
+            page["token_count"] = token_count
+    return job
+
+#Same chunking as loadlang.py. Near duplicates of any chunk of another document already indexed, or kept by another
+#document in the pipeline, are dropped. The chunks kept wait in job["dedup"] until index_stage commits them, or the
+#watcher discards them if the document fails.
+def chunk_stage(job, duplicates):
+    job["dedup"] = duplicates.pending()
+    job["chunks"] = dedup_chunks(chunk_pages(job["pages"], os.path.join(data_source, job["name"])), duplicates, pending=job["dedup"])
+    count('watch', 'chunks', len(job["chunks"]))
+    return job
+
+def embed_stage(job, embedding):
+    job["vectors"] = embedding.embed_documents([chunk.page_content for chunk in job["chunks"]])
+    return job
+
+#What the index worker holds on to: its connection, the vector store and the dedup index a document's chunks are
+#committed to once they are in the store.
+class Indexer:
+    def __init__(self, duplicates, backend=vector_backend):
+        self.duplicates = duplicates
+        os.makedirs(data_pre_processed, exist_ok=True)
+        os.makedirs(os.path.join(data_source, 'processed'), exist_ok=True)
+        self.conn = init_lexical_index(writer_db())
+        self.backend = backend
+        if backend == 'numpy':
+            from vectorstore import NumpyVectorStore
+            self.vectordb = NumpyVectorStore()
+            self.known_ids = {record["id"] for record in self.vectordb.records}
+        else:
+            from langchain.vectorstores import Chroma
+            self.vectordb = Chroma(embedding_function=get_embeddings(), persist_directory=data_directory)
+
+    #The numpy store can't delete, so chunks of an earlier version of a changed document stay until it is rebuilt.
+    def add_chunks(self, chunks, vectors):
+        if self.backend != 'numpy':
+            report = incremental_ingest(self.vectordb, chunks, self.conn, embeddings=vectors)
+            self.vectordb.persist()
+            return report["added"]
+
+        new = [(chunk, vector, chunk_id) for chunk, vector, (chunk_id, _) in zip(chunks, vectors, chunk_ids(chunks))
+               if chunk_id not in self.known_ids]
+        if new:
+            self.vectordb.add_embeddings([chunk.page_content for chunk, _, _ in new], [vector for _, vector, _ in new],
+                                         [chunk.metadata for chunk, _, _ in new], [chunk_id for _, _, chunk_id in new])
+            self.known_ids.update(chunk_id for _, _, chunk_id in new)
+        return len(new)
+
+def index_stage(job, indexer):
+    save_document_store(job["name"], job["pages"], job["boilerplate"])
+    with indexer.conn:
+        pages = index_document(indexer.conn, job["name"], job["pages"])
+        added = indexer.add_chunks(job["chunks"], job["vectors"])
+        indexer.duplicates.commit(job["dedup"], indexer.conn)
+    move_to_processed(job["path"], os.path.join(data_source, 'processed'))
+    logger.info(f'{job["name"]}: {len(job["pages"])} pages ({pages["added"]} new to BM25), {added} new chunks, '
+                f'searchable {time.time() - job["found"]:.1f}s after it was found')
+    return job
+
+#The dedup index starts with the signatures of everything indexed before, see NearDuplicateIndex.load.
+def load_duplicates():
+    conn = init_db(data_conn)
+    try:
+        return NearDuplicateIndex().load(conn)
+    finally:
+        conn.close()
+
+def build_pipeline(workers, on_done=None, on_error=None, queue_size=watch_queue_size, duplicates=None):
+    #Extraction is CPU bound, the extract threads hand the parsing to processes
+    pool = ExtractPool(workers["extract"])
+    duplicates = duplicates if duplicates is not None else load_duplicates()
+    stages = [
+        Stage('extract', extract_stage, workers["extract"], lambda: pool, queue_size),
+        Stage('tokenize', tokenize_stage, workers["tokenize"], lambda: init_token_cache(writer_db()), queue_size),
+        Stage('chunk', chunk_stage, workers["chunk"], lambda: duplicates, queue_size),
+        Stage('embed', embed_stage, workers["embed"], get_embeddings, queue_size),
+        Stage('index', index_stage, 1, lambda: Indexer(duplicates), queue_size),
+    ]
+    return Pipeline(stages, on_done, on_error, closers=[pool.shutdown])
+
+#Polls the source directory. A PDF is only picked up once its size and modified time are the same on two polls
+#in a row, so one still being copied in is left alone.
+class FolderWatcher:
+    def __init__(self, directory=data_source, interval=watch_interval, workers=None):
+        self.directory = directory
+        self.interval = interval
+        self.seen = {}
+        self.in_progress = set()
+        self.duplicates = load_duplicates()
+        self.pipeline = build_pipeline(workers or parse_workers(watch_workers), self.done, self.failed, duplicates=self.duplicates)
+
+    def done(self, job):
+        self.in_progress.discard(job["path"])
+        count('watch', 'documents')
+        record_span('watch_latency', time.time() - job["found"], file=job["name"], pages=len(job["pages"]))
+
+    def failed(self, job, stage, error):
+        failed_dir = os.path.join(self.directory, 'failed')
+        os.makedirs(failed_dir, exist_ok=True)
+        if os.path.exists(job["path"]):
+            move_to_processed(job["path"], failed_dir)
+        if "dedup" in job:
+            self.duplicates.discard(job["dedup"])
+        self.in_progress.discard(job["path"])
+        count('watch', 'failed')
+        logger.error(f'Moved {job["name"]} to {failed_dir} after {stage} failed: {error}')
+
+    def scan(self, settle=True):
+        ready = []
+        current = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.lower().endswith('.pdf') and entry.path not in self.in_progress:
+                stat = entry.stat()
+                current[entry.path] = (stat.st_size, stat.st_mtime)
+                if not settle or self.seen.get(entry.path) == current[entry.path]:
+                    ready.append(entry.path)
+        self.seen = current
+        return sorted(ready)
+
+    #Feed new files in until stop is set. once: take what is there now, wait for it to go through, and return.
+    def run(self, stop, once=False):
+        self.pipeline.start()
+        logger.info(f'Watching {self.directory} every {self.interval}s')
+        try:
+            while not stop.is_set():
+                for path in self.scan(settle=not once):
+                    job = {"path": path, "name": os.path.basename(path), "found": time.time()}
+                    self.in_progress.add(path)
+                    while not self.pipeline.submit(job, timeout=self.interval):
+                        if stop.is_set():
+                            #Never started, it is picked up again next time
+                            self.in_progress.discard(path)
+                            break
+                    if stop.is_set():
+                        break
+                if once:
+                    break
+                stop.wait(self.interval)
+        finally:
+            logger.info(f'Draining {sum(self.pipeline.depths().values())} queued and every in flight document')
+            self.pipeline.drain()
+            logger.info('Stopped')
+
+if __name__ == '__main__':
+    #python watcher.py        watch until SIGINT or SIGTERM
+    #python watcher.py once   ingest the PDFs there now and exit
+    load_dotenv()
+    init_logging(log_level)
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    FolderWatcher().run(stop, once=len(sys.argv) > 1 and sys.argv[1] == 'once')
@@ -0,0 +1,174 @@
+#OS imports
+import os
+import json
+import time
+import socket
+import logging
+
+logger = logging.getLogger(__name__)
+
+lease_seconds = int(os.getenv('QUEUE_LEASE_SECONDS', 600))
+
+#Batches of pages waiting to go through the LLM. A worker claims a batch by taking a lease on it,
+#if the worker dies the lease expires and the batch can be claimed again by someone else.
+#pages is a JSON list of [page_number, part], part is 0 for a whole page or the part of a page split by the packer.
+#status is one of pending, leased, done, failed
+PAGE_QUEUE_TABLE = '''CREATE TABLE IF NOT EXISTS page_queue (
+                        id INTEGER PRIMARY KEY,
+                        document TEXT NOT NULL,
+                        seq INTEGER NOT NULL,
+                        page_start INTEGER NOT NULL,
+                        page_end INTEGER NOT NULL,
+                        pages TEXT NOT NULL,
+                        token_limit INTEGER NOT NULL,
+                        token_count INTEGER NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        lease_owner TEXT,
+                        lease_expiry REAL,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        updated REAL NOT NULL,
+                        UNIQUE (document, seq)
+                    )'''
+
+def init_work_queue(conn):
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA busy_timeout=30000')
+    migrate_work_queue(conn)
+    conn.execute(PAGE_QUEUE_TABLE)
+    conn.execute('CREATE INDEX IF NOT EXISTS page_queue_claim ON page_queue (status, lease_expiry, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS page_queue_document ON page_queue (document, status)')
+    conn.commit()
+    return conn
+
+#Queues made before the packer have a batch per run of whole pages, page_start to page_end, and no seq or pages
+#columns. Rebuild the table in the current layout, each old batch becoming a pages list of that run with no parts
+#(whole pages are never split again, so the token_limit they were packed to doesn't matter) and keeping its id,
+#status, lease and attempts.
+def migrate_work_queue(conn):
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(page_queue)')]
+    if not columns or 'pages' in columns:
+        return
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('''SELECT id, document, page_start, page_end, token_count, status, lease_owner, lease_expiry, attempts, updated
+                               FROM page_queue ORDER BY document, page_start''').fetchall()
+        conn.execute('ALTER TABLE page_queue RENAME TO page_queue_old')
+        conn.execute(PAGE_QUEUE_TABLE)
+        seqs = {}
+        migrated = []
+        for batch_id, document, page_start, page_end, token_count, status, lease_owner, lease_expiry, attempts, updated in rows:
+            seq = seqs[document] = seqs.get(document, -1) + 1
+            pages = [[page_number, 0] for page_number in range(page_start, page_end + 1)]
+            migrated.append((batch_id, document, seq, page_start, page_end, json.dumps(pages), token_count, token_count, status,
+                             lease_owner, lease_expiry, attempts, updated))
+        conn.executemany('''INSERT INTO page_queue (id, document, seq, page_start, page_end, pages, token_limit, token_count, status,
+                                                    lease_owner, lease_expiry, attempts, updated)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', migrated)
+        #The old indexes went with the renamed table, init_work_queue makes them again on the new one
+        conn.execute('DROP TABLE page_queue_old')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info(f'Migrated {len(rows)} batches in page_queue to the packed batch layout')
+
+def worker_name():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+def document_queued(conn, document):
+    return conn.execute('SELECT 1 FROM page_queue WHERE document = ? LIMIT 1', (document,)).fetchone() is not None
+
+#Queue the packed batches for a document, once. Returns the number of batches added.
+def enqueue_document(conn, document, batches, token_limit):
+    if document_queued(conn, document):
+        return 0
+
+    now = time.time()
+    rows = []
+    for seq, batch in enumerate(batches):
+        pages = [[page["page_number"], page.get("part", 0)] for page in batch["pages"]]
+        rows.append((document, seq, pages[0][0], pages[-1][0], json.dumps(pages), token_limit, batch["token_count"], now))
+
+    conn.executemany('''INSERT OR IGNORE INTO page_queue (document, seq, page_start, page_end, pages, token_limit, token_count, updated)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    conn.commit()
+    logger.info(f'Queued {len(rows)} batches for {document}')
+    return len(rows)
+
+#Take the lease on the oldest batch that is pending or whose lease has run out.
+#BEGIN IMMEDIATE takes the write lock up front so two workers can't claim the same row.
+def claim_batch(conn, owner=None, lease=lease_seconds):
+    owner = owner or worker_name()
+    now = time.time()
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('''SELECT id, document, page_start, page_end, pages, token_limit, token_count, attempts FROM page_queue
+                              WHERE status = 'pending' OR (status = 'leased' AND lease_expiry < ?)
+                              ORDER BY id LIMIT 1''', (now,)).fetchone()
+        if row is None:
+            conn.commit()
+            return None
+
+        conn.execute('''UPDATE page_queue SET status = 'leased', lease_owner = ?, lease_expiry = ?, attempts = attempts + 1, updated = ?
+                        WHERE id = ?''', (owner, now + lease, now, row[0]))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    batch = dict(zip(("id", "document", "page_start", "page_end", "pages", "token_limit", "token_count", "attempts"), row))
+    batch["pages"] = json.loads(batch["pages"])
+    batch["attempts"] += 1
+    batch["lease_owner"] = owner
+    logger.debug(f'{owner} claimed batch {batch["id"]} pages {batch["page_start"]}-{batch["page_end"]} of {batch["document"]}')
+    return batch
+
+#Returns False if the lease had already been lost to another worker.
+def renew_lease(conn, batch, lease=lease_seconds):
+    now = time.time()
+    cursor = conn.execute('''UPDATE page_queue SET lease_expiry = ?, updated = ?
+                             WHERE id = ? AND status = 'leased' AND lease_owner = ?''',
+                          (now + lease, now, batch["id"], batch["lease_owner"]))
+    conn.commit()
+    return cursor.rowcount == 1
+
+def complete_batch(conn, batch):
+    cursor = conn.execute('''UPDATE page_queue SET status = 'done', lease_expiry = NULL, updated = ?
+                             WHERE id = ? AND status = 'leased' AND lease_owner = ?''',
+                          (time.time(), batch["id"], batch["lease_owner"]))
+    conn.commit()
+    return cursor.rowcount == 1
+
+#Hand a batch back so another worker can pick it up straight away.
+def release_batch(conn, batch):
+    cursor = conn.execute('''UPDATE page_queue SET status = 'pending', lease_owner = NULL, lease_expiry = NULL, updated = ?
+                             WHERE id = ? AND status = 'leased' AND lease_owner = ?''',
+                          (time.time(), batch["id"], batch["lease_owner"]))
+    conn.commit()
+    return cursor.rowcount == 1
+
+#Give up on a batch that has failed too many times. It is never claimed again, so its document stays in the pre
+#processed directory until it is forgotten and queued afresh.
+def fail_batch(conn, batch):
+    cursor = conn.execute('''UPDATE page_queue SET status = 'failed', lease_owner = NULL, lease_expiry = NULL, updated = ?
+                             WHERE id = ? AND status = 'leased' AND lease_owner = ?''',
+                          (time.time(), batch["id"], batch["lease_owner"]))
+    conn.commit()
+    return cursor.rowcount == 1
+
+def document_done(conn, document):
+    row = conn.execute("SELECT COUNT(*) FROM page_queue WHERE document = ? AND status != 'done'", (document,)).fetchone()
+    return row[0] == 0
+
+#Drop a finished document from the queue so a new version with the same name can be queued again.
+def forget_document(conn, document):
+    conn.execute('DELETE FROM page_queue WHERE document = ?', (document,))
+    conn.commit()
+
+def queue_status(conn):
+    status = {}
+    for document, batch_status, count in conn.execute('SELECT document, status, COUNT(*) FROM page_queue GROUP BY document, status'):
+        status.setdefault(document, {})[batch_status] = count
+    return status